@@ -2,13 +2,173 @@
 # Placeholder for audio+image to video (avatar generation) logic 
 import time
 import os
+import io
+import hashlib
 import tempfile
-from typing import Tuple, Optional
+import threading
+from collections import OrderedDict
+from typing import Tuple, Optional, Union, BinaryIO, Callable, Any, Iterator
 
-def lazy_load_model():
+from backend import fmp4, metrics, models, wav
+from backend.cache import DiskCache, cache_key
+from backend.live_video import LiveVideo, LiveVideoRegistry
+
+# Audio/image inputs may be file paths, bytes or buffers already held in memory
+# (e.g. memoryviews of spooled uploads), or open binary files
+MediaInput = Union[str, bytes, bytearray, memoryview, BinaryIO]
+
+# Settings that change the rendered output; part of every video cache key
+MODEL_SETTINGS = {"model": "sample", "resolution": 720, "fps": 25, "container": "fmp4"}
+
+# Videos are written as fragmented MP4, one fragment per this many seconds of frames;
+# a client can start playing as soon as the first fragment is written
+FRAGMENT_SECONDS = float(os.getenv("AVATAR_FRAGMENT_S", 0.5))
+# Pace the placeholder renderer at this many frames per second (0 = as fast as it can),
+# to see progressive streaming behave as it will with a real model
+PLACEHOLDER_RENDER_FPS = float(os.getenv("AVATAR_PLACEHOLDER_RENDER_FPS", 0))
+SAMPLE_VIDEO_PATH = "backend/sample_avatar.mp4"
+
+# Rendered videos, content-addressed by audio + image digest + MODEL_SETTINGS
+video_cache = DiskCache(
+    os.getenv("AVATAR_CACHE_DIR", os.path.join(tempfile.gettempdir(), "daylily_avatar_cache")),
+    max_bytes=int(float(os.getenv("AVATAR_CACHE_MAX_MB", 1024)) * 1024 * 1024),
+    suffix=".mp4"
+)
+
+metrics.register_cache("video", video_cache)
+
+# Renders in progress, streamed to clients while they are written
+live_videos = LiveVideoRegistry(video_cache)
+
+# Per-identity preprocessing hooks, set by lazy_load_model once the talking-head
+# model is wired in. face_detector(rgb_array) -> (x0, y0, x1, y1) face box or None;
+# landmark_detector(face_crop) -> landmarks; identity_encoder(face_crop) -> latent features.
+face_detector: Optional[Callable[[Any], Any]] = None
+landmark_detector: Optional[Callable[[Any], Any]] = None
+identity_encoder: Optional[Callable[[Any], Any]] = None
+
+FACE_CROP_SIZE = 256
+# Larger portraits are rejected before their pixels are decoded
+MAX_IMAGE_PIXELS = int(os.getenv("AVATAR_MAX_IMAGE_PIXELS", 4096 * 4096))
+
+def _load_model():
     """Placeholder for model loading - no actual model needed for test"""
     pass
 
+# The placeholder renderer holds no weights
+models.registry.register("avatar", _load_model, footprint=lambda: 0)
+
+def lazy_load_model():
+    models.ensure("avatar")
+
+class AvatarIdentity:
+    """A registered avatar portrait and everything precomputed from it."""
+    __slots__ = ("avatar_id", "digest", "image_bytes", "face_crop", "landmarks", "features", "created_at")
+
+    def __init__(self, digest: str, image_bytes: bytes, face_crop=None, landmarks=None, features=None):
+        self.avatar_id = digest[:32]
+        self.digest = digest
+        self.image_bytes = image_bytes
+        self.face_crop = face_crop
+        self.landmarks = landmarks
+        self.features = features
+        self.created_at = time.time()
+
+class InvalidImageError(ValueError):
+    """The uploaded portrait could not be decoded as an image."""
+
+def preprocess_image(image_bytes: bytes, digest: Optional[str] = None) -> AvatarIdentity:
+    """
+    Decode the portrait, crop the face (center square until a face_detector is loaded),
+    resize it to FACE_CROP_SIZE and run the landmark/encoder hooks once.
+    digest is the sha256 of image_bytes, if the caller already has it.
+    Raises InvalidImageError if image_bytes isn't an image PIL can read.
+    """
+    digest = digest or hashlib.sha256(image_bytes).hexdigest()
+    try:
+        import numpy as np
+        from PIL import Image
+    except ImportError:
+        return AvatarIdentity(digest, image_bytes)
+    try:
+        img = Image.open(io.BytesIO(image_bytes))
+        # Image.open only reads the header; refuse huge images before decoding the pixels
+        if img.width * img.height > MAX_IMAGE_PIXELS:
+            raise InvalidImageError(f"Image is {img.width}x{img.height}; at most {MAX_IMAGE_PIXELS} pixels are allowed")
+        img = img.convert("RGB")
+    except InvalidImageError:
+        raise
+    except (OSError, ValueError, SyntaxError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and truncated files are OSErrors; some decoders raise
+        # ValueError or SyntaxError on corrupt data
+        raise InvalidImageError(str(e)) from e
+    box = face_detector(np.asarray(img)) if face_detector else None
+    if box is None:
+        side = min(img.size)
+        left, top = (img.width - side) // 2, (img.height - side) // 2
+        box = (left, top, left + side, top + side)
+    face_crop = np.asarray(img.crop(box).resize((FACE_CROP_SIZE, FACE_CROP_SIZE)))
+    landmarks = landmark_detector(face_crop) if landmark_detector else None
+    features = identity_encoder(face_crop) if identity_encoder else None
+    return AvatarIdentity(digest, image_bytes, face_crop, landmarks, features)
+
+class IdentityRegistry:
+    """Thread-safe LRU of preprocessed avatar identities, keyed by avatar_id."""
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._items: "OrderedDict[str, AvatarIdentity]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, avatar_id: str) -> Optional[AvatarIdentity]:
+        with self._lock:
+            identity = self._items.get(avatar_id)
+            if identity is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(avatar_id)
+            self.hits += 1
+            return identity
+
+    def register(self, image_bytes: Union[bytes, memoryview], digest: Optional[str] = None) -> AvatarIdentity:
+        """
+        Preprocess and store a portrait; re-registering the same bytes reuses the entry.
+        digest is the sha256 of image_bytes, if the caller already has it.
+        """
+        digest = digest or hashlib.sha256(image_bytes).hexdigest()
+        existing = self.get(digest[:32])
+        if existing is not None:
+            return existing
+        # The identity outlives the request, so it keeps its own copy of a borrowed buffer
+        identity = preprocess_image(bytes(image_bytes), digest)
+        with self._lock:
+            self._items[identity.avatar_id] = identity
+            self._items.move_to_end(identity.avatar_id)
+            while len(self._items) > self.max_entries:
+                self._items.popitem(last=False)
+                self.evictions += 1
+        return identity
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._items),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+identity_registry = IdentityRegistry(int(os.getenv("AVATAR_IDENTITY_CACHE_SIZE", 64)))
+
+def register_avatar_image(image_bytes: Union[bytes, memoryview], digest: Optional[str] = None) -> AvatarIdentity:
+    return identity_registry.register(image_bytes, digest)
+
+def get_avatar_identity(avatar_id: str) -> Optional[AvatarIdentity]:
+    return identity_registry.get(avatar_id)
+
 def create_default_avatar_image():
     """Create a simple default avatar image if none exists."""
     default_path = "backend/default_avatar.png"
@@ -30,43 +190,195 @@ def create_default_avatar_image():
                 f.write("Default avatar placeholder")
     return default_path
 
-def create_test_video():
-    """Create a simple test video file for demonstration."""
-    # Create a more substantial MP4 video file that browsers can actually play
-    # This includes proper MP4 structure with moov and mdat boxes
-    mp4_data = (
-        # File type box
-        b'\x00\x00\x00\x20ftypmp41'
-        b'\x00\x00\x00\x00mp41isom'
-        
-        # Movie box (moov)
-        b'\x00\x00\x00\x5Cmoov'
-        b'\x00\x00\x00\x2Cmvhd'
-        b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        b'\x00\x00\x03\xE8\x00\x00\x00\x00\x00\x01\x00\x00'
-        b'\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        
-        # Track box (trak)
-        b'\x00\x00\x00\x2Ctrak'
-        b'\x00\x00\x00\x20tkhd'
-        b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        b'\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00'
-        
-        # Media data box (mdat) - contains actual video data
-        b'\x00\x00\x00\x08mdat'
-        b'\x00\x00\x00\x00'  # Empty video data (1 frame)
-    )
-    return mp4_data
-
-def generate_avatar(audio_path: str, image_path: Optional[str] = None) -> Tuple[str, float]:
+_sample_track: Optional[fmp4.VideoTrack] = None
+_sample_lock = threading.Lock()
+
+def sample_track() -> fmp4.VideoTrack:
+    """The video track of SAMPLE_VIDEO_PATH, parsed once; its frames stand in for rendered ones."""
+    global _sample_track
+    with _sample_lock:
+        if _sample_track is None:
+            with open(SAMPLE_VIDEO_PATH, "rb") as f:
+                _sample_track = fmp4.read_video_track(f.read())
+        return _sample_track
+
+class RenderCancelled(Exception):
+    """Raised inside a render whose cancel event was set; the partial video is discarded."""
+
+def _placeholder_frames(
+    track: fmp4.VideoTrack,
+    num_frames: int,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[threading.Event] = None
+) -> Iterator[fmp4.Sample]:
+    """num_frames encoded frames, looping the sample clip (it starts on a keyframe, so the loop decodes cleanly)."""
+    interval = 1.0 / PLACEHOLDER_RENDER_FPS if PLACEHOLDER_RENDER_FPS > 0 else 0.0
+    for i in range(num_frames):
+        if cancel is not None and cancel.is_set():
+            raise RenderCancelled()
+        if interval:
+            time.sleep(interval)
+        yield track.samples[i % len(track.samples)]
+        if progress is not None:
+            progress(i + 1, num_frames)
+
+def render_fragments(
+    audio: MediaInput,
+    image=None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[threading.Event] = None
+) -> Iterator[bytes]:
+    """
+    The talking-head video for audio as fragmented MP4: the init segment, then a
+    moof+mdat fragment every FRAGMENT_SECONDS of frames, each yielded as soon as
+    its frames exist. One frame per 1/fps of audio (the whole clip if audio isn't WAV).
+    progress(frames_done, total_frames) is called after every frame; setting cancel
+    stops the render with RenderCancelled before the next one.
+    Placeholder: frames come from the sample clip; a real model would encode each
+    generated frame here (keeping a keyframe at the start of every fragment).
+    """
+    track = sample_track()
+    num_frames = audio_frame_count(audio) or len(track.samples)
+    frames = _placeholder_frames(track, num_frames, progress, cancel)
+    return fmp4.fragmented(track, frames, max(1, int(track.timescale * FRAGMENT_SECONDS)))
+
+def create_test_video(seconds: float = 1.0) -> bytes:
+    """A short, playable fragmented MP4 (the start of the sample clip) for demos and tests."""
+    track = sample_track()
+    num_frames = max(1, int(round(seconds * MODEL_SETTINGS["fps"])))
+    frames = (track.samples[i % len(track.samples)] for i in range(num_frames))
+    return b"".join(fmp4.fragmented(track, frames, max(1, int(track.timescale * FRAGMENT_SECONDS))))
+
+def media_digest(media: Optional[Union[MediaInput, AvatarIdentity]]) -> str:
+    """sha256 of a path, bytes or file object's content; file objects are rewound afterwards."""
+    if media is None:
+        return "default"
+    if isinstance(media, AvatarIdentity):
+        return media.digest
+    h = hashlib.sha256()
+    if isinstance(media, (bytes, bytearray, memoryview)):
+        h.update(media)
+    elif isinstance(media, str):
+        with open(media, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                h.update(block)
+    else:
+        media.seek(0)
+        for block in iter(lambda: media.read(1024 * 1024), b""):
+            h.update(block)
+        media.seek(0)
+    return h.hexdigest()
+
+def video_cache_key(audio: MediaInput, image: Optional[Union[MediaInput, AvatarIdentity]] = None) -> str:
+    return video_cache_key_for(media_digest(audio), media_digest(image))
+
+def video_cache_key_for(audio_digest: str, image_digest: str) -> str:
+    """video_cache_key from already computed media digests ("default" for no image)."""
+    settings = ",".join(f"{k}={v}" for k, v in sorted(MODEL_SETTINGS.items()))
+    return cache_key("video", settings, audio_digest, image_digest)
+
+def audio_frame_count(audio: MediaInput) -> Optional[int]:
+    """Number of video frames needed to cover a WAV input at MODEL_SETTINGS["fps"], or None if it isn't PCM WAV."""
+    if not isinstance(audio, (str, bytes, bytearray, memoryview)):
+        audio.seek(0)
+        data = audio.read()
+        audio.seek(0)
+    else:
+        data = audio
+    info = wav.read_info(data)
+    if info is None:
+        return None
+    return max(1, int(round(info[2] * MODEL_SETTINGS["fps"])))
+
+def cached_video_path(key: str) -> Optional[str]:
+    """Path of a previously rendered video for key, or None."""
+    return video_cache.get_path(key)
+
+def live_video(key: str) -> Optional[LiveVideo]:
+    """The in-progress render for key, if there is one."""
+    return live_videos.get(key)
+
+def generate_avatar(
+    audio: MediaInput,
+    image: Optional[Union[MediaInput, AvatarIdentity]] = None,
+    key: Optional[str] = None,
+    on_start: Optional[Callable[[LiveVideo], None]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[threading.Event] = None
+) -> Tuple[str, float]:
     """
     Generate a 720p, 24+ FPS MP4 video with lip-sync using SadTalker.
-    For now, returns a real sample video for testing.
+    audio and image may be paths or in-memory buffers (TTS output from /converse,
+    spooled uploads from /generate-avatar);
+    image may also be a registered AvatarIdentity, whose precomputed face crop,
+    landmarks and features are reused instead of preprocessing the portrait again.
+    Identical (audio, image) pairs are served from video_cache instead of re-rendering;
+    callers that already computed video_cache_key and checked the cache pass it as key.
+    The video is written fragment by fragment into a LiveVideo that clients can stream
+    while rendering continues; on_start receives it before the first frame. A request
+    for a video that is already rendering shares that render instead of starting another.
+    progress is called after every rendered frame (a shared render can't report progress).
+    Setting cancel raises RenderCancelled for this caller, but the render only stops once
+    every caller sharing it has cancelled; until then the caller that started it keeps
+    rendering for the others. Returns the cached path once the whole video is written.
     """
-    import time
     start_time = time.time()
-    sample_video_path = "backend/sample_avatar.mp4"
+    if key is None:
+        key = video_cache_key(audio, image)
+        cached = video_cache.get_path(key)
+        if cached:
+            return cached, round(time.time() - start_time, 2)
+    live, created = live_videos.start(key)
+    released = False
+
+    def release():
+        nonlocal released
+        if not released:
+            released = True
+            live_videos.release(live)
+
+    try:
+        if on_start is not None:
+            on_start(live)
+        if not created:
+            while not live.wait_finished(0.5):
+                if cancel is not None and cancel.is_set():
+                    raise RenderCancelled()
+            if live.error is not None:
+                raise RuntimeError(f"Avatar render failed: {live.error}")
+            return live.path, round(time.time() - start_time, 2)
+
+        def on_frame(done: int, total: int):
+            # A caller that cancels stops being a consumer; the render itself only stops
+            # (via live.stop) once nobody else shares it
+            if cancel is not None and cancel.is_set():
+                release()
+                return
+            if progress is not None:
+                try:
+                    progress(done, total)
+                except Exception:
+                    if cancel is None or not cancel.is_set():
+                        raise
+                    release()
+
+        try:
+            # Rendering and fragment encoding are interleaved, so they are timed together
+            with metrics.phase("avatar", "inference"):
+                for chunk in render_fragments(audio, image, on_frame, live.stop):
+                    live.write(chunk)
+        except BaseException as e:
+            live_videos.finish(live, e)
+            if not isinstance(e, RenderCancelled):
+                metrics.error("avatar_render")
+            raise
+        video_path = live_videos.finish(live)
+    finally:
+        release()
+    if video_path is None:
+        raise RuntimeError(f"Avatar render failed: {live.error}")
+    if cancel is not None and cancel.is_set():
+        # Finished for the callers sharing it (and cached), but this caller gave up on it
+        raise RenderCancelled()
     latency = round(time.time() - start_time, 2)
-    return sample_video_path, latency 
\ No newline at end of file
+    return video_path, latency
@@ -0,0 +1,108 @@
+# backend/batching.py
+# Micro-batching scheduler: coalesce concurrent model calls into one batched call
+import contextvars
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List
+
+from backend import tracing
+
+
+class MicroBatcher:
+    """
+    Collects items submitted from many threads for up to max_wait_ms (or until
+    max_batch_size items are waiting), runs them through run_batch(items) as one
+    call, and fans the results back out to each submitter's Future.
+    run_batch must return one result per item, in order; an Exception in place of a
+    result fails only that item's Future. If run_batch itself raises, every item in
+    the batch gets the error. Each submitter's trace gets the time its item waited
+    for a batch and the batch's own run time.
+    """
+    def __init__(
+        self,
+        name: str,
+        run_batch: Callable[[List[Any]], List[Any]],
+        max_batch_size: int,
+        max_wait_ms: float
+    ):
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name=f"batcher-{self.name}", daemon=True)
+                self._thread.start()
+
+    def submit(self, item: Any) -> Future:
+        """Queue an item; the returned Future resolves once its batch has run."""
+        self._ensure_started()
+        future: Future = Future()
+        self._queue.put((item, future, contextvars.copy_context(), time.perf_counter()))
+        return future
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = [entry for entry in self._collect() if entry[1].set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            with self._stats_lock:
+                self.batches += 1
+                self.items += len(batch)
+                self.max_seen = max(self.max_seen, len(batch))
+            started = time.perf_counter()
+            try:
+                results = self.run_batch([item for item, _, _, _ in batch])
+            except Exception as e:
+                results = None
+                error = e
+            finished = time.perf_counter()
+            for _, _, context, submitted in batch:
+                context.run(tracing.record, f"{self.name}.batch_wait", submitted, started)
+                context.run(tracing.record, f"{self.name}.batch", started, finished, size=len(batch))
+            if results is None:
+                for _, future, _, _ in batch:
+                    future.set_exception(error)
+                continue
+            for (_, future, _, _), result in zip(batch, results):
+                if isinstance(result, Exception):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "max_batch_size": self.max_batch_size,
+                "max_wait_ms": self.max_wait * 1000.0,
+                "batches": self.batches,
+                "items": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "largest_batch": self.max_seen,
+            }
@@ -0,0 +1,172 @@
+# backend/executor.py
+# Bounded per-stage worker pools for blocking model inference
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from backend import metrics, tracing
+
+QUEUE_WAIT_SECONDS = metrics.registry.histogram(
+    "daylily_stage_queue_wait_seconds", "Time jobs waited for a stage worker.", ("endpoint", "stage")
+)
+COMPUTE_SECONDS = metrics.registry.histogram(
+    "daylily_stage_compute_seconds", "Time jobs ran on a stage worker.", ("endpoint", "stage")
+)
+
+class QueueFullError(Exception):
+    """Raised when a stage already has as many jobs as it is allowed to hold."""
+    def __init__(self, stage: str, retry_after: int):
+        super().__init__(f"Stage '{stage}' is at capacity, retry in {retry_after}s")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class StageExecutor:
+    """
+    Runs blocking calls for one pipeline stage (transcribe, speak, avatar) on a
+    dedicated thread pool so the event loop stays responsive.
+    At most max_workers jobs run at once and at most max_queue more may wait;
+    anything beyond that is rejected with QueueFullError.
+    """
+    def __init__(self, name: str, max_workers: int, max_queue: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"stage-{name}")
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.completed = 0
+        self.failed = 0
+        self.rejected = 0
+        self.queue_wait_total = 0.0
+        self.queue_wait_max = 0.0
+        self.compute_total = 0.0
+        self.compute_max = 0.0
+
+    def _record(self, queue_wait: float, compute: float, ok: bool):
+        endpoint = metrics.current_endpoint()
+        QUEUE_WAIT_SECONDS.observe(queue_wait, endpoint=endpoint, stage=self.name)
+        COMPUTE_SECONDS.observe(compute, endpoint=endpoint, stage=self.name)
+        with self._lock:
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+            self.queue_wait_total += queue_wait
+            self.queue_wait_max = max(self.queue_wait_max, queue_wait)
+            self.compute_total += compute
+            self.compute_max = max(self.compute_max, compute)
+
+    def _release(self, _future):
+        with self._lock:
+            self._pending -= 1
+
+    def retry_after(self) -> int:
+        """Rough number of seconds until a slot frees up, based on average compute time."""
+        with self._lock:
+            finished = self.completed + self.failed
+            avg = self.compute_total / finished if finished else 1.0
+            backlog = max(self._pending - self.max_workers + 1, 1)
+        return max(1, math.ceil(avg * backlog / self.max_workers))
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Queue fn(*args, **kwargs) on the stage pool; raises QueueFullError if the stage is full."""
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                full = True
+            else:
+                self._pending += 1
+                full = False
+        if full:
+            raise QueueFullError(self.name, self.retry_after())
+
+        enqueued = time.perf_counter()
+
+        def job():
+            started = time.perf_counter()
+            with self._lock:
+                self._running += 1
+            tracing.record(f"{self.name}.queue", enqueued, started)
+            ok = False
+            try:
+                with tracing.span(f"{self.name}.run"):
+                    result = fn(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                with self._lock:
+                    self._running -= 1
+                self._record(started - enqueued, time.perf_counter() - started, ok)
+
+        # The job sees the submitting request's context (its endpoint for metrics, its trace)
+        future = self._pool.submit(contextvars.copy_context().run, job)
+        # Release the slot when the job finishes or is cancelled before it starts,
+        # not when the awaiting request goes away.
+        future.add_done_callback(self._release)
+        return future
+
+    async def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Run fn(*args, **kwargs) on the stage pool and await its result."""
+        return await asyncio.wrap_future(self.submit(fn, *args, **kwargs))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            finished = self.completed + self.failed
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "running": self._running,
+                "queued": self._pending - self._running,
+                "completed": self.completed,
+                "failed": self.failed,
+                "rejected": self.rejected,
+                "queue_wait_avg": round(self.queue_wait_total / finished, 4) if finished else 0.0,
+                "queue_wait_max": round(self.queue_wait_max, 4),
+                "compute_avg": round(self.compute_total / finished, 4) if finished else 0.0,
+                "compute_max": round(self.compute_max, 4),
+            }
+
+
+def _stage_from_env(name: str, default_workers: int, default_queue: int) -> StageExecutor:
+    prefix = name.upper()
+    workers = int(os.getenv(f"{prefix}_WORKERS", default_workers))
+    max_queue = int(os.getenv(f"{prefix}_MAX_QUEUE", default_queue))
+    return StageExecutor(name, max(1, workers), max(0, max_queue))
+
+
+# One executor per pipeline stage, sized via <STAGE>_WORKERS / <STAGE>_MAX_QUEUE
+stages: Dict[str, StageExecutor] = {
+    # Transcribe workers mostly wait on the Whisper micro-batcher, so allow as many as a batch
+    # holds; without batching each worker runs its own Whisper call, so keep one
+    "transcribe": _stage_from_env("transcribe", max(1, int(os.getenv("WHISPER_BATCH_SIZE", 4))), 16),
+    "speak": _stage_from_env("speak", 1, 16),
+    "avatar": _stage_from_env("avatar", 1, 8),
+}
+
+metrics.registry.callback(
+    "daylily_stage_running", "Jobs running on each stage's workers.", "gauge",
+    lambda: [((name,), stage.stats()["running"]) for name, stage in stages.items()], ("stage",)
+)
+metrics.registry.callback(
+    "daylily_stage_queued", "Jobs waiting for each stage's workers.", "gauge",
+    lambda: [((name,), stage.stats()["queued"]) for name, stage in stages.items()], ("stage",)
+)
+metrics.registry.callback(
+    "daylily_stage_rejected_total", "Jobs turned away because a stage's queue was full.", "counter",
+    lambda: [((name,), stage.rejected) for name, stage in stages.items()], ("stage",)
+)
+
+
+def get_stage(name: str) -> StageExecutor:
+    return stages[name]
+
+
+def get_stage_stats() -> Dict[str, Dict[str, Any]]:
+    return {name: stage.stats() for name, stage in stages.items()}
@@ -0,0 +1,242 @@
+# backend/fmp4.py
+# Minimal MP4 (ISO BMFF) video track reader and fragmented-MP4 writer for progressive playback
+import struct
+from typing import Iterable, Iterator, List, Optional, Tuple
+
+# trun sample_flags: sync samples depend on nothing; others depend on earlier samples and are not sync
+_SYNC_FLAGS = 0x02000000
+_NON_SYNC_FLAGS = 0x01010000
+_UNITY_MATRIX = struct.pack(">9I", 0x10000, 0, 0, 0, 0x10000, 0, 0, 0, 0x40000000)
+
+
+class Sample:
+    """One encoded video frame (an access unit) with its timing in track timescale units."""
+    __slots__ = ("data", "duration", "composition_offset", "sync")
+
+    def __init__(self, data, duration: int, composition_offset: int = 0, sync: bool = False):
+        self.data = data
+        self.duration = duration
+        self.composition_offset = composition_offset
+        self.sync = sync
+
+
+class VideoTrack:
+    """
+    The first video track of an MP4: its codec configuration (the stsd box, copied
+    verbatim into init segments), timescale, size and samples. Sample data are
+    memoryview slices of the file contents passed to read_video_track.
+    """
+    __slots__ = ("timescale", "width", "height", "stsd", "media_time", "samples")
+
+    def __init__(self, timescale: int, width: int, height: int, stsd: bytes, media_time: int, samples: List[Sample]):
+        self.timescale = timescale
+        self.width = width
+        self.height = height
+        self.stsd = stsd
+        self.media_time = media_time
+        self.samples = samples
+
+    @property
+    def duration(self) -> int:
+        return sum(s.duration for s in self.samples)
+
+
+# --- Reading ---
+
+def _boxes(data, start: int, end: int) -> Iterator[Tuple[bytes, int, int, int]]:
+    """(type, box start, payload start, box end) for each box in data[start:end]."""
+    while start + 8 <= end:
+        size, kind = struct.unpack_from(">I4s", data, start)
+        header = 8
+        if size == 1:
+            size = struct.unpack_from(">Q", data, start + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - start
+        if size < header:
+            raise ValueError(f"Invalid MP4 box size {size} at offset {start}")
+        yield kind, start, start + header, start + size
+        start += size
+
+
+def _find(data, start: int, end: int, *path: bytes) -> Optional[Tuple[int, int, int]]:
+    """(box start, payload start, box end) of the first box along path, or None."""
+    for kind, box_start, payload, box_end in _boxes(data, start, end):
+        if kind == path[0]:
+            if len(path) == 1:
+                return box_start, payload, box_end
+            return _find(data, payload, box_end, *path[1:])
+    return None
+
+
+def _table(data, box: Optional[Tuple[int, int, int]], fmt: str) -> List[tuple]:
+    """Entries of a full box that is a 32-bit count followed by fixed-size records."""
+    if box is None:
+        return []
+    payload = box[1] + 4
+    count = struct.unpack_from(">I", data, payload)[0]
+    size = struct.calcsize(fmt)
+    return [struct.unpack_from(fmt, data, payload + 4 + i * size) for i in range(count)]
+
+
+def read_video_track(data) -> VideoTrack:
+    """Parse the first video track of a (non-fragmented) MP4 held in memory."""
+    view = memoryview(data)
+    moov = _find(view, 0, len(view), b"moov")
+    if moov is None:
+        raise ValueError("No moov box; not an MP4 or already fragmented")
+    for kind, _, payload, end in _boxes(view, moov[1], moov[2]):
+        if kind != b"trak":
+            continue
+        hdlr = _find(view, payload, end, b"mdia", b"hdlr")
+        if hdlr is None or bytes(view[hdlr[1] + 8:hdlr[1] + 12]) != b"vide":
+            continue
+        return _read_track(view, payload, end)
+    raise ValueError("MP4 has no video track")
+
+
+def _read_track(view, start: int, end: int) -> VideoTrack:
+    tkhd = _find(view, start, end, b"tkhd")
+    width, height = struct.unpack_from(">II", view, tkhd[2] - 8)
+    mdhd = _find(view, start, end, b"mdia", b"mdhd")
+    version = view[mdhd[1]]
+    timescale = struct.unpack_from(">I", view, mdhd[1] + (20 if version == 1 else 12))[0]
+
+    media_time = 0
+    elst = _find(view, start, end, b"edts", b"elst")
+    if elst is not None:
+        entries = _table(view, elst, ">QqI" if view[elst[1]] == 1 else ">IiI")
+        media_time = max(0, entries[0][1]) if entries else 0
+
+    stbl = _find(view, start, end, b"mdia", b"minf", b"stbl")
+    box = lambda kind: _find(view, stbl[1], stbl[2], kind)  # noqa: E731
+    stsd = box(b"stsd")
+
+    durations = [delta for count, delta in _table(view, box(b"stts"), ">II") for _ in range(count)]
+    offsets = [offset for count, offset in _table(view, box(b"ctts"), ">Ii") for _ in range(count)]
+    stss = box(b"stss")
+    sync = {n for (n,) in _table(view, stss, ">I")} if stss is not None else None
+
+    stsz = box(b"stsz")
+    fixed_size, count = struct.unpack_from(">II", view, stsz[1] + 4)
+    sizes = [fixed_size] * count if fixed_size else list(struct.unpack_from(f">{count}I", view, stsz[1] + 12))
+
+    co64 = box(b"co64")
+    chunks = [c for (c,) in (_table(view, co64, ">Q") if co64 else _table(view, box(b"stco"), ">I"))]
+    stsc = _table(view, box(b"stsc"), ">III")
+
+    samples = []
+    n = 0
+    for i, (first_chunk, per_chunk, _) in enumerate(stsc):
+        last_chunk = stsc[i + 1][0] - 1 if i + 1 < len(stsc) else len(chunks)
+        for chunk in range(first_chunk, last_chunk + 1):
+            offset = chunks[chunk - 1]
+            for _ in range(per_chunk):
+                if n >= count:
+                    break
+                samples.append(Sample(
+                    view[offset:offset + sizes[n]],
+                    durations[n] if n < len(durations) else durations[-1],
+                    offsets[n] if n < len(offsets) else 0,
+                    sync is None or (n + 1) in sync
+                ))
+                offset += sizes[n]
+                n += 1
+    return VideoTrack(timescale, width >> 16, height >> 16, bytes(view[stsd[0]:stsd[2]]), media_time, samples)
+
+
+# --- Writing ---
+
+def _box(kind: bytes, *payload: bytes) -> bytes:
+    body = b"".join(payload)
+    return struct.pack(">I4s", 8 + len(body), kind) + body
+
+
+def _full_box(kind: bytes, version: int, flags: int, *payload: bytes) -> bytes:
+    return _box(kind, struct.pack(">I", (version << 24) | flags), *payload)
+
+
+def init_segment(track: VideoTrack, track_id: int = 1) -> bytes:
+    """ftyp + moov for a fragmented MP4 whose samples all arrive in later fragments."""
+    ftyp = _box(b"ftyp", b"iso5", struct.pack(">I", 512), b"iso5iso6mp41")
+    mvhd = _full_box(
+        b"mvhd", 0, 0,
+        struct.pack(">IIII", 0, 0, track.timescale, 0),
+        struct.pack(">IH", 0x10000, 0x100), bytes(10), _UNITY_MATRIX, bytes(24),
+        struct.pack(">I", track_id + 1)
+    )
+    tkhd = _full_box(
+        b"tkhd", 0, 3,
+        struct.pack(">IIIII", 0, 0, track_id, 0, 0), bytes(8),
+        struct.pack(">HHHH", 0, 0, 0, 0), _UNITY_MATRIX,
+        struct.pack(">II", track.width << 16, track.height << 16)
+    )
+    # Like ffmpeg's empty_moov output: skip the decoder delay introduced by B-frame reordering
+    edts = _box(b"edts", _full_box(b"elst", 0, 0, struct.pack(">IIiI", 1, 0, track.media_time, 0x10000))) \
+        if track.media_time else b""
+    mdhd = _full_box(b"mdhd", 0, 0, struct.pack(">IIIIHH", 0, 0, track.timescale, 0, 0x55C4, 0))
+    hdlr = _full_box(b"hdlr", 0, 0, struct.pack(">I4s", 0, b"vide"), bytes(12), b"VideoHandler\0")
+    stbl = _box(
+        b"stbl",
+        track.stsd,
+        _full_box(b"stts", 0, 0, struct.pack(">I", 0)),
+        _full_box(b"stsc", 0, 0, struct.pack(">I", 0)),
+        _full_box(b"stsz", 0, 0, struct.pack(">II", 0, 0)),
+        _full_box(b"stco", 0, 0, struct.pack(">I", 0)),
+    )
+    minf = _box(
+        b"minf",
+        _full_box(b"vmhd", 0, 1, bytes(8)),
+        _box(b"dinf", _full_box(b"dref", 0, 0, struct.pack(">I", 1), _full_box(b"url ", 0, 1))),
+        stbl
+    )
+    trak = _box(b"trak", tkhd, edts, _box(b"mdia", mdhd, hdlr, minf))
+    mvex = _box(b"mvex", _full_box(b"trex", 0, 0, struct.pack(">IIIII", track_id, 1, 0, 0, 0)))
+    return ftyp + _box(b"moov", mvhd, trak, mvex)
+
+
+def fragment(sequence: int, base_decode_time: int, samples: List[Sample], track_id: int = 1) -> bytes:
+    """moof + mdat carrying samples, which start at base_decode_time (track timescale units)."""
+    def moof(data_offset: int) -> bytes:
+        trun = _full_box(
+            b"trun", 1, 0xF01,  # data offset, per-sample duration, size, flags, composition offset
+            struct.pack(">Ii", len(samples), data_offset),
+            b"".join(
+                struct.pack(">IIIi", s.duration, len(s.data), _SYNC_FLAGS if s.sync else _NON_SYNC_FLAGS,
+                            s.composition_offset)
+                for s in samples
+            )
+        )
+        traf = _box(
+            b"traf",
+            _full_box(b"tfhd", 0, 0x20000, struct.pack(">I", track_id)),  # default-base-is-moof
+            _full_box(b"tfdt", 1, 0, struct.pack(">Q", base_decode_time)),
+            trun
+        )
+        return _box(b"moof", _full_box(b"mfhd", 0, 0, struct.pack(">I", sequence)), traf)
+
+    size = len(moof(0))
+    mdat_size = 8 + sum(len(s.data) for s in samples)
+    return moof(size + 8) + struct.pack(">I4s", mdat_size, b"mdat") + b"".join(s.data for s in samples)
+
+
+def fragmented(track: VideoTrack, samples: Iterable[Sample], fragment_duration: int) -> Iterator[bytes]:
+    """
+    The init segment, then one moof+mdat per fragment_duration (track timescale units)
+    of samples, each yielded as soon as its samples have arrived.
+    """
+    yield init_segment(track)
+    pending: List[Sample] = []
+    pending_duration = 0
+    decode_time = 0
+    sequence = 1
+    for sample in samples:
+        pending.append(sample)
+        pending_duration += sample.duration
+        if pending_duration >= fragment_duration:
+            yield fragment(sequence, decode_time, pending)
+            sequence += 1
+            decode_time += pending_duration
+            pending, pending_duration = [], 0
+    if pending:
+        yield fragment(sequence, decode_time, pending)
@@ -0,0 +1,417 @@
+# backend/jobs.py
+# Background job queue for long avatar renders: priorities, per-session fairness, progress, cancellation
+import asyncio
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import CancelledError, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from backend.executor import QueueFullError, StageExecutor, get_stage
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+FINISHED_STATES = (DONE, FAILED, CANCELLED)
+
+# Lower runs first
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class SessionJobLimitError(Exception):
+    """Raised when a session already has as many unfinished jobs as it may queue."""
+    def __init__(self, limit: int):
+        super().__init__(f"This session already has {limit} unfinished jobs")
+        self.limit = limit
+
+
+class JobCancelled(Exception):
+    """Raised by Job.report (and so inside the job function) once the job has been cancelled."""
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class Job:
+    """
+    One submitted job. fn(job) runs on the queue's stage; it reports progress with
+    job.report(done, total), which raises JobCancelled once cancellation was requested,
+    and may set job.result (a JSON-able dict) for clients as it goes.
+    on_finish(job) runs once the job reaches a finished state, whatever the outcome.
+    watched_at, if set, returns the monotonic time a client last followed the job some
+    other way than polling or SSE (e.g. by streaming its video); the sweeper counts it.
+    Coroutines wait for any change with wait_change(); version counts changes.
+    """
+    __slots__ = (
+        "id", "session_id", "priority", "fn", "on_finish", "state", "progress", "result", "error",
+        "created_at", "started_at", "finished_at", "last_seen", "watchers", "watched_at", "version",
+        "cancel_event", "_waiters"
+    )
+
+    def __init__(self, session_id: str, priority: str, fn: Callable[["Job"], Any],
+                 on_finish: Optional[Callable[["Job"], None]] = None):
+        self.id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.priority = priority
+        self.fn = fn
+        self.on_finish = on_finish
+        self.state = QUEUED
+        self.progress = 0.0
+        self.result: Dict[str, Any] = {}
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.last_seen = time.monotonic()
+        self.watchers = 0
+        self.watched_at: Optional[Callable[[], float]] = None
+        self.version = 0
+        self.cancel_event = threading.Event()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    @property
+    def finished(self) -> bool:
+        return self.state in FINISHED_STATES
+
+    def _changed(self):
+        # Safe from any thread: a waiter that registers after the swap below sees the new version
+        self.version += 1
+        waiters, self._waiters = self._waiters, []
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # the waiting loop has shut down
+
+    def report(self, done: int, total: int):
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+        self.progress = min(1.0, done / total) if total else 0.0
+        self._changed()
+
+    def update(self, **result):
+        """Merge result fields (e.g. the video URL once rendering starts) and notify watchers."""
+        self.result = dict(self.result, **result)
+        self._changed()
+
+    async def wait_change(self, version: int):
+        """Return once the job has changed since version (or immediately if it already has)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._waiters.append((loop, future))
+        if self.version != version:
+            _resolve(future)
+        await future
+
+    def last_watched(self) -> float:
+        """Monotonic time anyone last polled, watched or otherwise followed the job."""
+        if self.watched_at is None:
+            return self.last_seen
+        return max(self.last_seen, self.watched_at())
+
+    def to_dict(self, position: Optional[int] = None) -> Dict[str, Any]:
+        data = {
+            "job_id": self.id,
+            "state": self.state,
+            "priority": self.priority,
+            "progress": round(self.progress, 3),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+        }
+        if position is not None:
+            data["position"] = position
+        data.update(self.result)
+        return data
+
+
+class JobQueue:
+    """
+    Bounded queue of Jobs run on a StageExecutor by `workers` threads (so at most that
+    many occupy the stage at once, next to any synchronous requests using it).
+
+    Order: higher priority first; within a priority, sessions take turns (round robin
+    over the sessions with queued jobs, one job per turn), so one client submitting
+    many jobs can't starve the others. At most max_queued jobs wait in total and at most
+    max_per_session unfinished jobs per session.
+
+    Jobs nobody has polled, watched (SSE) or otherwise followed (Job.watched_at) for
+    abandon_after seconds are cancelled, so a client that goes away stops costing
+    compute; finished jobs are kept for retention seconds so their result can still
+    be fetched.
+    """
+    def __init__(
+        self,
+        stage: StageExecutor,
+        workers: int = 1,
+        max_queued: int = 32,
+        max_per_session: int = 4,
+        abandon_after: float = 60.0,
+        retention: float = 600.0,
+        sweep_interval: float = 5.0
+    ):
+        self.stage = stage
+        self.workers = max(1, workers)
+        self.max_queued = max_queued
+        self.max_per_session = max_per_session
+        self.abandon_after = abandon_after
+        self.retention = retention
+        self.sweep_interval = sweep_interval
+        self._cond = threading.Condition()
+        # One round-robin ring per priority: session_id -> its queued jobs, in turn order
+        self._levels: List["OrderedDict[str, deque]"] = [OrderedDict() for _ in PRIORITIES]
+        self._jobs: Dict[str, Job] = {}
+        self._unfinished: Dict[str, int] = {}
+        self._queued = 0
+        self._threads: List[threading.Thread] = []
+        self._start_lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.abandoned = 0
+        self.rejected = 0
+
+    def _ensure_workers(self):
+        if self._threads:
+            return
+        with self._start_lock:
+            if self._threads:
+                return
+            for i in range(self.workers):
+                t = threading.Thread(target=self._work, name=f"jobs-{self.stage.name}-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+            sweeper = threading.Thread(target=self._sweep_loop, name=f"jobs-{self.stage.name}-sweep", daemon=True)
+            sweeper.start()
+            self._threads.append(sweeper)
+
+    def submit(self, session_id: str, fn: Callable[[Job], Any], priority: str = "normal",
+               on_finish: Optional[Callable[[Job], None]] = None) -> Job:
+        """Queue fn as a job. Raises QueueFullError, SessionJobLimitError or ValueError (unknown priority)."""
+        if priority not in PRIORITIES:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}")
+        self._ensure_workers()
+        job = Job(session_id, priority, fn, on_finish)
+        with self._cond:
+            if self._queued >= self.max_queued:
+                self.rejected += 1
+                raise QueueFullError(f"{self.stage.name} jobs", self._retry_after())
+            if self._unfinished.get(session_id, 0) >= self.max_per_session:
+                self.rejected += 1
+                raise SessionJobLimitError(self.max_per_session)
+            ring = self._levels[PRIORITIES[priority]]
+            ring.setdefault(session_id, deque()).append(job)
+            self._jobs[job.id] = job
+            self._unfinished[session_id] = self._unfinished.get(session_id, 0) + 1
+            self._queued += 1
+            self.submitted += 1
+            self._cond.notify()
+        return job
+
+    def _retry_after(self) -> int:
+        return max(1, self.stage.retry_after() * max(1, self._queued) // self.workers)
+
+    def _next_locked(self) -> Optional[Job]:
+        for ring in self._levels:
+            if not ring:
+                continue
+            session_id, jobs = next(iter(ring.items()))
+            job = jobs.popleft()
+            # The session goes to the back of the ring (or leaves it if it has nothing else queued)
+            del ring[session_id]
+            if jobs:
+                ring[session_id] = jobs
+            self._queued -= 1
+            return job
+        return None
+
+    def position(self, job: Job) -> Optional[int]:
+        """How many queued jobs will start before job under the current order (None unless queued)."""
+        with self._cond:
+            if job.state != QUEUED:
+                return None
+            level = PRIORITIES[job.priority]
+            ahead = sum(len(jobs) for ring in self._levels[:level] for jobs in ring.values())
+            ring = self._levels[level]
+            own = ring.get(job.session_id)
+            if own is None or job not in own:
+                return None
+            turn = list(own).index(job)  # this session's turns before job's
+            seen_own = False
+            for session_id, jobs in ring.items():
+                if session_id == job.session_id:
+                    seen_own = True
+                    continue
+                # Sessions ahead in the ring get turn + 1 turns before job, those behind get turn
+                ahead += min(len(jobs), turn + (0 if seen_own else 1))
+            return ahead + turn
+
+    def get(self, job_id: str, seen: bool = True) -> Optional[Job]:
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is not None and seen:
+                job.last_seen = time.monotonic()
+            return job
+
+    def _finish_locked(self, job: Job, state: str, error: Optional[str] = None):
+        job.state = state
+        if error is not None:
+            job.error = error
+        job.finished_at = time.time()
+        remaining = self._unfinished.get(job.session_id, 1) - 1
+        if remaining > 0:
+            self._unfinished[job.session_id] = remaining
+        else:
+            self._unfinished.pop(job.session_id, None)
+        if state == DONE:
+            self.completed += 1
+            job.progress = 1.0
+        elif state == FAILED:
+            self.failed += 1
+        else:
+            self.cancelled += 1
+        job._changed()
+
+    def _run_on_finish(self, job: Job):
+        if job.on_finish is None:
+            return
+        try:
+            job.on_finish(job)
+        except Exception:
+            logging.exception(f"Job {job.id} cleanup failed")
+
+    def cancel(self, job_id: str, reason: Optional[str] = None) -> Optional[Job]:
+        """Cancel a job: a queued one is dropped at once, a running one stops at its next report()."""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None or job.finished:
+                return job
+            job.cancel_event.set()
+            if reason:
+                job.error = reason
+            if job.state != QUEUED:
+                return job
+            ring = self._levels[PRIORITIES[job.priority]]
+            jobs = ring.get(job.session_id)
+            if jobs is not None and job in jobs:
+                jobs.remove(job)
+                if not jobs:
+                    del ring[job.session_id]
+                self._queued -= 1
+            self._finish_locked(job, CANCELLED)
+        self._run_on_finish(job)
+        return job
+
+    def _execute(self, job: Job) -> Any:
+        """Run job.fn on the stage, waiting out a full stage and giving up once cancelled."""
+        while True:
+            if job.cancel_event.is_set():
+                raise JobCancelled()
+            try:
+                future = self.stage.submit(job.fn, job)
+                break
+            except QueueFullError as e:
+                job.cancel_event.wait(min(e.retry_after, 5))
+        while True:
+            try:
+                return future.result(timeout=0.5)
+            except FutureTimeout:
+                if job.cancel_event.is_set() and future.cancel():
+                    raise JobCancelled()
+            except CancelledError:
+                raise JobCancelled()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                job = self._next_locked()
+                while job is None:
+                    self._cond.wait()
+                    job = self._next_locked()
+                job.state = RUNNING
+                job.started_at = time.time()
+                job._changed()
+            state, error = DONE, None
+            try:
+                self._execute(job)
+            except JobCancelled:
+                state = CANCELLED
+            except Exception as e:
+                # Job functions may surface cancellation as their own exception type
+                state, error = (CANCELLED, None) if job.cancel_event.is_set() else (FAILED, str(e))
+                if state == FAILED:
+                    logging.warning(f"Job {job.id} failed: {e}")
+            with self._cond:
+                self._finish_locked(job, state, error)
+            self._run_on_finish(job)
+
+    def sweep(self) -> int:
+        """Cancel abandoned jobs and forget finished ones past retention. Returns how many were abandoned."""
+        now = time.monotonic()
+        abandoned = []
+        with self._cond:
+            for job in list(self._jobs.values()):
+                if job.finished:
+                    if job.finished_at is not None and time.time() - job.finished_at > self.retention:
+                        del self._jobs[job.id]
+                elif self.abandon_after and not job.watchers and now - job.last_watched() > self.abandon_after:
+                    abandoned.append(job.id)
+        for job_id in abandoned:
+            if self.cancel(job_id, "abandoned: no client polled or watched the job") is not None:
+                self.abandoned += 1
+        if abandoned:
+            logging.info(f"Cancelled {len(abandoned)} abandoned {self.stage.name} jobs")
+        return len(abandoned)
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception("Job sweep failed")
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            running = sum(1 for job in self._jobs.values() if job.state == RUNNING)
+            return {
+                "workers": self.workers,
+                "queued": self._queued,
+                "running": running,
+                "max_queued": self.max_queued,
+                "max_per_session": self.max_per_session,
+                "tracked": len(self._jobs),
+                "submitted": self.submitted,
+                "completed": self.completed,
+                "failed": self.failed,
+                "cancelled": self.cancelled,
+                "abandoned": self.abandoned,
+                "rejected": self.rejected,
+            }
+
+
+def _queue_from_env(stage_name: str) -> JobQueue:
+    """<STAGE>_JOB_WORKERS (default: the stage's workers), <STAGE>_JOB_MAX_QUEUE, <STAGE>_JOB_MAX_PER_SESSION, JOB_ABANDON_S, JOB_RETENTION_S."""
+    stage = get_stage(stage_name)
+    prefix = stage_name.upper()
+    return JobQueue(
+        stage,
+        workers=int(os.getenv(f"{prefix}_JOB_WORKERS", stage.max_workers)),
+        max_queued=int(os.getenv(f"{prefix}_JOB_MAX_QUEUE", 32)),
+        max_per_session=int(os.getenv(f"{prefix}_JOB_MAX_PER_SESSION", 4)),
+        abandon_after=float(os.getenv("JOB_ABANDON_S", 60)),
+        retention=float(os.getenv("JOB_RETENTION_S", 600)),
+    )
+
+
+# Render jobs submitted via POST /jobs/avatar
+avatar_jobs = _queue_from_env("avatar")
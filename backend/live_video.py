@@ -0,0 +1,205 @@
+# backend/live_video.py
+# Videos still being rendered, streamed to clients while their file grows
+import asyncio
+import os
+import threading
+import time
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+from backend.cache import DiskCache
+
+STREAM_CHUNK_BYTES = 64 * 1024
+
+
+def _resolve(future: asyncio.Future):
+    if not future.done():
+        future.set_result(None)
+
+
+class LiveVideo:
+    """
+    A render in progress. The renderer thread appends chunks (for fragmented MP4:
+    the init segment, then one moof+mdat per fragment) to a temp file in the video
+    cache and commits it under key when done. Meanwhile any number of clients can
+    stream it: they read what has been written so far and wait for more.
+    Threads wait with wait_finished(), coroutines with wait() / finished().
+    consumers counts the callers sharing the render (see LiveVideoRegistry.start);
+    the renderer checks stop, which is set once the last of them has cancelled.
+    readers counts clients currently streaming or waiting for the video (watched_at()).
+    """
+    def __init__(self, key: str, cache: DiskCache):
+        self.key = key
+        self.cache = cache
+        self.path = cache.temp_path()
+        self.written = 0
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.consumers = 0
+        self.stop = threading.Event()
+        self.readers = 0
+        self.last_read = time.monotonic()
+        self._file = open(self.path, "wb")
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        self._waiters: List[Tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _wake(self, waiters):
+        for loop, future in waiters:
+            try:
+                loop.call_soon_threadsafe(_resolve, future)
+            except RuntimeError:
+                pass  # the waiting loop has shut down
+
+    def write(self, chunk: bytes):
+        """Append chunk; readers only ever see whole chunks."""
+        self._file.write(chunk)
+        self._file.flush()
+        with self._lock:
+            self.written += len(chunk)
+            waiters, self._waiters = self._waiters, []
+        self._wake(waiters)
+
+    def finish(self, error: Optional[BaseException] = None) -> Optional[str]:
+        """Commit the file to the cache (or drop it after an error) and wake all readers. Returns the cached path."""
+        self._file.close()
+        with self._lock:
+            if error is None:
+                try:
+                    self.path = self.cache.commit(self.key, self.path)
+                except OSError as e:
+                    error = e
+            if error is not None:
+                self.error = error
+                try:
+                    os.remove(self.path)
+                except OSError:
+                    pass
+            self.done = True
+            waiters, self._waiters = self._waiters, []
+        self._finished.set()
+        self._wake(waiters)
+        return self.path if error is None else None
+
+    def _reading(self, delta: int):
+        with self._lock:
+            self.readers += delta
+            self.last_read = time.monotonic()
+
+    def watched_at(self) -> float:
+        """Monotonic time a client last read the video (now while one is reading)."""
+        with self._lock:
+            return time.monotonic() if self.readers else self.last_read
+
+    def wait_finished(self, timeout: Optional[float] = None) -> bool:
+        return self._finished.wait(timeout)
+
+    async def wait(self, written: int):
+        """Return once more than written bytes are available or the render is over."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self.written > written or self.done:
+                return
+            future = loop.create_future()
+            self._waiters.append((loop, future))
+        await future
+
+    async def finished(self):
+        """Wait for the render to end; the waiting client counts as a reader meanwhile."""
+        self._reading(1)
+        try:
+            while not self.done:
+                await self.wait(self.written)
+        finally:
+            self._reading(-1)
+
+    async def stream(self, start: int = 0) -> AsyncIterator[bytes]:
+        """The video from byte start on, as it is written; ends when the render does (early if it failed)."""
+        with self._lock:
+            f = open(self.path, "rb")
+        self._reading(1)
+        try:
+            f.seek(start)
+            pos = start
+            while True:
+                with self._lock:
+                    available, done = self.written, self.done
+                if pos < available:
+                    chunk = f.read(min(STREAM_CHUNK_BYTES, available - pos))
+                    if not chunk:
+                        return
+                    pos += len(chunk)
+                    yield chunk
+                elif done:
+                    return
+                else:
+                    await self.wait(pos)
+        finally:
+            self._reading(-1)
+            f.close()
+
+
+class LiveVideoRegistry:
+    """Renders in progress by cache key, so concurrent requests for the same video share one render."""
+    def __init__(self, cache: DiskCache):
+        self.cache = cache
+        self._items: Dict[str, LiveVideo] = {}
+        self._lock = threading.Lock()
+        self.started = 0
+        self.shared = 0
+        self.stopped = 0
+        self.failed = 0
+
+    def get(self, key: str) -> Optional[LiveVideo]:
+        with self._lock:
+            return self._items.get(key)
+
+    def start(self, key: str) -> Tuple[LiveVideo, bool]:
+        """
+        The live video for key and whether the caller created it (and so must render and
+        finish it). Either way the caller counts as one of its consumers until it calls
+        release(). A render that is stopping because all its consumers cancelled isn't
+        shared; the caller starts a new one.
+        """
+        with self._lock:
+            live = self._items.get(key)
+            if live is not None and not live.stop.is_set():
+                live.consumers += 1
+                self.shared += 1
+                return live, False
+            live = self._items[key] = LiveVideo(key, self.cache)
+            live.consumers = 1
+            self.started += 1
+            return live, True
+
+    def release(self, live: LiveVideo) -> bool:
+        """
+        Drop one consumer of live. Returns True if that was the last one and the render
+        is still going, in which case live.stop is set so the renderer gives up.
+        """
+        with self._lock:
+            live.consumers -= 1
+            last = live.consumers <= 0 and not live.done
+            if last:
+                live.stop.set()
+                self.stopped += 1
+        return last
+
+    def finish(self, live: LiveVideo, error: Optional[BaseException] = None) -> Optional[str]:
+        try:
+            return live.finish(error)
+        finally:
+            with self._lock:
+                if self._items.get(live.key) is live:
+                    del self._items[live.key]
+                if error is not None:
+                    self.failed += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rendering": len(self._items),
+                "started": self.started,
+                "shared": self.shared,
+                "stopped": self.stopped,
+                "failed": self.failed,
+            }
@@ -0,0 +1,277 @@
+# backend/metrics.py
+# Counters and histograms in Prometheus text format (GET /metrics), without a client library
+import bisect
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backend import tracing
+
+# Seconds; spans a cached response (ms) to a long avatar render (minutes)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Sample = Tuple[str, Tuple[Tuple[str, str], ...], float]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...]) -> Tuple[Tuple[str, str], ...]:
+        return tuple(zip(self.labelnames, key))
+
+    def samples(self) -> Iterator[Sample]:
+        return iter(())
+
+
+class Counter(Metric):
+    """A monotonically increasing count per label set."""
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = list(self._values.items())
+        for key, value in values:
+            yield self.name, self._labels(key), value
+
+
+class Histogram(Metric):
+    """Observations bucketed per label set; buckets are stored per bucket and summed up at scrape time."""
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values: Dict[Tuple[str, ...], list] = {}  # key -> [counts per bucket + overflow, sum]
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)  # first bucket whose upper bound is >= value
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            values = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        for key, counts, total in values:
+            labels = self._labels(key)
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield f"{self.name}_bucket", labels + (("le", _format(bound)),), cumulative
+            yield f"{self.name}_sum", labels, total
+            yield f"{self.name}_count", labels, cumulative
+
+
+class CallbackMetric(Metric):
+    """
+    A gauge or counter read at scrape time from state kept elsewhere (cache stats,
+    session counts), so hot paths don't update it twice. collect() returns a number,
+    or (label values, number) pairs for labelled metrics.
+    """
+    def __init__(self, name: str, help: str, kind: str, collect: Callable[[], Any], labelnames: Iterable[str] = ()):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.collect = collect
+
+    def samples(self) -> Iterator[Sample]:
+        values = self.collect()
+        if not self.labelnames:
+            if values is not None:
+                yield self.name, (), values
+            return
+        for key, value in values:
+            if value is not None:
+                yield self.name, self._labels(tuple(str(v) for v in key)), value
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+        self._lock = threading.Lock()
+
+    def _add(self, metric: Metric) -> Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric '{metric.name}' is already registered")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Iterable[str] = (), buckets: Iterable[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def callback(self, name: str, help: str, kind: str, collect: Callable[[], Any], labelnames: Iterable[str] = ()) -> CallbackMetric:
+        return self._add(CallbackMetric(name, help, kind, collect, labelnames))
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (version 0.0.4)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                if labels:
+                    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+                    lines.append(f"{name}{{{rendered}}} {_format(value)}")
+                else:
+                    lines.append(f"{name} {_format(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Request metrics ---
+
+REQUEST_SECONDS = registry.histogram(
+    "daylily_request_duration_seconds", "HTTP request latency until the last body byte is sent.", ("endpoint", "method")
+)
+REQUESTS = registry.counter("daylily_requests_total", "HTTP requests by response status.", ("endpoint", "method", "status"))
+ERRORS = registry.counter("daylily_errors_total", "Failures by where they happened and what kind they were.", ("endpoint", "kind"))
+PHASE_SECONDS = registry.histogram(
+    "daylily_phase_duration_seconds", "Time spent decoding, in model inference and encoding, per endpoint and stage.",
+    ("endpoint", "stage", "phase")
+)
+FALLBACKS = registry.counter(
+    "daylily_fallbacks_total", "Responses served by a fallback instead of the model.", ("endpoint", "kind")
+)
+
+# The request (HTTP or WebSocket scope) being handled; its route names the endpoint label
+_current_scope: contextvars.ContextVar[Optional[dict]] = contextvars.ContextVar("metrics_scope", default=None)
+
+
+def current_endpoint() -> str:
+    """Route template of the request being handled (e.g. /videos/{video_id}), or "background"."""
+    scope = _current_scope.get()
+    if scope is None:
+        return "background"
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+def error(kind: str):
+    ERRORS.inc(endpoint=current_endpoint(), kind=kind)
+
+
+def fallback(kind: str):
+    FALLBACKS.inc(endpoint=current_endpoint(), kind=kind)
+
+
+@contextmanager
+def phase(stage: str, name: str) -> Iterator[None]:
+    """Time a decode / inference / encode step of stage for the current endpoint (and trace it)."""
+    started = time.perf_counter()
+    try:
+        with tracing.span(f"{stage}.{name}"):
+            yield
+    finally:
+        PHASE_SECONDS.observe(time.perf_counter() - started, endpoint=current_endpoint(), stage=stage, phase=name)
+
+
+# --- Caches ---
+# Objects with a stats() like backend.cache's (hits, misses, evictions, bytes), by name
+
+_caches: Dict[str, Any] = {}
+
+
+def register_cache(name: str, cache):
+    _caches[name] = cache
+
+
+def _cache_stat(field: str):
+    return lambda: [((name,), cache.stats().get(field)) for name, cache in list(_caches.items())]
+
+
+registry.callback("daylily_cache_hits_total", "Cache lookups that found an entry.", "counter", _cache_stat("hits"), ("cache",))
+registry.callback("daylily_cache_misses_total", "Cache lookups that found nothing.", "counter", _cache_stat("misses"), ("cache",))
+registry.callback("daylily_cache_evictions_total", "Entries evicted to stay within size limits.", "counter",
+                  _cache_stat("evictions"), ("cache",))
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording each HTTP request's latency and status by route
+    template. Pure ASGI rather than BaseHTTPMiddleware, so streamed responses pass
+    through untouched and the time runs until their last chunk has been sent.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        token = _current_scope.set(scope)
+        if scope["type"] == "websocket":
+            try:
+                await self.app(scope, receive, send)
+            finally:
+                _current_scope.reset(token)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        except Exception:
+            error("exception")
+            raise
+        finally:
+            endpoint = current_endpoint()
+            REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=endpoint, method=scope["method"])
+            REQUESTS.inc(endpoint=endpoint, method=scope["method"], status=status)
+            _current_scope.reset(token)
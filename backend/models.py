@@ -0,0 +1,341 @@
+# backend/models.py
+# Model registry: single-flight loading, background preloading, unload/reload, per-model readiness
+import gc
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+
+from backend import tracing
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+PENDING = "pending"
+LOADING = "loading"
+READY = "ready"
+FAILED = "failed"
+UNLOADING = "unloading"
+
+
+class ModelLoadError(Exception):
+    """A model could not be loaded (or its load did not finish in time)."""
+    def __init__(self, name: str, message: str):
+        super().__init__(f"Model '{name}' failed to load: {message}")
+        self.name = name
+
+
+def _rss_bytes() -> Optional[int]:
+    if psutil is None:
+        return None
+    return psutil.Process().memory_info().rss
+
+
+class ModelState:
+    """Load state and bookkeeping for one registered model."""
+    __slots__ = (
+        "name", "load", "unload", "footprint", "state", "error", "started_at",
+        "load_seconds", "memory_bytes", "last_memory_bytes", "users", "last_used", "loads",
+        "unloads", "done"
+    )
+
+    def __init__(
+        self,
+        name: str,
+        load: Callable[[], Any],
+        unload: Optional[Callable[[], Any]],
+        footprint: Optional[Callable[[], Optional[int]]]
+    ):
+        self.name = name
+        self.load = load
+        self.unload = unload
+        self.footprint = footprint
+        self.state = PENDING
+        self.error: Optional[str] = None
+        self.started_at: Optional[float] = None
+        self.load_seconds: Optional[float] = None
+        self.memory_bytes: Optional[int] = None
+        # Footprint from the most recent load, kept after unload to size a reload
+        self.last_memory_bytes: Optional[int] = None
+        self.users = 0
+        self.last_used: Optional[float] = None
+        self.loads = 0
+        self.unloads = 0
+        self.done = threading.Event()
+
+
+class ModelRegistry:
+    """
+    Owns the load lifecycle of every model. Each backend module registers
+    load()/unload() functions that set/clear its global model handle; the registry
+    guarantees load() runs at most once at a time per model, however many threads
+    ask for it. Callers that need a model while it is loading (or unloading) wait
+    for that to finish instead of starting their own load. A failed load is retried
+    by the next caller that finds it failed, not by the ones that waited on it.
+
+    Code that uses a model handle wraps the use in `with registry.use(name):`, so
+    unload() can wait for in-flight calls instead of pulling the model out from
+    under them. Don't call unload() from inside use() of the same model.
+    """
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._models: Dict[str, ModelState] = {}
+        # Called with the model name (outside the lock) around every load, e.g. by the residency manager
+        self.before_load: List[Callable[[str], None]] = []
+        self.after_load: List[Callable[[str], None]] = []
+
+    def register(
+        self,
+        name: str,
+        load: Callable[[], Any],
+        unload: Optional[Callable[[], Any]] = None,
+        footprint: Optional[Callable[[], Optional[int]]] = None
+    ):
+        """
+        load() brings the model into memory; unload() drops every reference to it.
+        footprint() returns its size in bytes; without it (or when it returns None) the
+        process RSS growth during load() is used, which over-counts when several models
+        load at once.
+        """
+        with self._cond:
+            self._models[name] = ModelState(name, load, unload, footprint)
+
+    def names(self) -> List[str]:
+        return list(self._models)
+
+    def _entry(self, name: str) -> ModelState:
+        try:
+            return self._models[name]
+        except KeyError:
+            raise KeyError(f"Unknown model '{name}'") from None
+
+    def _claim(self, entry: ModelState):
+        """Under the lock: mark entry as being loaded by the caller, with a fresh Event for waiters."""
+        entry.state = LOADING
+        entry.error = None
+        entry.started_at = time.time()
+        entry.done = threading.Event()
+
+    def _load(self, entry: ModelState) -> str:
+        """Run entry.load() on this thread; entry must already be claimed (LOADING). Returns the new state."""
+        for hook in self.before_load:
+            try:
+                hook(entry.name)
+            except Exception:
+                logging.exception(f"before_load hook failed for model '{entry.name}'")
+        started = time.perf_counter()
+        rss_before = _rss_bytes()
+        memory = None
+        try:
+            entry.load()
+            if entry.footprint is not None:
+                try:
+                    memory = entry.footprint()
+                except Exception:
+                    logging.exception(f"Measuring model '{entry.name}' failed")
+            if memory is None and rss_before is not None:
+                memory = max(0, _rss_bytes() - rss_before)
+        except Exception as e:
+            logging.exception(f"Loading model '{entry.name}' failed")
+            state, error = FAILED, str(e)
+        else:
+            state, error = READY, None
+        with self._cond:
+            entry.state = state
+            entry.error = error
+            entry.load_seconds = round(time.perf_counter() - started, 3)
+            entry.memory_bytes = memory
+            if state == READY:
+                entry.loads += 1
+                entry.last_used = time.monotonic()
+                if memory is not None:
+                    entry.last_memory_bytes = memory
+            entry.done.set()
+            self._cond.notify_all()
+        if state == READY:
+            logging.info(f"Model '{entry.name}' loaded in {entry.load_seconds}s")
+            for hook in self.after_load:
+                try:
+                    hook(entry.name)
+                except Exception:
+                    logging.exception(f"after_load hook failed for model '{entry.name}'")
+        return state
+
+    def start(self, name: str):
+        """Begin loading name in a background thread unless it is loading or loaded already."""
+        entry = self._entry(name)
+        with self._cond:
+            if entry.state not in (PENDING, FAILED):
+                return
+            self._claim(entry)
+        threading.Thread(target=self._load, args=(entry,), name=f"preload-{name}", daemon=True).start()
+
+    def preload(self, names: Optional[Iterable[str]] = None):
+        """Load the given models (all registered ones by default) concurrently in the background."""
+        for name in (self.names() if names is None else names):
+            if name not in self._models:
+                logging.warning(f"Not preloading unknown model '{name}'")
+                continue
+            self.start(name)
+
+    def ensure(self, name: str, timeout: Optional[float] = None):
+        """Block until name is loaded, loading it here if no load is in flight. Raises ModelLoadError."""
+        entry = self._entry(name)
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                if entry.state == READY:
+                    return
+                if entry.state in (PENDING, FAILED):
+                    self._claim(entry)
+                    done = None
+                else:
+                    done = entry.done
+            if done is None:
+                with tracing.span("model.load", model=name):
+                    state = self._load(entry)
+                if state == FAILED:
+                    raise ModelLoadError(name, entry.error)
+                continue
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            with tracing.span("model.wait", model=name):
+                loaded = done.wait(remaining)
+            if not loaded:
+                raise ModelLoadError(name, f"still {entry.state} after {timeout}s")
+            with self._cond:
+                if entry.state == FAILED:
+                    raise ModelLoadError(name, entry.error)
+            # READY, or PENDING after an unload: loop round and load it again
+
+    @contextmanager
+    def use(self, name: str, timeout: Optional[float] = None) -> Iterator[None]:
+        """Hold name loaded for the duration of the block (loading it first if needed)."""
+        entry = self._entry(name)
+        while True:
+            self.ensure(name, timeout)
+            with self._cond:
+                if entry.state == READY:
+                    entry.users += 1
+                    break
+        try:
+            yield
+        finally:
+            with self._cond:
+                entry.users -= 1
+                entry.last_used = time.monotonic()
+                self._cond.notify_all()
+
+    def unload(self, name: str, wait: bool = True) -> bool:
+        """
+        Drop a loaded model so its memory can be reclaimed. Waits for in-flight loads
+        and users first (or, with wait=False, gives up if there are any).
+        Returns True if the model was unloaded.
+        """
+        entry = self._entry(name)
+        with self._cond:
+            while entry.state in (LOADING, UNLOADING):
+                if not wait:
+                    return False
+                self._cond.wait()
+            if entry.state != READY or (entry.users and not wait):
+                return False
+            # New callers wait on this event and reload once the unload is done
+            entry.state = UNLOADING
+            entry.done = threading.Event()
+            while entry.users:
+                self._cond.wait()
+        try:
+            if entry.unload is not None:
+                entry.unload()
+        finally:
+            with self._cond:
+                freed = entry.memory_bytes
+                entry.state = PENDING
+                entry.memory_bytes = None
+                entry.unloads += 1
+                entry.done.set()
+                self._cond.notify_all()
+            gc.collect()
+        logging.info(f"Model '{name}' unloaded (~{(freed or 0) / 1024 / 1024:.0f} MB)")
+        return True
+
+    def reload(self, name: str, timeout: Optional[float] = None):
+        """Unload name (if loaded) and load it again."""
+        self.unload(name)
+        self.ensure(name, timeout)
+
+    def is_ready(self, names: Optional[Iterable[str]] = None) -> bool:
+        """
+        True when every named model has loaded successfully. A model that was loaded
+        and later unloaded still counts: the next request reloads it on demand.
+        """
+        names = self.names() if names is None else [name for name in names if name in self._models]
+        with self._cond:
+            return all(
+                self._models[name].state == READY
+                or (self._models[name].loads > 0 and self._models[name].state != FAILED)
+                for name in names
+            )
+
+    def resident(self) -> List[Dict[str, Any]]:
+        """Loaded models with their footprint, current users and last use (time.monotonic())."""
+        with self._cond:
+            return [
+                {
+                    "name": entry.name,
+                    "memory_bytes": entry.memory_bytes or 0,
+                    "users": entry.users,
+                    "last_used": entry.last_used or 0.0,
+                    "unloadable": entry.unload is not None,
+                }
+                for entry in self._models.values() if entry.state == READY
+            ]
+
+    def expected_bytes(self, name: str) -> int:
+        """Footprint of name's last load (0 if it has never loaded)."""
+        return self._entry(name).last_memory_bytes or 0
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        with self._cond:
+            return {
+                name: {
+                    "state": entry.state,
+                    "load_seconds": entry.load_seconds,
+                    "loading_for": round(now - entry.started_at, 3)
+                    if entry.state == LOADING and entry.started_at else None,
+                    "memory_mb": round(entry.memory_bytes / 1024 / 1024, 1)
+                    if entry.memory_bytes is not None else None,
+                    "users": entry.users,
+                    "loads": entry.loads,
+                    "unloads": entry.unloads,
+                    "error": entry.error,
+                }
+                for name, entry in self._models.items()
+            }
+
+
+def _preload_from_env() -> List[str]:
+    """Models named in PRELOAD_MODELS (comma-separated; empty or "none" disables preloading)."""
+    names = os.getenv("PRELOAD_MODELS", "whisper,tts,avatar")
+    if names.strip().lower() in ("", "none"):
+        return []
+    return [name.strip() for name in names.split(",") if name.strip()]
+
+
+# Backend modules register their models here when imported
+registry = ModelRegistry()
+
+PRELOAD_MODELS = _preload_from_env()
+
+
+def ensure(name: str, timeout: Optional[float] = None):
+    registry.ensure(name, timeout)
+
+
+def use(name: str, timeout: Optional[float] = None):
+    return registry.use(name, timeout)
@@ -0,0 +1,91 @@
+# backend/pipeline.py
+# In-process STT -> TTS -> avatar pipeline used by /converse
+import time
+from typing import Any, AsyncIterator, Dict, Optional, Tuple, Union
+
+from fastapi import UploadFile
+
+from backend import transcribe, speak, avatar, models
+from backend.executor import get_stage, QueueFullError
+
+
+class PipelineError(Exception):
+    """A pipeline stage failed; carries the stage name and an HTTP status code."""
+    def __init__(self, stage: str, message: str, status_code: int = 500):
+        super().__init__(message)
+        self.stage = stage
+        self.status_code = status_code
+
+
+def _speak(text: str, voice: Optional[str], speaker_embedding: Any) -> Tuple[bytes, float]:
+    models.ensure("tts")
+    return speak.generate_speech(text, voice, speaker_embedding)
+
+
+Portrait = Optional[Union[bytes, avatar.AvatarIdentity]]
+
+
+def _render(wav_bytes: bytes, portrait: Portrait) -> Tuple[bytes, float]:
+    models.ensure("avatar")
+    if isinstance(portrait, bytes):
+        portrait = avatar.register_avatar_image(portrait)
+    video_path, latency = avatar.generate_avatar(wav_bytes, portrait)
+    if not video_path:
+        raise RuntimeError("Failed to generate video file")
+    with open(video_path, "rb") as f:
+        return f.read(), latency
+
+
+async def transcribe_stage(
+    upload: UploadFile,
+    timings: Dict[str, float],
+    initial_prompt: Optional[str] = None
+) -> str:
+    """
+    Run STT for the mic upload (prompted with earlier turns); raises PipelineError on bad
+    input and models.ModelLoadError when Whisper cannot load.
+    """
+    def _transcribe():
+        models.ensure("whisper")
+        return transcribe.transcribe_audio(upload, initial_prompt)
+
+    start = time.perf_counter()
+    result = await get_stage("transcribe").run(_transcribe)
+    timings["transcribe"] = round(time.perf_counter() - start, 4)
+    if "error" in result:
+        raise PipelineError("transcribe", result["error"], 400)
+    return result["transcript"]
+
+
+async def synthesis_stages(
+    text: str,
+    portrait: Portrait,
+    timings: Dict[str, float],
+    voice: Optional[str] = None,
+    speaker_embedding: Any = None
+) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Yield ("audio", wav_bytes) then ("video", mp4_bytes) as each stage finishes.
+    The TTS output is handed to the avatar stage in memory, never re-uploaded.
+    A failing stage raises PipelineError; a full stage queue raises QueueFullError and a
+    model that cannot load raises models.ModelLoadError.
+    """
+    start = time.perf_counter()
+    try:
+        wav_bytes, _ = await get_stage("speak").run(_speak, text, voice, speaker_embedding)
+    except (QueueFullError, models.ModelLoadError):
+        raise
+    except Exception as e:
+        raise PipelineError("speak", str(e)) from e
+    timings["speak"] = round(time.perf_counter() - start, 4)
+    yield "audio", wav_bytes
+
+    start = time.perf_counter()
+    try:
+        video_bytes, _ = await get_stage("avatar").run(_render, wav_bytes, portrait)
+    except (QueueFullError, models.ModelLoadError):
+        raise
+    except Exception as e:
+        raise PipelineError("avatar", str(e)) from e
+    timings["avatar"] = round(time.perf_counter() - start, 4)
+    yield "video", video_bytes
@@ -0,0 +1,153 @@
+# backend/residency.py
+# Keeps loaded models within a memory budget: idle-timeout and LRU eviction, reload on demand
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from backend.models import ModelRegistry, registry
+
+
+class ResidencyManager:
+    """
+    Decides which registered models stay in memory.
+
+    - Idle timeout: a model nobody has used for idle_timeouts[name] seconds is
+      unloaded by a background sweeper (0 or missing disables it for that model).
+    - Budget: before a model loads, least recently used idle models are unloaded
+      until the resident footprints plus the incoming model's last known
+      footprint fit in budget_bytes; after a load the budget is checked again
+      with the measured footprint. Models that are in use are never evicted, so
+      the budget can be exceeded while everything resident is busy.
+
+    Evicted models are simply unloaded in the registry; the next request reloads
+    them on demand. Models registered without an unload function are never
+    evicted (there is nothing to free).
+    """
+    def __init__(
+        self,
+        models: ModelRegistry,
+        budget_bytes: int = 0,
+        idle_timeouts: Optional[Dict[str, float]] = None,
+        check_interval: float = 30.0
+    ):
+        self.models = models
+        self.budget_bytes = budget_bytes
+        self.idle_timeouts = idle_timeouts or {}
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._evicted = set()
+        self._thread = None
+        self._stop = threading.Event()
+        self.evictions: Dict[str, Dict[str, int]] = {}
+        self.reloads: Dict[str, int] = {}
+        self.budget_overruns = 0
+        models.before_load.append(self._before_load)
+        models.after_load.append(self._after_load)
+
+    def _evict(self, name: str, reason: str) -> bool:
+        if not self.models.unload(name, wait=False):
+            return False
+        with self._lock:
+            self._evicted.add(name)
+            counts = self.evictions.setdefault(name, {"idle": 0, "pressure": 0})
+            counts[reason] += 1
+        logging.info(f"Evicted model '{name}' ({reason})")
+        return True
+
+    def _fit(self, incoming: Optional[str], incoming_bytes: int) -> bool:
+        """Evict LRU idle models until resident + incoming_bytes fits the budget. False if it can't."""
+        if not self.budget_bytes:
+            return True
+        resident = [m for m in self.models.resident() if m["name"] != incoming]
+        total = sum(m["memory_bytes"] for m in resident) + incoming_bytes
+        candidates = sorted(
+            (m for m in resident if m["unloadable"] and not m["users"]),
+            key=lambda m: m["last_used"]
+        )
+        for m in candidates:
+            if total <= self.budget_bytes:
+                break
+            if self._evict(m["name"], "pressure"):
+                total -= m["memory_bytes"]
+        return total <= self.budget_bytes
+
+    def _before_load(self, name: str):
+        with self._lock:
+            reloading = name in self._evicted
+            if reloading:
+                self._evicted.discard(name)
+                self.reloads[name] = self.reloads.get(name, 0) + 1
+        if reloading:
+            logging.info(f"Reloading evicted model '{name}'")
+        self._fit(name, self.models.expected_bytes(name))
+
+    def _after_load(self, name: str):
+        if not self._fit(name, self.models.expected_bytes(name)):
+            with self._lock:
+                self.budget_overruns += 1
+            logging.warning(
+                f"Model memory over budget ({self.budget_bytes / 1024 / 1024:.0f} MB) after loading "
+                f"'{name}'; every other resident model is in use"
+            )
+
+    def sweep(self) -> List[str]:
+        """Unload models idle longer than their timeout. Returns the names evicted."""
+        now = time.monotonic()
+        evicted = []
+        for m in self.models.resident():
+            timeout = self.idle_timeouts.get(m["name"], 0)
+            if timeout and m["unloadable"] and not m["users"] and now - m["last_used"] >= timeout:
+                if self._evict(m["name"], "idle"):
+                    evicted.append(m["name"])
+        return evicted
+
+    def _loop(self):
+        while not self._stop.wait(self.check_interval):
+            try:
+                self.sweep()
+            except Exception:
+                logging.exception("Model residency sweep failed")
+
+    def start(self):
+        """Start the idle sweeper thread (no-op when no idle timeouts are set)."""
+        if self._thread is not None or not any(self.idle_timeouts.values()):
+            return
+        self._thread = threading.Thread(target=self._loop, name="model-residency", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self) -> Dict[str, Any]:
+        resident = self.models.resident()
+        with self._lock:
+            return {
+                "budget_mb": round(self.budget_bytes / 1024 / 1024, 1) if self.budget_bytes else None,
+                "resident_mb": round(sum(m["memory_bytes"] for m in resident) / 1024 / 1024, 1),
+                "resident": sorted(m["name"] for m in resident),
+                "idle_timeouts": dict(self.idle_timeouts),
+                "evictions": {name: dict(counts) for name, counts in self.evictions.items()},
+                "reloads": dict(self.reloads),
+                "budget_overruns": self.budget_overruns,
+            }
+
+
+def _residency_from_env() -> ResidencyManager:
+    """
+    MODEL_MEMORY_BUDGET_MB (default 3072, headroom in the 4 GiB container; 0 = no budget),
+    MODEL_IDLE_TIMEOUT_S for every model (default 0 = never) or <NAME>_IDLE_TIMEOUT_S per model,
+    MODEL_RESIDENCY_CHECK_S between idle sweeps (default 30).
+    """
+    budget = int(float(os.getenv("MODEL_MEMORY_BUDGET_MB", 3072)) * 1024 * 1024)
+    default_idle = float(os.getenv("MODEL_IDLE_TIMEOUT_S", 0))
+    idle = {
+        name: float(os.getenv(f"{name.upper()}_IDLE_TIMEOUT_S", default_idle))
+        for name in ("whisper", "tts", "avatar")
+    }
+    interval = float(os.getenv("MODEL_RESIDENCY_CHECK_S", 30))
+    return ResidencyManager(registry, max(0, budget), idle, max(1.0, interval))
+
+
+residency = _residency_from_env()
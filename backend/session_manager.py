@@ -1,65 +1,222 @@
+import abc
+import heapq
+import os
 import threading
 import uuid
 import time
 import logging
-from typing import Optional, Dict
+from typing import Any, Optional, Dict, List, Tuple
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from backend import metrics, tracing
+from backend.session_state import session_states
 
 # Session timeout in seconds (e.g., 30 minutes)
-SESSION_TIMEOUT = 1800
+SESSION_TIMEOUT = float(os.getenv("SESSION_TIMEOUT_S", 1800))
+# Independent shards, each with its own lock, so concurrent requests rarely contend
+SESSION_SHARDS = int(os.getenv("SESSION_SHARDS", 16))
+# How often the background sweeper removes expired sessions
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL_S", 30))
+# Log one create/touch line per this many events (plus a summary per sweep that expires anything)
+SESSION_LOG_EVERY = int(os.getenv("SESSION_LOG_EVERY", 1000))
 
-class SessionManager:
+_SWEEP_BATCH = 1000
+
+
+class SessionStore(abc.ABC):
     """
-    Thread-safe in-memory session manager for FastAPI backend.
-    Each session is identified by a UUID token.
+    Where sessions live. get_or_create_session only needs create_session and
+    touch_session; the rest is for the sweeper and /stats.
+    SessionManager keeps sessions in process memory (one instance);
+    session_redis.RedisSessionStore shares them between instances.
+    """
+    @abc.abstractmethod
+    def create_session(self) -> str:
+        """Start a new session and return its id."""
+
+    @abc.abstractmethod
+    def touch_session(self, session_id: str) -> bool:
+        """Refresh session_id's expiry; False if it is unknown or already expired."""
+
+    def cleanup_sessions(self) -> int:
+        """Remove expired sessions (no-op for stores that expire them server-side)."""
+        return 0
+
+    @abc.abstractmethod
+    def get_active_sessions(self) -> int:
+        """Number of sessions that have not expired."""
+
+    def stats(self) -> Dict[str, Any]:
+        return {"active": self.get_active_sessions()}
+
+
+class _Shard:
     """
+    One lock-protected slice of the sessions. deadlines maps session_id -> monotonic
+    expiry time; expiry is a min-heap of (deadline, session_id) with at most one entry
+    per session. Touches only move the deadline in the dict; when the sweeper pops an
+    entry whose session was touched since, it pushes it back with the new deadline.
+    """
+    __slots__ = ("lock", "deadlines", "expiry")
+
     def __init__(self):
-        self.sessions: Dict[str, float] = {}  # session_id -> last_access timestamp
         self.lock = threading.Lock()
+        self.deadlines: Dict[str, float] = {}
+        self.expiry: List[Tuple[float, str]] = []
+
+
+class SessionManager(SessionStore):
+    """
+    Thread-safe in-memory session manager for FastAPI backend.
+    Each session is identified by a UUID token.
+    Sessions are spread over lock-striped shards and expire SESSION_TIMEOUT seconds
+    (monotonic clock) after their last use; a background thread sweeps expired ones.
+    """
+    def __init__(
+        self,
+        timeout: float = SESSION_TIMEOUT,
+        shards: int = SESSION_SHARDS,
+        sweep_interval: float = SESSION_SWEEP_INTERVAL,
+        log_every: int = SESSION_LOG_EVERY
+    ):
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self.log_every = max(1, log_every)
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        self._sweeper = None
+        self._start_lock = threading.Lock()
+        # Counters are updated without a lock; they are for logging and stats only
+        self.created = 0
+        self.touched = 0
+        self.expired = 0
+
+    def _shard(self, session_id: str) -> _Shard:
+        return self._shards[hash(session_id) % len(self._shards)]
+
+    def _ensure_sweeper(self):
+        if self._sweeper is not None:
+            return
+        with self._start_lock:
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_loop, name="session-sweeper", daemon=True)
+                self._sweeper.start()
 
     def create_session(self) -> str:
+        self._ensure_sweeper()
         session_id = str(uuid.uuid4())
-        with self.lock:
-            self.sessions[session_id] = time.time()
-        logging.info(f"Session created: {session_id}")
+        deadline = time.monotonic() + self.timeout
+        shard = self._shard(session_id)
+        with shard.lock:
+            shard.deadlines[session_id] = deadline
+            heapq.heappush(shard.expiry, (deadline, session_id))
+        self.created += 1
+        if self.created % self.log_every == 1 or self.log_every == 1:
+            logging.info(f"Session created: {session_id} ({self.created} created so far)")
         return session_id
 
     def touch_session(self, session_id: str) -> bool:
         """Update last access time if session exists and not expired."""
-        with self.lock:
-            if session_id in self.sessions:
-                if time.time() - self.sessions[session_id] < SESSION_TIMEOUT:
-                    self.sessions[session_id] = time.time()
-                    logging.info(f"Session used: {session_id}")
-                    return True
-                else:
-                    # Session expired
-                    del self.sessions[session_id]
-                    logging.info(f"Session expired: {session_id}")
-        return False
-
-    def cleanup_sessions(self):
-        """Remove expired sessions."""
-        with self.lock:
-            expired = [sid for sid, ts in self.sessions.items() if time.time() - ts >= SESSION_TIMEOUT]
-            for sid in expired:
-                del self.sessions[sid]
-                logging.info(f"Session expired (cleanup): {sid}")
+        now = time.monotonic()
+        shard = self._shard(session_id)
+        with shard.lock:
+            deadline = shard.deadlines.get(session_id)
+            if deadline is None:
+                return False
+            if deadline <= now:
+                # Expired but not swept yet; the sweeper drops its heap entry later
+                del shard.deadlines[session_id]
+                expired = True
+            else:
+                shard.deadlines[session_id] = now + self.timeout
+                expired = False
+        if expired:
+            session_states.discard(session_id)
+            self.expired += 1
+            logging.debug(f"Session expired: {session_id}")
+            return False
+        self.touched += 1
+        if self.touched % self.log_every == 1 or self.log_every == 1:
+            logging.info(f"Session used: {session_id} ({self.touched} touches so far)")
+        return True
+
+    def cleanup_sessions(self) -> int:
+        """Remove expired sessions. Returns how many were removed."""
+        now = time.monotonic()
+        removed = 0
+        for shard in self._shards:
+            due = True
+            while due:
+                # Release the shard lock every _SWEEP_BATCH entries so requests aren't stalled
+                with shard.lock:
+                    expiry = shard.expiry
+                    for _ in range(_SWEEP_BATCH):
+                        if not expiry or expiry[0][0] > now:
+                            due = False
+                            break
+                        _, session_id = heapq.heappop(expiry)
+                        deadline = shard.deadlines.get(session_id)
+                        if deadline is None:
+                            continue  # already removed by touch_session
+                        if deadline <= now:
+                            del shard.deadlines[session_id]
+                            session_states.discard(session_id)
+                            removed += 1
+                        else:
+                            heapq.heappush(expiry, (deadline, session_id))
+        if removed:
+            self.expired += removed
+            logging.info(f"Sessions expired (cleanup): {removed}, {self.get_active_sessions()} active")
+        return removed
+
+    def _sweep_loop(self):
+        while True:
+            time.sleep(self.sweep_interval)
+            try:
+                self.cleanup_sessions()
+            except Exception:
+                logging.exception("Session sweep failed")
 
     def get_active_sessions(self) -> int:
-        with self.lock:
-            return len(self.sessions)
+        # len() of a dict is atomic; no need to take every shard lock
+        return sum(len(shard.deadlines) for shard in self._shards)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "store": "memory",
+            "active": self.get_active_sessions(),
+            "created": self.created,
+            "touched": self.touched,
+            "expired": self.expired,
+            "shards": len(self._shards),
+        }
+
+def _session_store_from_env() -> SessionStore:
+    """SESSION_STORE=memory (default) or redis (shared across instances, see REDIS_URL)."""
+    kind = os.getenv("SESSION_STORE", "memory").strip().lower()
+    if kind == "redis":
+        from backend.session_redis import redis_store_from_env
+        return redis_store_from_env()
+    if kind != "memory":
+        logging.warning(f"Unknown SESSION_STORE '{kind}', using in-memory sessions")
+    return SessionManager()
 
 # Singleton instance
-session_manager = SessionManager()
+session_manager = _session_store_from_env()
+
+# With SESSION_STORE=redis this is a SCAN per scrape, like /stats
+metrics.registry.callback(
+    "daylily_active_sessions", "Sessions that have not expired.", "gauge", session_manager.get_active_sessions
+)
+
+def get_session_state(session_id: str):
+    """The session's SessionState (avatar, voice, transcript context), or None if nothing is stored yet."""
+    return session_states.get(session_id)
 
 def get_or_create_session(session_id: Optional[str]) -> str:
     """
     Retrieve a valid session or create a new one if not provided or expired.
     Returns a valid session_id.
     """
-    if session_id and session_manager.touch_session(session_id):
-        return session_id
-    return session_manager.create_session() 
\ No newline at end of file
+    if not (session_id and session_manager.touch_session(session_id)):
+        session_id = session_manager.create_session()
+    tracing.set_session(session_id)
+    return session_id
@@ -0,0 +1,227 @@
+# backend/session_redis.py
+# Redis-backed session store, so a session id is valid on every instance behind the load balancer
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+from backend.session_manager import SESSION_LOG_EVERY, SESSION_TIMEOUT, SessionStore
+from backend.session_state import session_states
+
+# Connection problems count as "Redis unavailable"; fakeredis raises the same types
+_REDIS_ERRORS = (redis.RedisError, OSError) if redis is not None else (OSError,)
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Each session is a key <prefix><session_id> with a TTL of `timeout` seconds, so
+    Redis expires sessions itself and all instances agree on which ones exist.
+
+    Touches avoid a round trip per request: a session this instance confirmed in
+    Redis less than refresh_after seconds ago is accepted locally and marked dirty,
+    and a background flusher refreshes the TTLs of all dirty sessions in one
+    pipelined batch every flush_interval seconds. Anything else is checked with a
+    synchronous EXPIRE.
+
+    client may be any redis-py compatible client (e.g. fakeredis.FakeRedis for local
+    runs); otherwise one is built on a connection pool for url.
+    Per-session state (session_state) stays local to each instance: it holds model
+    inputs like avatar features that are cheap to rebuild and expensive to ship.
+    If Redis is unreachable, touch_session fails open (the client's id is accepted,
+    not stored) so requests keep working; errors are logged and counted.
+    """
+    def __init__(
+        self,
+        client: Any = None,
+        url: str = "redis://localhost:6379/0",
+        prefix: str = "daylily:session:",
+        timeout: float = SESSION_TIMEOUT,
+        max_connections: int = 16,
+        socket_timeout: float = 0.5,
+        refresh_after: Optional[float] = None,
+        flush_interval: float = 5.0,
+        log_every: int = SESSION_LOG_EVERY
+    ):
+        if client is None:
+            if redis is None:
+                raise RuntimeError("SESSION_STORE=redis needs the redis package (pip install redis)")
+            pool = redis.ConnectionPool.from_url(
+                url,
+                max_connections=max_connections,
+                socket_timeout=socket_timeout,
+                socket_connect_timeout=socket_timeout
+            )
+            client = redis.Redis(connection_pool=pool)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = max(1, int(timeout))
+        # Must stay well below the TTL: a locally accepted touch relies on the key
+        # still existing, and reaches Redis only at the next flush
+        self.refresh_after = refresh_after if refresh_after is not None else min(60.0, self.ttl / 10)
+        self.flush_interval = flush_interval
+        self.log_every = max(1, log_every)
+        self._lock = threading.Lock()
+        self._confirmed: Dict[str, float] = {}  # session_id -> monotonic time last seen in Redis
+        self._dirty = set()
+        self._flusher = None
+        self._start_lock = threading.Lock()
+        self.created = 0
+        self.touched = 0
+        self.local_touches = 0
+        self.flushes = 0
+        self.errors = 0
+
+    def _key(self, session_id: str) -> str:
+        return self.prefix + session_id
+
+    def _error(self, op: str, e: Exception):
+        self.errors += 1
+        if self.errors % self.log_every == 1 or self.log_every == 1:
+            logging.warning(f"Redis session {op} failed ({e}); {self.errors} errors so far")
+
+    def _ensure_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._start_lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="session-redis-flush", daemon=True)
+                self._flusher.start()
+
+    def create_session(self) -> str:
+        self._ensure_flusher()
+        session_id = str(uuid.uuid4())
+        try:
+            self.client.set(self._key(session_id), 1, ex=self.ttl, nx=True)
+        except _REDIS_ERRORS as e:
+            self._error("create", e)
+            return session_id
+        with self._lock:
+            self._confirmed[session_id] = time.monotonic()
+        self.created += 1
+        if self.created % self.log_every == 1 or self.log_every == 1:
+            logging.info(f"Session created: {session_id} ({self.created} created so far)")
+        return session_id
+
+    def touch_session(self, session_id: str) -> bool:
+        """Refresh session_id's TTL; False if Redis doesn't have it (expired or never created)."""
+        self._ensure_flusher()
+        now = time.monotonic()
+        with self._lock:
+            confirmed = self._confirmed.get(session_id)
+            local = confirmed is not None and now - confirmed < self.refresh_after
+            if local:
+                self._dirty.add(session_id)
+        if local:
+            self.touched += 1
+            self.local_touches += 1
+            return True
+        try:
+            exists = bool(self.client.expire(self._key(session_id), self.ttl))
+        except _REDIS_ERRORS as e:
+            self._error("touch", e)
+            return True
+        with self._lock:
+            if exists:
+                self._confirmed[session_id] = now
+            else:
+                self._confirmed.pop(session_id, None)
+                self._dirty.discard(session_id)
+        if not exists:
+            session_states.discard(session_id)
+            return False
+        self.touched += 1
+        if self.touched % self.log_every == 1 or self.log_every == 1:
+            logging.info(f"Session used: {session_id} ({self.touched} touches so far)")
+        return True
+
+    def touch_sessions(self, session_ids: Iterable[str]) -> List[bool]:
+        """Refresh many sessions' TTLs in one pipelined round trip."""
+        session_ids = list(session_ids)
+        pipe = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.expire(self._key(session_id), self.ttl)
+        results = [bool(r) for r in pipe.execute()]
+        now = time.monotonic()
+        with self._lock:
+            for session_id, exists in zip(session_ids, results):
+                if exists:
+                    self._confirmed[session_id] = now
+                else:
+                    self._confirmed.pop(session_id, None)
+        for session_id, exists in zip(session_ids, results):
+            if not exists:
+                session_states.discard(session_id)
+        return results
+
+    def cleanup_sessions(self) -> int:
+        """
+        Flush locally accepted touches to Redis and forget sessions not seen lately.
+        Redis expires the sessions themselves; returns how many dirty sessions turned
+        out to be gone.
+        """
+        with self._lock:
+            dirty = list(self._dirty)
+            self._dirty.clear()
+            cutoff = time.monotonic() - self.refresh_after
+            for session_id in [s for s, seen in self._confirmed.items() if seen < cutoff]:
+                del self._confirmed[session_id]
+        if not dirty:
+            return 0
+        try:
+            results = self.touch_sessions(dirty)
+        except _REDIS_ERRORS as e:
+            self._error("flush", e)
+            with self._lock:
+                self._dirty.update(dirty)
+            return 0
+        self.flushes += 1
+        return results.count(False)
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.cleanup_sessions()
+            except Exception:
+                logging.exception("Redis session flush failed")
+
+    def get_active_sessions(self) -> int:
+        """Number of session keys in Redis (a SCAN over the prefix; meant for /stats, not hot paths)."""
+        try:
+            return sum(1 for _ in self.client.scan_iter(match=self.prefix + "*", count=1000))
+        except _REDIS_ERRORS as e:
+            self._error("scan", e)
+            return -1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            cached = len(self._confirmed)
+            dirty = len(self._dirty)
+        return {
+            "store": "redis",
+            "active": self.get_active_sessions(),
+            "created": self.created,
+            "touched": self.touched,
+            "local_touches": self.local_touches,
+            "cached": cached,
+            "pending_refresh": dirty,
+            "flushes": self.flushes,
+            "errors": self.errors,
+        }
+
+
+def redis_store_from_env() -> RedisSessionStore:
+    return RedisSessionStore(
+        url=os.getenv("REDIS_URL", "redis://localhost:6379/0"),
+        prefix=os.getenv("SESSION_REDIS_PREFIX", "daylily:session:"),
+        max_connections=int(os.getenv("REDIS_MAX_CONNECTIONS", 16)),
+        socket_timeout=float(os.getenv("REDIS_SOCKET_TIMEOUT_S", 0.5)),
+        flush_interval=float(os.getenv("SESSION_REDIS_FLUSH_S", 5)),
+    )
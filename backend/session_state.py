@@ -0,0 +1,140 @@
+# backend/session_state.py
+# Per-session conversation state reused across turns: avatar, TTS voice, transcript context
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Dict, Optional
+
+# Recent transcripts kept per session and passed to Whisper as initial_prompt
+CONTEXT_TURNS = int(os.getenv("SESSION_CONTEXT_TURNS", 4))
+# Whisper only looks at the last ~224 prompt tokens; keep the prompt well within that
+CONTEXT_CHARS = int(os.getenv("SESSION_CONTEXT_CHARS", 400))
+
+# Fixed per-entry overhead assumed when sizing states (object, slots, dict entry, deque)
+_STATE_OVERHEAD = 512
+
+
+class SessionState:
+    """
+    What one conversation has set up so far. avatar is the session's registered
+    AvatarIdentity (held here so it survives eviction from the identity registry);
+    speaker_embedding is the TTS backend's conditioning for voice, loaded once.
+    """
+    __slots__ = ("avatar", "voice", "voice_backend", "speaker_embedding", "transcripts", "nbytes")
+
+    def __init__(self):
+        self.avatar = None
+        self.voice: Optional[str] = None
+        self.voice_backend: Optional[str] = None
+        self.speaker_embedding: Any = None
+        self.transcripts: "deque[str]" = deque(maxlen=max(1, CONTEXT_TURNS))
+        self.nbytes = _STATE_OVERHEAD
+
+    def prompt(self) -> Optional[str]:
+        """Recent transcripts as a Whisper initial_prompt (last CONTEXT_CHARS, cut at a word)."""
+        text = " ".join(self.transcripts).strip()
+        if len(text) > CONTEXT_CHARS:
+            text = text[-CONTEXT_CHARS:]
+            cut = text.find(" ")
+            text = text[cut + 1:] if cut >= 0 else text
+        return text or None
+
+
+def _approx_nbytes(obj: Any) -> int:
+    """Rough payload size: bytes/str/numpy arrays, recursing into containers and __slots__ objects."""
+    if obj is None:
+        return 0
+    if isinstance(obj, (bytes, bytearray, str)):
+        return len(obj)
+    nbytes = getattr(obj, "nbytes", None)
+    if isinstance(nbytes, int):
+        return nbytes
+    if isinstance(obj, dict):
+        return sum(_approx_nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple, deque)):
+        return sum(_approx_nbytes(v) for v in obj)
+    slots = getattr(type(obj), "__slots__", ())
+    return sum(_approx_nbytes(getattr(obj, name, None)) for name in slots)
+
+
+class SessionStateCache:
+    """
+    Thread-safe LRU of SessionState by session id, bounded by entry count and by the
+    approximate size of what the states hold. Session stores discard a session's
+    state when it expires; the bounds cover sessions that are simply abandoned.
+    Mutate states only through the set_*/add_* methods so sizes stay accurate.
+    """
+    def __init__(self, max_entries: int, max_bytes: int):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._states: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.evictions = 0
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is not None:
+                self._states.move_to_end(session_id)
+            return state
+
+    def _update(self, session_id: str, change) -> SessionState:
+        with self._lock:
+            state = self._states.get(session_id)
+            if state is None:
+                state = self._states[session_id] = SessionState()
+                self.total_bytes += state.nbytes
+            change(state)
+            size = _STATE_OVERHEAD + _approx_nbytes(state.avatar) + _approx_nbytes(state.speaker_embedding) \
+                + _approx_nbytes(state.transcripts)
+            self.total_bytes += size - state.nbytes
+            state.nbytes = size
+            self._states.move_to_end(session_id)
+            while self._states and (len(self._states) > self.max_entries or self.total_bytes > self.max_bytes):
+                evicted_id, evicted = self._states.popitem(last=False)
+                self.total_bytes -= evicted.nbytes
+                self.evictions += 1
+                if evicted_id == session_id:
+                    break
+            return state
+
+    def set_avatar(self, session_id: str, identity) -> SessionState:
+        def change(state):
+            state.avatar = identity
+        return self._update(session_id, change)
+
+    def set_voice(self, session_id: str, voice: Optional[str], backend: Optional[str], embedding: Any) -> SessionState:
+        def change(state):
+            state.voice = voice
+            state.voice_backend = backend
+            state.speaker_embedding = embedding
+        return self._update(session_id, change)
+
+    def add_transcript(self, session_id: str, text: str) -> SessionState:
+        def change(state):
+            if text and text.strip():
+                state.transcripts.append(text.strip())
+        return self._update(session_id, change)
+
+    def discard(self, session_id: str):
+        with self._lock:
+            state = self._states.pop(session_id, None)
+            if state is not None:
+                self.total_bytes -= state.nbytes
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._states),
+                "max_entries": self.max_entries,
+                "mb": round(self.total_bytes / 1024 / 1024, 2),
+                "max_mb": round(self.max_bytes / 1024 / 1024, 2),
+                "evictions": self.evictions,
+            }
+
+
+session_states = SessionStateCache(
+    int(os.getenv("SESSION_STATE_MAX", 10000)),
+    int(float(os.getenv("SESSION_STATE_MAX_MB", 256)) * 1024 * 1024)
+)
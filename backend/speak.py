@@ -1,103 +1,318 @@
 # backend/speak.py
 # Text-to-speech with fallback to simple audio generation
 import time
+import logging
 import os
-import struct
-from typing import Tuple
+import re
+import unicodedata
+from typing import Any, Iterable, List, Optional, Tuple
+import numpy as np
+
+from backend import metrics, models, wav
+from backend.cache import LRUCache, DiskCache, TieredCache, cache_key
 
 tts_model = None
-bark_write_wav = None
+tts_backend: Optional[str] = None  # "bark", "coqui" or None (simple audio fallback)
 bark_sample_rate = None
 
-def lazy_load_model():
-    global tts_model, bark_write_wav, bark_sample_rate
-    if tts_model is not None or bark_write_wav is not None:
-        return
+def _load_model():
+    global tts_model, tts_backend, bark_sample_rate
     try:
-        from bark import SAMPLE_RATE, generate_audio
-        from scipy.io.wavfile import write as write_wav
-        bark_write_wav = write_wav
+        from bark import SAMPLE_RATE, generate_audio, preload_models
+        # Bark loads its weights lazily on first generate; do it now so the registry
+        # load (and its memory footprint) covers them
+        preload_models()
         bark_sample_rate = SAMPLE_RATE
         tts_model = generate_audio
-        print("Loaded Bark TTS model")
+        tts_backend = "bark"
+        logging.info("Loaded Bark TTS model")
     except ImportError:
         try:
             from TTS.api import TTS as CoquiTTS
             tts_model = CoquiTTS()
-            print("Loaded Coqui TTS model")
+            tts_backend = "coqui"
+            logging.info("Loaded Coqui TTS model")
         except ImportError:
-            print("No TTS libraries found, using simple audio fallback")
+            logging.warning("No TTS libraries found, using simple audio fallback")
             tts_model = None
+            tts_backend = None
 
-def generate_simple_audio(text: str) -> bytes:
-    """Generate a simple beep audio as fallback when TTS is not available."""
-    # Create a simple WAV file with a beep sound
-    sample_rate = 22050
-    duration = 1.0  # 1 second
-    frequency = 440  # A4 note
-    
-    # Generate sine wave
-    num_samples = int(sample_rate * duration)
-    audio_data = []
-    for i in range(num_samples):
-        sample = int(32767 * 0.3 * (i % 2))  # Simple square wave beep
-        audio_data.append(sample)
-    
-    # WAV file header
-    wav_header = struct.pack('<4sI4s4sIHHIIHH4sI',
-        b'RIFF',                    # Chunk ID
-        36 + len(audio_data) * 2,   # Chunk size
-        b'WAVE',                    # Format
-        b'fmt ',                    # Subchunk1 ID
-        16,                         # Subchunk1 size
-        1,                          # Audio format (PCM)
-        1,                          # Num channels
-        sample_rate,                # Sample rate
-        sample_rate * 2,            # Byte rate
-        2,                          # Block align
-        16,                         # Bits per sample
-        b'data',                    # Subchunk2 ID
-        len(audio_data) * 2         # Subchunk2 size
-    )
-    
-    # Convert audio data to bytes
-    audio_bytes = struct.pack(f'<{len(audio_data)}h', *audio_data)
-    
-    return wav_header + audio_bytes
+def _unload_model():
+    global tts_model, tts_backend, bark_sample_rate
+    if tts_backend == "bark":
+        from bark.generation import clean_models
+        clean_models()
+    tts_model = None
+    tts_backend = None
+    bark_sample_rate = None
 
-def generate_speech(text: str) -> Tuple[bytes, float]:
+def _module_bytes(module) -> int:
+    """Parameter and buffer bytes of a torch module."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
+
+def _footprint() -> Optional[int]:
+    """Weight size of the loaded TTS model; None (RSS growth instead) when it can't be read."""
+    if tts_backend == "bark":
+        from bark.generation import models as bark_models
+        # Bark keeps the text model as {"model": ..., "tokenizer": ...}, the others bare
+        loaded = [m["model"] if isinstance(m, dict) else m for m in bark_models.values()]
+        return sum(_module_bytes(m) for m in loaded)
+    if tts_backend == "coqui":
+        synthesizer = getattr(tts_model, "synthesizer", None)
+        loaded = [getattr(synthesizer, attr, None) for attr in ("tts_model", "vocoder_model")]
+        loaded = [m for m in loaded if m is not None]
+        return sum(_module_bytes(m) for m in loaded) if loaded else None
+    return 0
+
+models.registry.register("tts", _load_model, _unload_model, _footprint)
+
+def lazy_load_model():
+    """Load the TTS backend once; concurrent callers wait for the same load."""
+    models.ensure("tts")
+
+def synthesize_array(text: str, voice: Optional[str] = None, speaker_embedding: Any = None):
+    """
+    Run the loaded TTS model and return (float audio array, sample rate),
+    or None when no model is loaded. Each call owns its own buffers, so any
+    number of synthesis calls can run concurrently.
+    voice is a Bark history prompt / Coqui speaker name; None uses the model default.
+    speaker_embedding (from load_voice_embedding) is used instead of re-loading voice.
+    """
+    with models.use("tts"), metrics.phase("speak", "inference"):
+        backend, model = tts_backend, tts_model
+        if backend == "bark":
+            prompt = speaker_embedding if speaker_embedding is not None else voice
+            if prompt is not None:
+                return model(text, history_prompt=prompt), bark_sample_rate
+            return model(text), bark_sample_rate
+        if backend == "coqui":
+            if voice:
+                return model.tts(text=text, speaker=voice), output_sample_rate()
+            return model.tts(text=text), output_sample_rate()
+        return None
+
+def load_voice_embedding(voice: Optional[str]) -> Any:
+    """
+    Speaker conditioning for voice, loaded once so a session can reuse it every turn:
+    Bark's history prompt arrays (otherwise re-read from its .npz on every generate).
+    None for the default voice, Coqui (it looks speakers up itself) or no model.
+    """
+    if not voice:
+        return None
+    with models.use("tts"):
+        if tts_backend != "bark":
+            return None
+        from bark.generation import _load_history_prompt
+        prompt = _load_history_prompt(voice)
+        return {k: np.asarray(prompt[k]) for k in ("semantic_prompt", "coarse_prompt", "fine_prompt")}
+
+# --- Result cache ---
+# Keyed on (normalized text, backend, voice, sample rate, kind). Only real model
+# output is cached; the simple-audio fallback is cheap and must not mask a model
+# that loads later.
+
+def _tts_cache_from_env() -> TieredCache:
+    memory = LRUCache(int(float(os.getenv("TTS_CACHE_MAX_MB", 64)) * 1024 * 1024))
+    disk_dir = os.getenv("TTS_CACHE_DIR")
+    disk = None
+    if disk_dir:
+        disk_max = int(float(os.getenv("TTS_CACHE_DISK_MAX_MB", 512)) * 1024 * 1024)
+        disk = DiskCache(disk_dir, max_bytes=disk_max, suffix=".wav")
+    return TieredCache(memory, disk)
+
+tts_cache = _tts_cache_from_env()
+metrics.register_cache("tts", tts_cache)
+
+def normalize_text(text: str) -> str:
+    """Unicode-normalize and collapse whitespace so trivially different inputs share a cache entry."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+def tts_cache_key(text: str, voice: Optional[str], sample_rate: int, kind: str = "wav") -> str:
+    return cache_key(kind, tts_backend, voice or "default", sample_rate, normalize_text(text))
+
+def preseed_cache(phrases: Iterable[str], voice: Optional[str] = None) -> int:
+    """Synthesize phrases that are not cached yet (e.g. at warmup). Returns how many were generated."""
+    lazy_load_model()
+    if tts_backend is None:
+        return 0
+    generated = 0
+    for phrase in phrases:
+        phrase = phrase.strip()
+        if not phrase or tts_cache_key(phrase, voice, output_sample_rate()) in tts_cache:
+            continue
+        generate_speech(phrase, voice)
+        generated += 1
+    return generated
+
+def load_preseed_phrases() -> List[str]:
+    """Phrases listed one per line in the file named by TTS_PRESEED_FILE, if set."""
+    path = os.getenv("TTS_PRESEED_FILE")
+    if not path or not os.path.exists(path):
+        return []
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+# --- Simple audio fallback ---
+# Used when no TTS model is available (or it fails). One short tone per word, so the
+# output length and rhythm track the text instead of always being a fixed beep.
+
+SIMPLE_AUDIO_SECONDS_PER_CHAR = 0.06
+SIMPLE_AUDIO_MIN_SECONDS = 0.3
+SIMPLE_AUDIO_MAX_SECONDS = 15.0
+SIMPLE_AUDIO_AMPLITUDE = 0.3
+SIMPLE_AUDIO_FADE_MS = 10
+
+def simple_audio_duration(text: str) -> float:
+    """Length in seconds of the fallback audio for text, roughly a speaking pace."""
+    seconds = len(normalize_text(text)) * SIMPLE_AUDIO_SECONDS_PER_CHAR
+    return min(max(seconds, SIMPLE_AUDIO_MIN_SECONDS), SIMPLE_AUDIO_MAX_SECONDS)
+
+def _fill_simple_tone(out: np.ndarray, text: str, sample_rate: int, frequency: float):
+    """Write the fallback tone for text into the preallocated int16 array out."""
+    n = out.size
+    words = normalize_text(text).split() or [""]
+    # Each word gets a share of the duration proportional to its length (plus a gap),
+    # at a pitch that moves a little around frequency
+    lengths = np.array([len(w) + 1 for w in words], dtype=np.int64)
+    bounds = np.round(np.concatenate(([0], np.cumsum(lengths))) * (n / lengths.sum())).astype(np.int64)
+    longest = int(np.diff(bounds).max()) if n else 0
+    # float32 scratch buffers, reused for every word (float32 sin is several times faster)
+    ticks = np.arange(longest, dtype=np.float32)
+    tone = np.empty(longest, dtype=np.float32)
+    # Fade each word in and out so tones are click-free and audibly separated
+    fade = max(1, sample_rate * SIMPLE_AUDIO_FADE_MS // 1000)
+    ramp = np.arange(fade, dtype=np.float32) / fade
+    gain = np.float32(32767 * SIMPLE_AUDIO_AMPLITUDE)
+    for start, end, length in zip(bounds[:-1], bounds[1:], lengths):
+        size = int(end - start)
+        if size == 0:
+            continue
+        pitch = frequency * (1.0 + 0.12 * (length % 3 - 1))
+        segment = tone[:size]
+        np.multiply(ticks[:size], np.float32(2 * np.pi * pitch / sample_rate), out=segment)
+        np.sin(segment, out=segment)
+        edge = min(fade, size // 2)
+        segment[:edge] *= ramp[:edge]
+        segment[size - edge:] *= ramp[edge - 1::-1] if edge else ramp[:0]
+        segment *= gain
+        np.copyto(out[start:end], segment, casting="unsafe")
+
+def generate_simple_audio(text: str, sample_rate: int = 22050, frequency: float = 440.0) -> bytes:
+    """Generate simple tone audio (WAV) as fallback when TTS is not available."""
+    buf, samples = wav.allocate(int(sample_rate * simple_audio_duration(text)), sample_rate)
+    _fill_simple_tone(samples, text, sample_rate, frequency)
+    return bytes(buf)
+
+def simple_audio_pcm(text: str, sample_rate: int, frequency: float = 440.0) -> bytes:
+    """Raw 16-bit PCM of the fallback tone, for streams that already sent a header."""
+    samples = np.empty(int(sample_rate * simple_audio_duration(text)), dtype="<i2")
+    _fill_simple_tone(samples, text, sample_rate, frequency)
+    return samples.tobytes()
+
+def generate_speech(text: str, voice: Optional[str] = None, speaker_embedding: Any = None) -> Tuple[bytes, float]:
     """
     Generate speech audio from text using Bark (preferred) or Coqui TTS (fallback).
-    Falls back to simple beep if no TTS libraries are available.
+    Falls back to simple tone audio if no TTS libraries are available.
+    Results from a real model are served from tts_cache on repeat requests.
     """
     lazy_load_model()
     if not text or not text.strip():
         raise ValueError("Text input is empty.")
     
     start_time = time.time()
+    key = tts_cache_key(text, voice, output_sample_rate()) if tts_backend else None
+    if key:
+        cached = tts_cache.get(key)
+        if cached is not None:
+            return cached, round(time.time() - start_time, 2)
     
     try:
-        # Try Bark first
-        if bark_write_wav and bark_sample_rate and callable(tts_model):
-            audio_array = tts_model(text)
-            bark_write_wav("output.wav", bark_sample_rate, audio_array)
-            with open("output.wav", "rb") as f:
-                wav_bytes = f.read()
-        # Try Coqui TTS
-        elif tts_model and hasattr(tts_model, 'tts_to_file'):
-            tts_model.tts_to_file(text=text, file_path="output.wav")
-            with open("output.wav", "rb") as f:
-                wav_bytes = f.read()
+        result = synthesize_array(text, voice, speaker_embedding)
+        if result is not None:
+            audio_array, sample_rate = result
+            with metrics.phase("speak", "encode"):
+                wav_bytes = wav.encode(audio_array, sample_rate)
+            tts_cache.put(key, wav_bytes)
         # Fallback to simple audio
         else:
+            metrics.fallback("tts_simple_audio")
             wav_bytes = generate_simple_audio(text)
         
         latency = round(time.time() - start_time, 2)
         return wav_bytes, latency
         
     except Exception as e:
-        # If all else fails, return simple beep
-        print(f"TTS generation failed: {str(e)}, using fallback")
+        # If all else fails, return simple tone audio
+        logging.warning(f"TTS generation failed: {str(e)}, using fallback")
+        metrics.error("tts")
+        metrics.fallback("tts_simple_audio")
         wav_bytes = generate_simple_audio(text)
         latency = round(time.time() - start_time, 2)
-        return wav_bytes, latency 
\ No newline at end of file
+        return wav_bytes, latency 
+
+# --- Sentence-chunked streaming synthesis ---
+
+FALLBACK_SAMPLE_RATE = 22050
+# Clauses longer than this are split further at commas so the first chunk stays short
+MAX_CHUNK_CHARS = int(os.getenv("TTS_MAX_CHUNK_CHARS", 120))
+
+_SENTENCE_RE = re.compile(r"(?<=[.!?;:])\s+")
+_CLAUSE_RE = re.compile(r"(?<=,)\s+")
+
+
+def split_sentences(text: str) -> List[str]:
+    """Split text into sentences, and over-long sentences into comma clauses."""
+    chunks = []
+    for sentence in _SENTENCE_RE.split(text.strip()):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if len(sentence) <= MAX_CHUNK_CHARS:
+            chunks.append(sentence)
+            continue
+        current = ""
+        for clause in _CLAUSE_RE.split(sentence):
+            if current and len(current) + len(clause) + 1 > MAX_CHUNK_CHARS:
+                chunks.append(current)
+                current = clause
+            else:
+                current = f"{current} {clause}" if current else clause
+        if current:
+            chunks.append(current)
+    return chunks
+
+
+def output_sample_rate() -> int:
+    """Sample rate of the loaded TTS backend."""
+    if tts_backend == "bark":
+        return bark_sample_rate
+    synthesizer = getattr(tts_model, "synthesizer", None)
+    if synthesizer is not None and getattr(synthesizer, "output_sample_rate", None):
+        return synthesizer.output_sample_rate
+    return FALLBACK_SAMPLE_RATE
+
+
+def synthesize_pcm(text: str, sample_rate: int, voice: Optional[str] = None, speaker_embedding: Any = None) -> bytes:
+    """
+    Synthesize one sentence/clause to raw 16-bit mono PCM at sample_rate.
+    Falls back to the simple tone (at the same rate) so a stream never changes format mid-way.
+    """
+    lazy_load_model()
+    key = tts_cache_key(text, voice, sample_rate, kind="pcm") if tts_backend else None
+    if key:
+        cached = tts_cache.get(key)
+        if cached is not None:
+            return cached
+    try:
+        result = synthesize_array(text, voice, speaker_embedding)
+        if result is not None:
+            with metrics.phase("speak", "encode"):
+                pcm = wav.float_to_pcm16(result[0])
+            tts_cache.put(key, pcm)
+            return pcm
+    except Exception as e:
+        logging.warning(f"TTS chunk generation failed: {str(e)}, using fallback")
+        metrics.error("tts")
+    metrics.fallback("tts_simple_audio")
+    return simple_audio_pcm(text, sample_rate)
@@ -0,0 +1,172 @@
+# backend/startup_profile.py
+# Cold-start profiler (STARTUP_PROFILE=1): per-module import times and per-phase startup timings
+import logging
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+ENABLED = os.getenv("STARTUP_PROFILE", "").strip().lower() in ("1", "true", "yes", "on")
+# Slowest modules listed in the report
+TOP_MODULES = int(os.getenv("STARTUP_PROFILE_TOP", 25))
+
+
+class _TimingFinder:
+    """
+    A meta path finder that finds nothing itself: it asks the finders after it
+    and wraps the exec_module of the loader they return, so each module's
+    execution is timed (like python -X importtime, but from inside the app and
+    including imports made later, e.g. by model loads in background threads).
+    """
+    def __init__(self, profile: "StartupProfile"):
+        self.profile = profile
+
+    def find_spec(self, name, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self:
+                continue
+            find = getattr(finder, "find_spec", None)
+            if find is None:
+                continue
+            spec = find(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # Builtin and frozen importers are classes, not instances, and cost next to nothing
+        if loader is not None and hasattr(loader, "__dict__") and "exec_module" not in vars(loader):
+            loader.exec_module = self.profile._timed(name, loader, loader.exec_module)
+        return spec
+
+
+class StartupProfile:
+    """
+    Startup timeline of this process. mark(phase) records when a phase ended;
+    imports are timed from install() until the first request has been served,
+    so heavy dependencies imported lazily (on model load or first use) show up too.
+    """
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.started_wall = time.time()
+        self.marks: List[tuple] = []
+        self.imports: Dict[str, List[float]] = {}  # module -> [cumulative seconds, self seconds]
+        self.first_request: Optional[Dict[str, Any]] = None
+        self._finder = _TimingFinder(self)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def install(self):
+        if self._finder not in sys.meta_path:
+            sys.meta_path.insert(0, self._finder)
+
+    def uninstall(self):
+        if self._finder in sys.meta_path:
+            sys.meta_path.remove(self._finder)
+
+    def _timed(self, name: str, loader, exec_module):
+        def exec_timed(module):
+            # One-shot: later reloads through this loader run untimed
+            vars(loader).pop("exec_module", None)
+            stack = self._local.__dict__.setdefault("stack", [])
+            frame = [time.perf_counter(), 0.0]  # start, time spent in nested imports
+            stack.append(frame)
+            try:
+                exec_module(module)
+            finally:
+                stack.pop()
+                total = time.perf_counter() - frame[0]
+                if stack:
+                    stack[-1][1] += total
+                with self._lock:
+                    self.imports[name] = [total, total - frame[1]]
+        return exec_timed
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def mark(self, phase: str):
+        """Record that phase has just ended; only the first mark of a phase counts."""
+        with self._lock:
+            if all(name != phase for name, _ in self.marks):
+                self.marks.append((phase, self.elapsed()))
+
+    def request_served(self, method: str, path: str, latency: float):
+        """Called after each request; the first one completes the profile."""
+        with self._lock:
+            if self.first_request is not None:
+                return
+            self.first_request = {
+                "method": method,
+                "path": path,
+                "latency_s": round(latency, 4),
+                "since_start_s": round(self.elapsed(), 4),
+            }
+        self.mark("first_request")
+        self.uninstall()
+        self.log()
+
+    def report(self, model_status: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+        with self._lock:
+            marks = sorted(self.marks, key=lambda mark: mark[1])
+            imports = dict(self.imports)
+            first_request = self.first_request
+        phases = []
+        previous = 0.0
+        for phase, at in marks:
+            phases.append({"phase": phase, "at_s": round(at, 4), "took_s": round(at - previous, 4)})
+            previous = at
+        slowest = sorted(imports.items(), key=lambda item: item[1][0], reverse=True)[:TOP_MODULES]
+        return {
+            # Interpreter start-up and everything imported before this module (uvicorn itself etc.)
+            "before_profile_s": round(self.started_wall - _process_start(), 4) if psutil is not None else None,
+            "phases": phases,
+            "models": {
+                name: {"state": status["state"], "load_seconds": status["load_seconds"]}
+                for name, status in (model_status or {}).items()
+            },
+            "first_request": first_request,
+            "imports": {
+                "modules": len(imports),
+                "top": [
+                    {"module": name, "cumulative_ms": round(total * 1000, 1), "self_ms": round(own * 1000, 1)}
+                    for name, (total, own) in slowest
+                ],
+            },
+        }
+
+    def log(self):
+        from backend import models
+        report = self.report(models.registry.status())
+        phases = ", ".join(f"{p['phase']} +{p['took_s']:.3f}s" for p in report["phases"])
+        logging.info(f"Startup profile: {phases}")
+        for name, status in report["models"].items():
+            took = f" in {status['load_seconds']}s" if status["load_seconds"] is not None else ""
+            logging.info(f"Startup profile: model '{name}' {status['state']}{took}")
+        for entry in report["imports"]["top"][:10]:
+            logging.info(
+                f"Startup profile: import {entry['module']} {entry['cumulative_ms']} ms "
+                f"(self {entry['self_ms']} ms)"
+            )
+
+
+def _process_start() -> float:
+    return psutil.Process().create_time()
+
+
+# Installed as early as possible: main imports this module before anything else
+profile: Optional[StartupProfile] = None
+if ENABLED:
+    profile = StartupProfile()
+    profile.install()
+
+
+def mark(phase: str):
+    if profile is not None:
+        profile.mark(phase)
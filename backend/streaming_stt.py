@@ -0,0 +1,251 @@
+# backend/streaming_stt.py
+# Incremental transcription for audio that arrives in chunks (WebSocket /ws/transcribe)
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from backend import transcribe
+
+FRAME_MS = 30
+# RMS above this (on [-1, 1] audio) counts as speech; ~ -40 dBFS
+VAD_THRESHOLD = float(os.getenv("STREAM_VAD_THRESHOLD", 0.01))
+# Trailing silence that ends an utterance
+END_SILENCE_MS = int(os.getenv("STREAM_END_SILENCE_MS", 600))
+# New audio needed before another partial transcript is attempted
+PARTIAL_INTERVAL_MS = int(os.getenv("STREAM_PARTIAL_INTERVAL_MS", 1000))
+# Partials only re-transcribe the most recent part of the utterance
+WINDOW_SECONDS = float(os.getenv("STREAM_WINDOW_SECONDS", 10))
+# Speech that never pauses is finalized at this length (one Whisper window)
+MAX_UTTERANCE_S = float(os.getenv("STREAM_MAX_UTTERANCE_S", 30))
+
+FORMATS = {"pcm16", "webm"}
+
+
+class StreamDecoder:
+    """
+    Decodes one growing WebM/Opus stream with a single PyAV container, so each chunk is
+    demuxed and decoded once. PyAV pulls input through read(), which blocks until more
+    is fed, so the container lives on its own thread; decode() hands back the samples
+    decoded since the last call once everything fed so far has been consumed.
+    """
+    def __init__(self, sampling_rate: int = transcribe.SAMPLE_RATE):
+        self.sampling_rate = sampling_rate
+        self.error: Optional[Exception] = None
+        self._cond = threading.Condition()
+        self._input = bytearray()
+        self._closed = False
+        self._idle = False  # the decoder thread is waiting for input
+        self._output: List[np.ndarray] = []
+        self._thread = threading.Thread(target=self._run, name="stream-decoder", daemon=True)
+        self._thread.start()
+
+    def read(self, size: int = -1) -> bytes:
+        """File-like read for PyAV: block until input arrives; b"" (EOF) once closed."""
+        with self._cond:
+            while not self._input and not self._closed:
+                self._idle = True
+                self._cond.notify_all()
+                self._cond.wait()
+            self._idle = False
+            size = len(self._input) if size is None or size < 0 else size
+            data = bytes(self._input[:size])
+            del self._input[:size]
+            return data
+
+    def _run(self):
+        try:
+            import av
+            # Only the header is needed to set up the Opus stream; don't wait for seconds of audio first
+            with av.open(self, mode="r", format="matroska", options={"probesize": "32", "analyzeduration": "0"}) as container:
+                resampler = av.AudioResampler(format="s16", layout="mono", rate=self.sampling_rate)
+                for frame in container.decode(audio=0):
+                    self._emit(resampler.resample(frame))
+                self._emit(resampler.resample(None))
+        except Exception as e:
+            logging.warning(f"Streaming WebM decode failed: {e}")
+            self.error = e
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+
+    def _emit(self, frames):
+        for frame in frames:
+            samples = frame.to_ndarray().reshape(-1).astype(np.float32) / 32768.0
+            with self._cond:
+                self._output.append(samples)
+
+    def decode(self, data: bytes = b"", timeout: float = 5.0) -> np.ndarray:
+        """Feed data; return every sample decoded so far that hasn't been returned yet."""
+        with self._cond:
+            if data and not self._closed:
+                self._input.extend(data)
+                self._idle = False
+                self._cond.notify_all()
+            self._cond.wait_for(lambda: self._closed or (self._idle and not self._input), timeout)
+            samples = np.concatenate(self._output) if self._output else np.zeros(0, dtype=np.float32)
+            self._output = []
+        return samples
+
+    def close(self, timeout: float = 5.0) -> np.ndarray:
+        """End of input: let the decoder drain, stop its thread and return the remaining samples."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join(timeout)
+        return self.decode()
+
+
+class StreamingTranscriber:
+    """
+    Accumulates audio chunks for one client, runs an energy VAD over 30 ms frames,
+    and produces partial transcripts over a sliding window while the user speaks and
+    a final transcript for the whole utterance once they stop.
+    Not thread-safe: the caller must not run process()/flush() concurrently.
+
+    pcm16: chunks are raw little-endian 16-bit mono PCM at sample_rate.
+    pcm16 at other rates is resampled with a StreamResampler, continuously across chunks.
+    webm: chunks are consecutive pieces of one MediaRecorder WebM/Opus stream; they are
+    not independently decodable, so they are fed to one StreamDecoder per recording
+    (a new one after flush(), since a new recording starts a new container).
+    Call close() when the client goes away to stop the decoder thread.
+    """
+    def __init__(self, audio_format: str = "pcm16", sample_rate: int = transcribe.SAMPLE_RATE):
+        if audio_format not in FORMATS:
+            raise ValueError(f"Unsupported stream format: {audio_format}")
+        self.audio_format = audio_format
+        self.sample_rate = sample_rate
+        self._frame = transcribe.SAMPLE_RATE * FRAME_MS // 1000
+        self._max_utterance = int(MAX_UTTERANCE_S * transcribe.SAMPLE_RATE)
+        self._decoder: Optional[StreamDecoder] = None
+        self._resampler = transcribe.StreamResampler(sample_rate)
+        self._pcm_remainder = b""
+        self._pending = np.zeros(0, dtype=np.float32)  # samples not yet run through the VAD
+        self._utterance: List[np.ndarray] = []
+        self._utterance_len = 0
+        self._in_speech = False
+        self._silence_ms = 0
+        self._since_partial = 0
+        self._last_partial = ""
+        self._speech_ended_at: Optional[float] = None
+        # Earlier turns of the conversation, passed to Whisper with every utterance
+        self.initial_prompt: Optional[str] = None
+
+    def add_chunk(self, data: bytes):
+        if self.audio_format == "pcm16":
+            data = self._pcm_remainder + data
+            usable = len(data) - len(data) % 2
+            self._pcm_remainder = data[usable:]
+            samples = np.frombuffer(data[:usable], dtype="<i2").astype(np.float32) / 32768.0
+            samples = self._resampler.process(samples)
+        else:
+            if self._decoder is None:
+                self._decoder = StreamDecoder()
+            samples = self._decoder.decode(data)
+        self._pending = np.concatenate([self._pending, samples])
+
+    def _end_input(self):
+        """The client stopped recording: take the audio held back by the resampler or decoder."""
+        if self.audio_format == "pcm16":
+            tail = self._resampler.process(np.zeros(0, dtype=np.float32), final=True)
+            self._resampler = transcribe.StreamResampler(self.sample_rate)
+            self._pcm_remainder = b""
+        elif self._decoder is not None:
+            tail = self._decoder.close()
+            self._decoder = None
+        else:
+            return
+        self._pending = np.concatenate([self._pending, tail])
+
+    def close(self):
+        """Stop the WebM decoder thread, if one is running."""
+        if self._decoder is not None:
+            self._decoder.close(timeout=0)
+            self._decoder = None
+
+    def _run_vad(self) -> bool:
+        """
+        Consume whole frames from the pending buffer; True when an utterance just ended,
+        either on trailing silence or on reaching MAX_UTTERANCE_S.
+        """
+        usable = self._pending.size - self._pending.size % self._frame
+        if usable == 0:
+            return False
+        frames = self._pending[:usable].reshape(-1, self._frame)
+        self._pending = self._pending[usable:]
+        voiced = np.sqrt(np.mean(frames * frames, axis=1)) > VAD_THRESHOLD
+        for i, (frame, is_voiced) in enumerate(zip(frames, voiced)):
+            if is_voiced:
+                self._in_speech = True
+                self._silence_ms = 0
+            elif self._in_speech:
+                self._silence_ms += FRAME_MS
+            if self._in_speech:
+                self._utterance.append(frame)
+                self._utterance_len += frame.size
+                self._since_partial += frame.size
+                if self._silence_ms >= END_SILENCE_MS or self._utterance_len >= self._max_utterance:
+                    self._speech_ended_at = time.perf_counter()
+                    # Frames after the end of speech belong to the next utterance
+                    self._pending = np.concatenate([frames[i + 1:].ravel(), self._pending])
+                    return True
+        return False
+
+    def _utterance_audio(self, seconds: Optional[float] = None) -> np.ndarray:
+        audio = np.concatenate(self._utterance) if self._utterance else np.zeros(0, dtype=np.float32)
+        if seconds is not None:
+            audio = audio[-int(seconds * transcribe.SAMPLE_RATE):]
+        return audio
+
+    def _finish_utterance(self) -> Dict:
+        audio = self._utterance_audio()
+        started = time.perf_counter()
+        text = transcribe.transcribe_array(audio, self.initial_prompt).strip()
+        ended_at = self._speech_ended_at or started
+        event = {
+            "type": "final",
+            "text": text,
+            "duration": round(audio.size / transcribe.SAMPLE_RATE, 2),
+            "latency": round(time.perf_counter() - ended_at, 3),
+        }
+        self._utterance = []
+        self._utterance_len = 0
+        self._in_speech = False
+        self._silence_ms = 0
+        self._since_partial = 0
+        self._last_partial = ""
+        self._speech_ended_at = None
+        return event
+
+    def process(self) -> List[Dict]:
+        """Run VAD over new audio and Whisper where needed; returns events to send."""
+        events = []
+        if self._run_vad():
+            events.append(self._finish_utterance())
+            # Audio after the end of speech may already contain the next utterance
+            if self._pending.size >= self._frame:
+                events.extend(self.process())
+            return events
+        partial_due = self._since_partial * 1000 >= PARTIAL_INTERVAL_MS * transcribe.SAMPLE_RATE
+        if self._in_speech and partial_due:
+            self._since_partial = 0
+            text = transcribe.transcribe_array(self._utterance_audio(WINDOW_SECONDS), self.initial_prompt).strip()
+            if text and text != self._last_partial:
+                self._last_partial = text
+                events.append({"type": "partial", "text": text})
+        return events
+
+    def flush(self) -> List[Dict]:
+        """End of stream from the client: finalize whatever speech is buffered."""
+        self._end_input()
+        events = []
+        while self._run_vad():
+            events.append(self._finish_utterance())
+        if self._utterance_len:
+            self._speech_ended_at = time.perf_counter()
+            events.append(self._finish_utterance())
+        return events
@@ -0,0 +1,353 @@
+# backend/tracing.py
+# Per-request span tracing: Server-Timing headers and sampled traces to JSONL or an OTLP/HTTP collector
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+# Fraction of requests whose full trace is exported (0 = none, 1 = all)
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0))
+# Also export every request slower than this, whatever the sample rate (0 = off); for tail latency
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 0))
+# Exported traces are appended here, one JSON object per line (empty = no file)...
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join(tempfile.gettempdir(), "daylily_traces.jsonl"))
+# ...or, if set, POSTed as OTLP/HTTP JSON (e.g. http://localhost:4318/v1/traces)
+TRACE_OTLP_URL = os.getenv("TRACE_OTLP_URL")
+# Server-Timing response header with the spans finished before the response starts
+TRACE_SERVER_TIMING = os.getenv("TRACE_SERVER_TIMING", "1") == "1"
+# Traces waiting for the exporter thread; more are dropped rather than slowing requests
+TRACE_QUEUE_SIZE = int(os.getenv("TRACE_QUEUE_SIZE", 1000))
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "daylily")
+
+_TRACEPARENT_RE = re.compile(r"^[0-9a-f]{2}-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+# Server-Timing metric names are HTTP tokens
+_TOKEN_RE = re.compile(r"[^!#$%&'*+\-.^_`|~0-9A-Za-z]")
+MAX_SERVER_TIMING_ENTRIES = 20
+
+
+def _new_id(nbytes: int) -> str:
+    return f"{random.getrandbits(nbytes * 8):0{nbytes * 2}x}"
+
+
+class Span:
+    """One timed operation; times are time.perf_counter() values."""
+    __slots__ = ("span_id", "parent_id", "name", "start", "end", "attrs", "thread")
+
+    def __init__(self, name: str, parent_id: Optional[str], start: float, attrs: Dict[str, Any]):
+        self.span_id = _new_id(8)
+        self.parent_id = parent_id
+        self.name = name
+        self.start = start
+        self.end: Optional[float] = None
+        self.attrs = attrs
+        self.thread = threading.current_thread().name
+
+
+class Trace:
+    """
+    The spans of one request. The trace id continues an incoming W3C traceparent when
+    there is one; the session id is attached once the request has resolved its session,
+    so traces can be grouped by session (and a session's requests found by trace id).
+    Spans may be added from any thread running in the request's context.
+    """
+    __slots__ = (
+        "trace_id", "root", "session_id", "started_wall", "method", "route", "status", "spans", "_lock"
+    )
+
+    def __init__(self, trace_id: Optional[str] = None, parent_id: Optional[str] = None):
+        self.trace_id = trace_id or _new_id(16)
+        self.root = Span("request", parent_id, time.perf_counter(), {})
+        self.started_wall = time.time()
+        self.session_id: Optional[str] = None
+        self.method: Optional[str] = None
+        self.route: Optional[str] = None
+        self.status: Optional[int] = None
+        self.spans: List[Span] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_traceparent(cls, header: Optional[str]) -> "Trace":
+        match = _TRACEPARENT_RE.match(header.strip().lower()) if header else None
+        if match and match.group(1) != "0" * 32:
+            return cls(match.group(1), match.group(2))
+        return cls()
+
+    @property
+    def duration(self) -> float:
+        return (self.root.end or time.perf_counter()) - self.root.start
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def server_timing(self, now: float) -> str:
+        """Server-Timing value: finished spans summed by name, then the total so far."""
+        totals: Dict[str, List[float]] = {}
+        with self._lock:
+            spans = list(self.spans)
+        for span in spans:
+            entry = totals.setdefault(span.name, [0.0, 0])
+            entry[0] += span.end - span.start
+            entry[1] += 1
+        parts = []
+        for name, (seconds, count) in list(totals.items())[:MAX_SERVER_TIMING_ENTRIES]:
+            desc = f';desc="x{count}"' if count > 1 else ""
+            parts.append(f"{_TOKEN_RE.sub('_', name)};dur={seconds * 1000:.1f}{desc}")
+        parts.append(f"total;dur={(now - self.root.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        base = self.root.start
+        with self._lock:
+            spans = list(self.spans)
+        return {
+            "trace_id": self.trace_id,
+            "session_id": self.session_id,
+            "method": self.method,
+            "route": self.route,
+            "status": self.status,
+            "start": round(self.started_wall, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "spans": [
+                {
+                    "span_id": s.span_id,
+                    "parent_id": s.parent_id,
+                    "name": s.name,
+                    "start_ms": round((s.start - base) * 1000, 3),
+                    "duration_ms": round((s.end - s.start) * 1000, 3),
+                    "thread": s.thread,
+                    **({"attrs": s.attrs} if s.attrs else {}),
+                }
+                for s in sorted(spans, key=lambda s: s.start)
+            ],
+        }
+
+    def to_otlp_spans(self) -> List[Dict[str, Any]]:
+        def nanos(t: float) -> str:
+            return str(int((self.started_wall + t - self.root.start) * 1e9))
+
+        def attributes(attrs: Dict[str, Any]) -> List[Dict[str, Any]]:
+            return [{"key": k, "value": {"stringValue": str(v)}} for k, v in attrs.items() if v is not None]
+
+        root_attrs = {
+            "http.request.method": self.method, "http.route": self.route,
+            "http.response.status_code": self.status, "session.id": self.session_id,
+        }
+        with self._lock:
+            spans = [self.root] + list(self.spans)
+        return [
+            {
+                "traceId": self.trace_id,
+                "spanId": s.span_id,
+                **({"parentSpanId": s.parent_id} if s.parent_id else {}),
+                "name": f"{self.method} {self.route}" if s is self.root else s.name,
+                "kind": 2 if s is self.root else 1,  # SERVER / INTERNAL
+                "startTimeUnixNano": nanos(s.start),
+                "endTimeUnixNano": nanos(s.end),
+                "attributes": attributes(root_attrs if s is self.root else dict(s.attrs, thread=s.thread)),
+            }
+            for s in spans
+        ]
+
+
+# The trace of the request being handled, and the span new spans nest under
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("trace", default=None)
+_current_parent: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("trace_parent", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[None]:
+    """Time the enclosed block as a span of the current request; a no-op outside one."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    s = Span(name, _current_parent.get(), time.perf_counter(), attrs)
+    token = _current_parent.set(s.span_id)
+    try:
+        yield
+    finally:
+        s.end = time.perf_counter()
+        _current_parent.reset(token)
+        trace.add(s)
+
+
+def record(name: str, start: float, end: float, **attrs):
+    """Add a span measured elsewhere (perf_counter start/end), e.g. time spent queued."""
+    trace = _current_trace.get()
+    if trace is None:
+        return
+    s = Span(name, _current_parent.get(), start, attrs)
+    s.end = end
+    trace.add(s)
+
+
+def set_session(session_id: str):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.session_id = session_id
+
+
+# --- Export ---
+
+class TraceSink:
+    """
+    Exports sampled traces from a background thread, in batches: appended to a
+    JSONL file, or POSTed to an OTLP/HTTP (JSON) collector. offer() never blocks;
+    when the exporter falls behind, traces are dropped and counted.
+    """
+    BATCH_SIZE = 100
+    BATCH_WAIT_S = 1.0
+
+    def __init__(self, path: Optional[str], otlp_url: Optional[str], max_queue: int):
+        self.path = path
+        self.otlp_url = otlp_url
+        self._queue: "queue.Queue[Trace]" = queue.Queue(max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def offer(self, trace: Trace):
+        if not self.path and not self.otlp_url:
+            return
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._loop, name="trace-export", daemon=True)
+                    self._thread.start()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.dropped += 1
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.BATCH_WAIT_S
+            while len(batch) < self.BATCH_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                if self.otlp_url:
+                    self._post_otlp(batch)
+                else:
+                    self._write_jsonl(batch)
+                self.exported += len(batch)
+            except Exception as e:
+                self.failed += len(batch)
+                logging.warning(f"Exporting {len(batch)} traces failed: {e}")
+
+    def _write_jsonl(self, batch: List[Trace]):
+        lines = "".join(json.dumps(trace.to_dict(), separators=(",", ":")) + "\n" for trace in batch)
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+    def _post_otlp(self, batch: List[Trace]):
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+                "scopeSpans": [{
+                    "scope": {"name": "backend.tracing"},
+                    "spans": [s for trace in batch for s in trace.to_otlp_spans()],
+                }],
+            }]
+        }
+        request = urllib.request.Request(
+            self.otlp_url, data=json.dumps(body).encode(), headers={"Content-Type": "application/json"}, method="POST"
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            response.read()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": TRACE_SAMPLE_RATE,
+            "slow_ms": TRACE_SLOW_MS,
+            "target": self.otlp_url or self.path,
+            "queued": self._queue.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "failed": self.failed,
+        }
+
+
+sink = TraceSink(TRACE_FILE, TRACE_OTLP_URL, TRACE_QUEUE_SIZE)
+
+
+def sampled(trace: Trace) -> bool:
+    if TRACE_SLOW_MS and trace.duration * 1000 >= TRACE_SLOW_MS:
+        return True
+    return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware giving each HTTP request a Trace. The response headers carry
+    X-Trace-ID and Server-Timing (spans that finished before the response started,
+    so not the streaming of a body); the exported trace also has a "response" span
+    covering the body from the first header byte to the last chunk.
+    """
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for name, value in scope.get("headers", ()):
+            if name == b"traceparent":
+                traceparent = value.decode("latin-1")
+                break
+        trace = Trace.from_traceparent(traceparent)
+        trace.method = scope["method"]
+        trace_token = _current_trace.set(trace)
+        parent_token = _current_parent.set(trace.root.span_id)
+        response_started: Optional[float] = None
+
+        async def send_traced(message):
+            nonlocal response_started
+            if message["type"] == "http.response.start":
+                response_started = time.perf_counter()
+                trace.status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-trace-id", trace.trace_id.encode()))
+                if TRACE_SERVER_TIMING:
+                    headers.append((b"server-timing", trace.server_timing(response_started).encode()))
+                    headers.append((b"timing-allow-origin", b"*"))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_traced)
+        finally:
+            trace.root.end = time.perf_counter()
+            if response_started is not None:
+                response = Span("response", trace.root.span_id, response_started, {})
+                response.end = trace.root.end
+                trace.add(response)
+            route = scope.get("route")
+            trace.route = getattr(route, "path", None) or "unmatched"
+            _current_parent.reset(parent_token)
+            _current_trace.reset(trace_token)
+            if sampled(trace):
+                sink.offer(trace)
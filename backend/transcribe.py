@@ -1,81 +1,315 @@
 # backend/transcribe.py
-# Placeholder for speech-to-text (WAV to text) logic 
+# Speech-to-text with faster-whisper, decoding uploads in memory
 from fastapi import UploadFile
-from typing import Dict
-import time
-from faster_whisper import WhisperModel
-from pydub import AudioSegment
-import tempfile
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+import bisect
+import logging
 import os
+import time
+import wave
+import numpy as np
 
+from backend import metrics, models
+from backend.batching import MicroBatcher
+
+# faster_whisper (and ctranslate2/PyAV/tokenizers under it) is imported only where it is
+# used, so importing this module stays cheap and cold starts don't pay for it up front
 model = None
+model_path: Optional[str] = None
 
-def lazy_load_model():
+# Whisper's native input format
+SAMPLE_RATE = 16000
+
+def _load_model():
+    global model, model_path
+    from faster_whisper import WhisperModel
+    from faster_whisper.utils import download_model
+    # Load the Whisper model (tiny for speed/VRAM); the path is kept to size its weights
+    model_path = download_model("tiny")
+    model = WhisperModel(model_path, device="cpu", compute_type="int8")
+
+def _unload_model():
     global model
-    if model is None:
-        # Load the Whisper model (tiny for speed/VRAM)
-        model = WhisperModel("tiny", device="cpu", compute_type="int8")
+    model = None
+
+def _footprint() -> Optional[int]:
+    """Size of the CTranslate2 weights file, an estimate of the loaded model's memory."""
+    weights = os.path.join(model_path, "model.bin") if model_path else None
+    return os.path.getsize(weights) if weights and os.path.exists(weights) else None
+
+models.registry.register("whisper", _load_model, _unload_model, _footprint)
+
+def lazy_load_model():
+    """Load Whisper once; concurrent callers wait for the same load."""
+    models.ensure("whisper")
 
 SUPPORTED_TYPES = {"audio/wav", "audio/x-wav", "audio/wave", "audio/mp3", "audio/mpeg", "audio/webm", "audio/webm;codecs=opus"}
+WAV_TYPES = {"audio/wav", "audio/x-wav", "audio/wave"}
+
+_PCM_DTYPES = {1: np.uint8, 2: np.dtype("<i2"), 4: np.dtype("<i4")}
+_RESAMPLE_TAPS = 63
+
+
+def _lowpass_taps(rate: int) -> np.ndarray:
+    """Anti-aliasing filter for downsampling from rate to 16 kHz (a single unit tap otherwise)."""
+    if rate <= SAMPLE_RATE:
+        return np.ones(1, dtype=np.float32)
+    cutoff = 0.5 * SAMPLE_RATE / rate
+    n = np.arange(_RESAMPLE_TAPS) - (_RESAMPLE_TAPS - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(_RESAMPLE_TAPS)
+    return (taps / taps.sum()).astype(np.float32)
+
+
+def resample(audio: np.ndarray, rate: int) -> np.ndarray:
+    """Resample to 16 kHz: windowed-sinc low-pass (when downsampling), then linear interpolation."""
+    if rate == SAMPLE_RATE:
+        return audio
+    if rate > SAMPLE_RATE:
+        audio = np.convolve(audio, _lowpass_taps(rate), mode="same")
+    positions = np.arange(int(audio.size * SAMPLE_RATE / rate)) * (rate / SAMPLE_RATE)
+    return np.interp(positions, np.arange(audio.size), audio).astype(np.float32)
+
+
+class StreamResampler:
+    """
+    resample() for audio that arrives in chunks: the filter and interpolation carry over
+    chunk boundaries, so the concatenated output matches resampling the whole stream at
+    once. Output that depends on samples not received yet is held back until the next
+    chunk, or until process(final=True).
+    """
+    def __init__(self, rate: int):
+        self.rate = rate
+        self._taps = _lowpass_taps(rate)
+        self._half = (self._taps.size - 1) // 2
+        self._step = rate / SAMPLE_RATE
+        self._input = np.zeros(0, dtype=np.float32)  # unfiltered input, starting at _offset
+        self._offset = 0
+        self._next = 0  # index of the next output sample
+
+    def process(self, samples: np.ndarray, final: bool = False) -> np.ndarray:
+        if self.rate == SAMPLE_RATE:
+            return samples
+        self._input = np.concatenate([self._input, samples.astype(np.float32, copy=False)])
+        total = self._offset + self._input.size
+        if final:
+            end = int(total * SAMPLE_RATE / self.rate)
+        else:
+            # Interpolating output k reads filtered input at floor(k*step)+1, which needs _half more samples
+            ready = total - 2 - self._half
+            end = int(ready // self._step) + 1 if ready >= 0 else 0
+        if end <= self._next:
+            return np.zeros(0, dtype=np.float32)
+        positions = np.arange(self._next, end) * self._step
+        lo = int(positions[0])
+        hi = min(int(positions[-1]) + 1, total - 1)
+        # Raw input around [lo, hi], zero-padded past either end of the stream like mode="same"
+        start = lo - self._half - self._offset
+        stop = hi + self._half + 1 - self._offset
+        window = self._input[max(0, start):max(0, min(stop, self._input.size))]
+        window = np.concatenate([
+            np.zeros(max(0, -start), dtype=np.float32),
+            window,
+            np.zeros(max(0, stop - max(start, self._input.size)), dtype=np.float32),
+        ])
+        filtered = np.convolve(window, self._taps, mode="valid")
+        out = np.interp(positions, np.arange(lo, hi + 1), filtered).astype(np.float32)
+        self._next = end
+        # Keep only the input later outputs can still read
+        keep_from = max(self._offset, int(self._next * self._step) - self._half)
+        self._input = self._input[keep_from - self._offset:]
+        self._offset = keep_from
+        return out
+
+
+def _decode_wav(stream: BinaryIO) -> Optional[np.ndarray]:
+    """
+    Fast path for PCM WAV: read samples straight into numpy, downmix and resample.
+    Returns None for anything the wave module can't parse (float WAV, WAVE_FORMAT_EXTENSIBLE, ...).
+    """
+    try:
+        with wave.open(stream, "rb") as wav:
+            if wav.getsampwidth() not in _PCM_DTYPES:
+                return None
+            rate = wav.getframerate()
+            channels = wav.getnchannels()
+            width = wav.getsampwidth()
+            frames = wav.readframes(wav.getnframes())
+    except (wave.Error, EOFError):
+        return None
+    samples = np.frombuffer(frames, dtype=_PCM_DTYPES[width])
+    if width == 1:
+        audio = (samples.astype(np.float32) - 128.0) / 128.0
+    else:
+        audio = samples.astype(np.float32) / float(2 ** (8 * width - 1))
+    if channels > 1:
+        audio = audio.reshape(-1, channels).mean(axis=1)
+    return resample(audio, rate)
+
+
+def av_decode_audio(stream: BinaryIO, sampling_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Decode any container/codec PyAV understands to mono float32 at sampling_rate."""
+    from faster_whisper.audio import decode_audio
+    return decode_audio(stream, sampling_rate=sampling_rate)
+
+
+def decode_upload(stream: BinaryIO, content_type: Optional[str] = None) -> np.ndarray:
+    """
+    Decode an uploaded WAV/MP3/WebM(Opus) stream to 16 kHz mono float32 in memory.
+    PCM WAV is read directly with numpy; everything else goes through PyAV (which
+    faster-whisper already depends on), so there are no temp files or re-encodes.
+    """
+    with metrics.phase("transcribe", "decode"):
+        stream.seek(0)
+        if content_type is None or content_type in WAV_TYPES:
+            audio = _decode_wav(stream)
+            if audio is not None:
+                return audio
+            stream.seek(0)
+        return av_decode_audio(stream, sampling_rate=SAMPLE_RATE)
 
 
-def transcribe_audio(file: UploadFile) -> Dict:
+# --- Cross-request batching ---
+# Concurrent requests are coalesced for up to WHISPER_BATCH_WAIT_MS (or until
+# WHISPER_BATCH_SIZE are waiting) and decoded together by faster-whisper's
+# BatchedInferencePipeline. WHISPER_BATCH_SIZE=1 turns batching off.
+BATCH_SIZE = int(os.getenv("WHISPER_BATCH_SIZE", 4))
+BATCH_WAIT_MS = float(os.getenv("WHISPER_BATCH_WAIT_MS", 10))
+# Only utterances that fit in one 30 s Whisper window are batched
+MAX_BATCH_SAMPLES = 30 * SAMPLE_RATE
+# Silence laid between utterances when they are handed to the pipeline as one clip list
+_BATCH_GAP_SAMPLES = SAMPLE_RATE // 10
+
+
+def _transcribe_one(audio: np.ndarray, initial_prompt: Optional[str] = None) -> str:
+    segments, info = model.transcribe(audio, beam_size=1, initial_prompt=initial_prompt)
+    return "".join([seg.text for seg in segments])
+
+
+def _utterance_language(audio: np.ndarray) -> Optional[str]:
+    """Language of one utterance, as model.transcribe would detect it (None for English-only models)."""
+    if not model.model.is_multilingual:
+        return None
+    language, _, _ = model.detect_language(audio)
+    return language
+
+
+def _transcribe_clips(audios: List[np.ndarray], initial_prompt: Optional[str], language: Optional[str]) -> List[str]:
+    """
+    Decode several <=30 s utterances in one BatchedInferencePipeline call: they are laid
+    end to end as separate clips, and each segment is mapped back to its clip by seek.
+    """
+    from faster_whisper import BatchedInferencePipeline
+
+    starts = []
+    offset = 0
+    for audio in audios:
+        starts.append(offset)
+        offset += audio.size + _BATCH_GAP_SAMPLES
+    joined = np.zeros(offset, dtype=np.float32)
+    for start, audio in zip(starts, audios):
+        joined[start:start + audio.size] = audio
+    segments, info = BatchedInferencePipeline(model).transcribe(
+        joined,
+        language=language,
+        beam_size=1,
+        initial_prompt=initial_prompt,
+        batch_size=len(audios),
+        clip_timestamps=[
+            {"start": start / SAMPLE_RATE, "end": (start + audio.size) / SAMPLE_RATE}
+            for start, audio in zip(starts, audios)
+        ],
+    )
+    # The pipeline stamps each segment with its clip's offset in frames
+    seeks = [int(start / SAMPLE_RATE * model.frames_per_second) for start in starts]
+    texts = [[] for _ in audios]
+    for seg in segments:
+        texts[max(bisect.bisect_right(seeks, seg.seek) - 1, 0)].append(seg.text)
+    return ["".join(parts) for parts in texts]
+
+
+def _transcribe_batch(items: List[Tuple[np.ndarray, Optional[str]]]) -> List[Union[str, Exception]]:
+    """
+    Transcripts for a batch, in order. Short utterances sharing a prompt and language
+    are decoded together; a lone utterance (or a long or empty one) goes through
+    model.transcribe as it would unbatched. An utterance that fails on that path gets
+    its exception instead of a transcript.
+    """
+    results: List[Union[str, Exception, None]] = [None] * len(items)
+    groups: Dict[Tuple[Optional[str], Optional[str]], List[int]] = {}
+    short = [i for i, (audio, _) in enumerate(items) if 0 < audio.size <= MAX_BATCH_SAMPLES]
+    if len(short) > 1:
+        try:
+            for i in short:
+                audio, initial_prompt = items[i]
+                groups.setdefault((initial_prompt, _utterance_language(audio)), []).append(i)
+        except Exception as e:
+            logging.warning(f"Whisper language detection failed ({e}); transcribing sequentially")
+            groups = {}
+    for (initial_prompt, language), indices in groups.items():
+        if len(indices) < 2:
+            continue
+        try:
+            texts = _transcribe_clips([items[i][0] for i in indices], initial_prompt, language)
+        except Exception as e:
+            logging.warning(f"Batched Whisper decode failed ({e}); transcribing sequentially")
+            continue
+        for i, text in zip(indices, texts):
+            results[i] = text
+    for i, (audio, initial_prompt) in enumerate(items):
+        if results[i] is None:
+            try:
+                results[i] = _transcribe_one(audio, initial_prompt)
+            except Exception as e:
+                results[i] = e
+    return results
+
+
+batcher = MicroBatcher("whisper", _transcribe_batch, BATCH_SIZE, BATCH_WAIT_MS) if BATCH_SIZE > 1 else None
+
+
+def transcribe_array(audio: np.ndarray, initial_prompt: Optional[str] = None) -> str:
+    """Transcribe 16 kHz mono float32 audio with the loaded Whisper model (batched when enabled)."""
+    with models.use("whisper"), metrics.phase("transcribe", "inference"):
+        if batcher is not None:
+            return batcher.submit((audio, initial_prompt)).result()
+        return _transcribe_one(audio, initial_prompt)
+
+
+def transcribe_audio(file: UploadFile, initial_prompt: Optional[str] = None) -> Dict:
+    """Validate and transcribe an upload; initial_prompt carries earlier turns of the conversation."""
     lazy_load_model()
     start_time = time.time()
-    
+
     # Validate file type
     if file.content_type not in SUPPORTED_TYPES:
         return {"error": f"Unsupported file type: {file.content_type}"}
-    
+
     # Check if file is empty
     file.file.seek(0, 2)  # Seek to end
     file_size = file.file.tell()
     file.file.seek(0)  # Reset to beginning
-    
+
     if file_size == 0:
         return {"error": "Audio file is empty"}
-    
+
     if file_size < 100:  # Very small files are likely corrupted
         return {"error": "Audio file is too small or corrupted"}
-    
+
     try:
-        # Save uploaded file to a temp file
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
-            # Convert to WAV if needed
-            if file.content_type in ["audio/mp3", "audio/mpeg"]:
-                audio = AudioSegment.from_file(file.file, format="mp3")
-                audio.export(tmp.name, format="wav")
-            elif file.content_type in ["audio/webm", "audio/webm;codecs=opus"]:
-                audio = AudioSegment.from_file(file.file, format="webm")
-                audio.export(tmp.name, format="wav")
-            else:
-                tmp.write(file.file.read())
-                tmp.flush()
-            tmp_path = tmp.name
-            
-        # Validate the temp file exists and has content
-        if not os.path.exists(tmp_path) or os.path.getsize(tmp_path) == 0:
-            return {"error": "Failed to save audio file"}
-            
+        # Decode straight from the upload stream to a 16 kHz float32 array
+        audio = decode_upload(file.file, file.content_type)
+        if audio.size == 0:
+            metrics.error("transcribe_decode")
+            return {"error": "Failed to decode audio file"}
+
         # Transcribe with faster-whisper
         if model is None:
+            metrics.error("transcribe_no_model")
             return {"error": "Whisper model not loaded"}
-        segments, info = model.transcribe(tmp_path, beam_size=1)
-        transcript = "".join([seg.text for seg in segments])
+        transcript = transcribe_array(audio, initial_prompt)
         latency = round(time.time() - start_time, 2)
-        
-        # Clean up temp file
-        try:
-            os.remove(tmp_path)
-        except:
-            pass
-            
         return {"transcript": transcript, "latency": latency}
     except Exception as e:
-        # Clean up temp file on error
-        try:
-            if 'tmp_path' in locals() and os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except:
-            pass
-        return {"error": f"Transcription failed: {str(e)}"} 
\ No newline at end of file
+        logging.exception("Transcription failed")
+        metrics.error("transcribe")
+        return {"error": f"Transcription failed: {str(e)}"}
@@ -0,0 +1,227 @@
+# backend/uploads.py
+# Streaming multipart ingestion: small parts stay in memory, large ones spill to tmpfs
+import mmap
+import os
+import tempfile
+from typing import Dict, Optional
+
+from python_multipart import MultipartParser
+from python_multipart.exceptions import MultipartParseError
+from python_multipart.multipart import parse_options_header
+
+from backend import tracing
+
+# Parts up to this size are kept in a bytearray; larger ones spill to a file in UPLOAD_SPILL_DIR
+UPLOAD_SPOOL_BYTES = int(float(os.getenv("UPLOAD_SPOOL_MB", 1)) * 1024 * 1024)
+# /dev/shm is tmpfs on Linux (and Cloud Run), so spilled parts never touch a disk
+UPLOAD_SPILL_DIR = os.getenv("UPLOAD_SPILL_DIR") or ("/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir())
+# Per-part limits, enforced while the body streams in
+MAX_AUDIO_BYTES = int(float(os.getenv("UPLOAD_MAX_AUDIO_MB", 25)) * 1024 * 1024)
+MAX_IMAGE_BYTES = int(float(os.getenv("UPLOAD_MAX_IMAGE_MB", 10)) * 1024 * 1024)
+# Plain form fields (avatar_id etc.) and any part without its own limit
+MAX_FIELD_BYTES = 64 * 1024
+# Room for part headers and boundaries when checking Content-Length up front
+_FORM_OVERHEAD = 16 * 1024
+
+
+class UploadError(Exception):
+    """A request body that can't be accepted; status_code is 400, 413 or 415."""
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class SpooledPart:
+    """
+    One multipart part. Data accumulates in a bytearray until it passes
+    UPLOAD_SPOOL_BYTES, then moves to an anonymous file in UPLOAD_SPILL_DIR
+    (unlinked on creation, so nothing is left behind even if the process dies).
+    view() returns the content without copying it: a memoryview of the buffer,
+    or of a read-only mmap of the spilled file.
+    """
+    __slots__ = ("name", "filename", "content_type", "limit", "size", "_buffer", "_file", "_mmap", "_view")
+
+    def __init__(self, name: str, filename: Optional[str], content_type: Optional[str], limit: int):
+        self.name = name
+        self.filename = filename
+        self.content_type = content_type
+        self.limit = limit
+        self.size = 0
+        self._buffer: Optional[bytearray] = bytearray()
+        self._file = None
+        self._mmap = None
+        self._view: Optional[memoryview] = None
+
+    @property
+    def spilled(self) -> bool:
+        return self._file is not None
+
+    def write(self, data: memoryview):
+        self.size += len(data)
+        if self.size > self.limit:
+            raise UploadError(f"'{self.name}' is larger than {self.limit // 1024} KB", 413)
+        if self._file is None and self.size > UPLOAD_SPOOL_BYTES:
+            self._file = tempfile.TemporaryFile(dir=UPLOAD_SPILL_DIR, prefix="daylily-upload-")
+            self._file.write(self._buffer)
+            self._buffer = None
+        if self._file is not None:
+            self._file.write(data)
+        else:
+            self._buffer += data
+
+    def view(self) -> memoryview:
+        if self._view is None:
+            if self._file is None:
+                self._view = memoryview(self._buffer)
+            else:
+                self._file.flush()
+                self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+                self._view = memoryview(self._mmap)
+        return self._view
+
+    def text(self) -> str:
+        return bytes(self.view()).decode("utf-8", errors="replace")
+
+    def close(self):
+        # A consumer still holding an export (e.g. a cancelled request's worker) keeps the
+        # buffer alive; it is then freed by the garbage collector instead
+        if self._view is not None:
+            try:
+                self._view.release()
+            except BufferError:
+                pass
+            self._view = None
+        if self._mmap is not None:
+            try:
+                self._mmap.close()
+            except BufferError:
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._buffer = None
+
+
+class MultipartForm:
+    """Parts of a parsed multipart body by field name (the last one wins). Close it, or use it as a context manager."""
+    def __init__(self):
+        self.parts: Dict[str, SpooledPart] = {}
+
+    def add(self, part: SpooledPart):
+        old = self.parts.pop(part.name, None)
+        if old is not None:
+            old.close()
+        self.parts[part.name] = part
+
+    def file(self, name: str) -> Optional[SpooledPart]:
+        """The uploaded file for name, or None if it is missing or empty."""
+        part = self.parts.get(name)
+        if part is None or part.filename is None or not part.size:
+            return None
+        return part
+
+    def field(self, name: str) -> Optional[str]:
+        part = self.parts.get(name)
+        if part is None or part.filename is not None:
+            return None
+        return part.text()
+
+    def close(self):
+        for part in self.parts.values():
+            part.close()
+        self.parts.clear()
+
+    def __enter__(self) -> "MultipartForm":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+async def read_multipart(request, limits: Dict[str, int]) -> MultipartForm:
+    """
+    Stream a multipart/form-data request body into a MultipartForm.
+    limits maps field name -> maximum part size; other fields get MAX_FIELD_BYTES.
+    A Content-Length larger than the limits allow is rejected before reading the
+    body, and any part is rejected as soon as it grows past its limit.
+    Raises UploadError; everything spooled so far is released on any failure.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data":
+        raise UploadError("Expected a multipart/form-data body", 415)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise UploadError("Missing multipart boundary")
+    max_total = sum(limits.values()) + MAX_FIELD_BYTES + _FORM_OVERHEAD
+    length = request.headers.get("content-length")
+    if length and length.isdigit() and int(length) > max_total:
+        raise UploadError(f"Request body is larger than {max_total // 1024} KB", 413)
+
+    form = MultipartForm()
+    headers: Dict[bytes, bytes] = {}
+    field = bytearray()
+    value = bytearray()
+    current: Dict[str, SpooledPart] = {}
+
+    def on_part_begin():
+        headers.clear()
+
+    def on_header_field(data: bytes, start: int, end: int):
+        field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int):
+        value.extend(data[start:end])
+
+    def on_header_end():
+        headers[bytes(field).lower()] = bytes(value)
+        field.clear()
+        value.clear()
+
+    def on_headers_finished():
+        _, disposition = parse_options_header(headers.get(b"content-disposition", b""))
+        name = disposition.get(b"name")
+        if name is None:
+            raise UploadError("Multipart part without a name")
+        name = name.decode("utf-8", errors="replace")
+        filename = disposition.get(b"filename")
+        part_type = headers.get(b"content-type")
+        part = SpooledPart(
+            name,
+            filename.decode("utf-8", errors="replace") if filename is not None else None,
+            part_type.decode("latin-1") if part_type else None,
+            limits.get(name, MAX_FIELD_BYTES)
+        )
+        form.add(part)
+        current["part"] = part
+
+    def on_part_data(data: bytes, start: int, end: int):
+        current["part"].write(memoryview(data)[start:end])
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+    })
+    received = 0
+    try:
+        with tracing.span("multipart"):
+            async for chunk in request.stream():
+                if not chunk:
+                    continue
+                # Also covers chunked bodies that declared no Content-Length
+                received += len(chunk)
+                if received > max_total:
+                    raise UploadError(f"Request body is larger than {max_total // 1024} KB", 413)
+                parser.write(chunk)
+            parser.finalize()
+    except MultipartParseError as e:
+        form.close()
+        raise UploadError(f"Malformed multipart body: {e}") from e
+    except BaseException:
+        form.close()
+        raise
+    return form
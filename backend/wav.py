@@ -0,0 +1,74 @@
+# backend/wav.py
+# Shared 16-bit PCM WAV header/encoding helpers for speak.py and avatar.py
+import io
+import struct
+import wave
+from typing import Optional, Tuple, Union
+
+import numpy as np
+
+HEADER_SIZE = 44
+# Sizes written in the header of a stream whose length is not known up front
+STREAMING_SIZE = 0xFFFFFFFF
+
+
+def header(sample_rate: int, data_size: int, riff_size: Optional[int] = None) -> bytes:
+    """44-byte header for 16-bit mono PCM WAV data of data_size bytes."""
+    return struct.pack('<4sI4s4sIHHIIHH4sI',
+        b'RIFF',                    # Chunk ID
+        36 + data_size if riff_size is None else riff_size,  # Chunk size
+        b'WAVE',                    # Format
+        b'fmt ',                    # Subchunk1 ID
+        16,                         # Subchunk1 size
+        1,                          # Audio format (PCM)
+        1,                          # Num channels
+        sample_rate,                # Sample rate
+        sample_rate * 2,            # Byte rate
+        2,                          # Block align
+        16,                         # Bits per sample
+        b'data',                    # Subchunk2 ID
+        data_size                   # Subchunk2 size
+    )
+
+
+def stream_header(sample_rate: int) -> bytes:
+    """WAV header for a stream of unknown length (sizes set to 0xFFFFFFFF)."""
+    return header(sample_rate, STREAMING_SIZE, riff_size=STREAMING_SIZE)
+
+
+def allocate(num_samples: int, sample_rate: int) -> Tuple[bytearray, np.ndarray]:
+    """
+    Preallocate a complete WAV file buffer and return it with an int16 numpy view
+    over its sample area, so PCM can be written in place without extra copies.
+    """
+    buf = bytearray(HEADER_SIZE + num_samples * 2)
+    buf[:HEADER_SIZE] = header(sample_rate, num_samples * 2)
+    samples = np.frombuffer(buf, dtype="<i2", offset=HEADER_SIZE, count=num_samples)
+    return buf, samples
+
+
+def float_to_pcm16(audio) -> bytes:
+    """Convert float audio in [-1, 1] to little-endian 16-bit PCM bytes."""
+    samples = np.asarray(audio, dtype=np.float32).ravel()
+    out = np.empty(samples.size, dtype="<i2")
+    np.multiply(np.clip(samples, -1.0, 1.0), 32767, out=out, casting="unsafe")
+    return out.tobytes()
+
+
+def encode(audio, sample_rate: int) -> bytes:
+    """Encode float audio in [-1, 1] straight to WAV bytes, without touching disk."""
+    samples = np.asarray(audio, dtype=np.float32).ravel()
+    buf, out = allocate(samples.size, sample_rate)
+    np.multiply(np.clip(samples, -1.0, 1.0), 32767, out=out, casting="unsafe")
+    return bytes(buf)
+
+
+def read_info(data: Union[str, bytes, memoryview]) -> Optional[Tuple[int, int, float]]:
+    """(sample_rate, channels, duration in seconds) of a PCM WAV path or bytes, or None if not a WAV."""
+    try:
+        source = data if isinstance(data, str) else io.BytesIO(data)
+        with wave.open(source, "rb") as w:
+            rate = w.getframerate()
+            return rate, w.getnchannels(), w.getnframes() / float(rate)
+    except (wave.Error, EOFError, OSError, ZeroDivisionError):
+        return None
@@ -9,7 +9,18 @@ function getSessionId() {
   }
   return sid;
 }
-const sessionId = getSessionId();
+let sessionId = getSessionId();
+
+// The backend issues session ids; keep the one it returns so later turns
+// reuse the session's avatar, voice and transcript context
+function rememberSession(res) {
+  const sid = res.headers.get("X-Session-ID");
+  if (sid && sid !== sessionId) {
+    sessionId = sid;
+    localStorage.setItem("daylily_session_id", sid);
+  }
+  return res;
+}
 
 // DOM elements
 const messagesDiv = document.getElementById("messages");
@@ -88,7 +99,15 @@ function stopRecording(e) {
   micIcon.textContent = "🎤";
 }
 
-// Send audio to backend for transcription
+// Decode a base64 payload from /converse into a Blob
+function base64ToBlob(b64, type) {
+  const bin = atob(b64);
+  const bytes = new Uint8Array(bin.length);
+  for (let i = 0; i < bin.length; i++) bytes[i] = bin.charCodeAt(i);
+  return new Blob([bytes], { type });
+}
+
+// Send audio to backend: one /converse call runs STT -> TTS -> avatar server-side
 function sendAudio(audioBlob) {
   showError("");
   const formData = new FormData();
@@ -97,36 +116,34 @@ function sendAudio(audioBlob) {
   formData.append("audio", audioBlob, filename);
   const t0 = performance.now();
   
-  console.log("Making request to:", `${BACKEND_URL}/transcribe?session_id_query=${sessionId}`); // Debug log
+  console.log("Making request to:", `${BACKEND_URL}/converse?format=json&session_id_query=${sessionId}`); // Debug log
   console.log("Audio blob size:", audioBlob.size, "type:", audioBlob.type); // Debug log
+  addMessage("🎬 Generating avatar video...", "bot");
   
-  fetch(`${BACKEND_URL}/transcribe?session_id_query=${sessionId}`, {
+  fetch(`${BACKEND_URL}/converse?format=json&session_id_query=${sessionId}`, {
     method: "POST",
     body: formData
   })
-    .then(res => {
+    .then(rememberSession)
+    .then(res => res.json().then(data => {
       console.log("Response status:", res.status, res.statusText); // Debug log
       if (!res.ok) {
-        throw new Error(`HTTP ${res.status}: ${res.statusText}`);
+        throw new Error(data.error || `HTTP ${res.status}: ${res.statusText}`);
       }
-      return res.json();
-    })
+      return data;
+    }))
     .then(data => {
       const t1 = performance.now();
-      latencyIndicator.textContent = `STT: ${(t1-t0).toFixed(0)}ms`;
-      console.log("Transcription response:", data); // Debug log
-      if (data.transcript) {
-        addMessage(data.transcript, "user");
-        handleUserMessage(data.transcript);
-      } else if (data.error) {
-        showError(`Transcription error: ${data.error}`);
-      } else {
-        showError("No transcript received.");
-      }
+      const t = data.timings || {};
+      latencyIndicator.textContent = `Total: ${(t1-t0).toFixed(0)}ms (STT ${(1000*(t.transcribe||0)).toFixed(0)} / TTS ${(1000*(t.speak||0)).toFixed(0)} / Avatar ${(1000*(t.avatar||0)).toFixed(0)})`;
+      console.log("Converse response timings:", t); // Debug log
+      addMessage(data.transcript, "user");
+      playAudio(base64ToBlob(data.audio_base64, "audio/wav"));
+      playVideo(base64ToBlob(data.video_base64, "video/mp4"));
     })
     .catch((error) => {
-      console.error("Transcription request failed:", error);
-      showError(`Transcription failed: ${error.message}`);
+      console.error("Converse request failed:", error);
+      showError(`Request failed: ${error.message}`);
     });
 }
 
@@ -145,11 +162,12 @@ function handleUserMessage(text) {
   showError("");
   // 1. Get TTS audio
   const t0 = performance.now();
-  fetch(`${BACKEND_URL}/speak?session_id=${sessionId}`, {
+  fetch(`${BACKEND_URL}/speak?session_id_query=${sessionId}`, {
     method: "POST",
     headers: { "Content-Type": "application/json" },
     body: JSON.stringify({ text })
   })
+    .then(rememberSession)
     .then(res => res.blob())
     .then(audioBlob => {
       const t1 = performance.now();
@@ -184,6 +202,7 @@ function generateAvatar(audioBlob, text) {
     method: "POST",
     body: formData
   })
+    .then(rememberSession)
     .then(res => {
       if (!res.ok) {
         throw new Error(`Avatar generation failed: ${res.status}`);
@@ -20,7 +20,16 @@ console.log("AI Avatar Widget JS loaded");
     }
     return sid;
   }
-  const sessionId = getSessionId();
+  let sessionId = getSessionId();
+  // Adopt the id the backend issues so later turns reuse its session state
+  function rememberSession(r) {
+    const sid = r.headers.get('X-Session-ID');
+    if (sid && sid !== sessionId) {
+      sessionId = sid;
+      localStorage.setItem(sessionKey, sid);
+    }
+    return r;
+  }
 
   // --- DOM Helpers ---
   function el(tag, attrs = {}, ...children) {
@@ -183,9 +192,10 @@ console.log("AI Avatar Widget JS loaded");
     form.append('file', blob, 'audio.wav');
     fetch(backendUrl + '/transcribe', {
       method: 'POST',
-      headers: { 'session_id': sessionId },
+      headers: { 'session-id': sessionId },
       body: form
     })
+      .then(rememberSession)
       .then(r => r.json())
       .then(data => {
         if (data.transcript) {
@@ -215,10 +225,11 @@ console.log("AI Avatar Widget JS loaded");
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
-          'session_id': sessionId
+          'session-id': sessionId
         },
         body: JSON.stringify({ text: aiText })
       })
+        .then(rememberSession)
         .then(r => r.ok ? r.blob() : Promise.reject(r))
         .then(audioBlob => {
           // Optionally play audio
@@ -238,30 +249,55 @@ console.log("AI Avatar Widget JS loaded");
     }, 800);
   }
 
-  // --- Send Audio+Image to /generate-avatar ---
+  // --- Register the avatar image once; later calls send only its avatar_id ---
+  let avatarIdPromise = null;
+  function getAvatarId(forceRegister) {
+    if (!avatarIdPromise || forceRegister) {
+      avatarIdPromise = fetchImageAsBlob(avatarImage).then(imgBlob => {
+        const form = new FormData();
+        form.append('image', imgBlob, 'avatar.png');
+        return fetch(backendUrl + '/avatars', { method: 'POST', body: form });
+      })
+        .then(r => r.ok ? r.json() : Promise.reject(r))
+        .then(data => data.avatar_id)
+        .catch(err => { avatarIdPromise = null; throw err; });
+    }
+    return avatarIdPromise;
+  }
+
+  // --- Send Audio + avatar_id to /generate-avatar ---
+  function postAvatarVideo(audioBlob, avatarId) {
+    const form = new FormData();
+    form.append('audio', audioBlob, 'audio.wav');
+    form.append('avatar_id', avatarId);
+    return fetch(backendUrl + '/generate-avatar', {
+      method: 'POST',
+      headers: { 'session-id': sessionId },
+      body: form
+    }).then(rememberSession);
+  }
+
   function sendAvatarVideo(audioBlob) {
     isLoading = true;
     showSpinner();
-    const form = new FormData();
-    form.append('audio', audioBlob, 'audio.wav');
-    form.append('image', avatarImage, 'avatar.png'); // If avatarImage is a URL, fetch and convert to blob
-    fetchImageAsBlob(avatarImage).then(imgBlob => {
-      form.set('image', imgBlob, 'avatar.png');
-      fetch(backendUrl + '/generate-avatar', {
-        method: 'POST',
-        headers: { 'session_id': sessionId },
-        body: form
+    getAvatarId(false)
+      .then(avatarId => postAvatarVideo(audioBlob, avatarId))
+      .then(r => {
+        // The server may have evicted the registration; re-register once and retry
+        if (r.status === 404) {
+          return getAvatarId(true).then(avatarId => postAvatarVideo(audioBlob, avatarId));
+        }
+        return r;
       })
-        .then(r => r.ok ? r.blob() : Promise.reject(r))
-        .then(videoBlob => {
-          if (currentVideoUrl) URL.revokeObjectURL(currentVideoUrl);
-          currentVideoUrl = URL.createObjectURL(videoBlob);
-          messages.push({ type: 'video', url: currentVideoUrl });
-          renderMessages();
-        })
-        .catch(() => showError('Avatar video failed.'))
-        .finally(() => { isLoading = false; hideSpinner(); });
-    });
+      .then(r => r.ok ? r.blob() : Promise.reject(r))
+      .then(videoBlob => {
+        if (currentVideoUrl) URL.revokeObjectURL(currentVideoUrl);
+        currentVideoUrl = URL.createObjectURL(videoBlob);
+        messages.push({ type: 'video', url: currentVideoUrl });
+        renderMessages();
+      })
+      .catch(() => showError('Avatar video failed.'))
+      .finally(() => { isLoading = false; hideSpinner(); });
   }
 
   // --- Fetch image as blob (for avatar) ---
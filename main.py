@@ -1,16 +1,67 @@
-from fastapi import FastAPI, UploadFile, File, Request, Form, Header, Cookie, Response, Query
+# Imported first so STARTUP_PROFILE=1 times every import that follows
+from backend import startup_profile
+from fastapi import FastAPI, UploadFile, File, Request, Form, Header, Cookie, Response, Query, WebSocket, WebSocketDisconnect
 from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
 import os
-import tempfile
-import shutil
-from typing import Optional
+import time
+import asyncio
+import json
+import base64
+import hmac
+import uuid
+import logging
+import threading
+from contextlib import asynccontextmanager
+from typing import Callable, Optional, Tuple
+
+# LOG_LEVEL=DEBUG also logs each transcription request and its result
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO").upper())
 
 # Import backend modules (to be implemented)
-from backend import transcribe, speak, avatar
-from backend.session_manager import get_or_create_session
+from backend import transcribe, speak, avatar, wav
+from backend.session_manager import get_or_create_session, get_session_state, session_manager
+from backend.session_state import session_states
+from backend.executor import get_stage, get_stage_stats, QueueFullError
+from backend import pipeline, models, uploads, metrics, tracing
+from backend.residency import residency
+from backend.streaming_stt import StreamingTranscriber
+from backend.live_video import LiveVideo
+from backend.jobs import PRIORITIES, Job, SessionJobLimitError, avatar_jobs
+
+startup_profile.mark("imports")
+
+# --- Model loading ---
+# Models listed in PRELOAD_MODELS start loading in background threads as soon as the
+# app starts; /ready reports when they are done. A request that needs a model before
+# then waits for the in-flight load rather than starting its own.
+
+def mark_models_ready(name: str):
+    if models.registry.is_ready(models.PRELOAD_MODELS):
+        startup_profile.mark("models_ready")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if startup_profile.profile is not None:
+        models.registry.after_load.append(mark_models_ready)
+    models.registry.preload(models.PRELOAD_MODELS)
+    residency.start()
+    startup_profile.mark("startup")
+    if not models.PRELOAD_MODELS:
+        startup_profile.mark("models_ready")
+    yield
+    residency.stop()
+
+def lazy_load_whisper():
+    models.ensure("whisper")
+
+def lazy_load_tts():
+    models.ensure("tts")
+
+def lazy_load_avatar():
+    models.ensure("avatar")
 
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Add CORS middleware
 app.add_middleware(
@@ -19,29 +70,289 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Let browser clients read back the session id so later turns reuse session state
+    expose_headers=["X-Session-ID", "X-Latency", "X-Avatar-ID", "X-Trace-ID", "Server-Timing"],
 )
+# Wraps CORS, so request latency includes it and the whole streamed body
+app.add_middleware(metrics.MetricsMiddleware)
+# Outermost: every request gets a trace (Server-Timing, X-Trace-ID; sampled ones exported)
+app.add_middleware(tracing.TracingMiddleware)
 
-# --- Lazy model loading flags ---
-models_loaded = {
-    'whisper': False,
-    'tts': False,
-    'avatar': False
-}
+if startup_profile.profile is not None:
+    @app.middleware("http")
+    async def profile_first_request(request: Request, call_next):
+        started = time.perf_counter()
+        response = await call_next(request)
+        startup_profile.profile.request_served(request.method, request.url.path, time.perf_counter() - started)
+        return response
 
-def lazy_load_whisper():
-    if not models_loaded['whisper']:
-        transcribe.lazy_load_model()
-        models_loaded['whisper'] = True
+def stage_busy_response(e: QueueFullError, sid: Optional[str] = None) -> JSONResponse:
+    """503 with Retry-After for a stage whose queue is full; keeps the client's session id."""
+    headers = {"Retry-After": str(e.retry_after)}
+    if sid:
+        headers["X-Session-ID"] = sid
+    return JSONResponse(content={"error": str(e), "stage": e.stage}, status_code=503, headers=headers)
 
-def lazy_load_tts():
-    if not models_loaded['tts']:
-        speak.lazy_load_model()
-        models_loaded['tts'] = True
+# Retry-After for requests whose model is loading or failed to load (a later request retries the load)
+MODEL_RETRY_AFTER_S = int(os.getenv("MODEL_RETRY_AFTER_S", 10))
+
+def model_unavailable_response(e: models.ModelLoadError, sid: Optional[str] = None) -> JSONResponse:
+    """503 with Retry-After for a model that failed to load, with its registry state."""
+    headers = {"Retry-After": str(MODEL_RETRY_AFTER_S)}
+    if sid:
+        headers["X-Session-ID"] = sid
+    content = {"error": str(e), "model": models.registry.status().get(e.name)}
+    return JSONResponse(content=content, status_code=503, headers=headers)
+
+def session_prompt(sid: str) -> Optional[str]:
+    """Recent transcripts of this session, as Whisper's initial_prompt."""
+    state = get_session_state(sid)
+    return state.prompt() if state is not None else None
+
+def run_transcribe(upload: UploadFile, sid: str):
+    lazy_load_whisper()
+    result = transcribe.transcribe_audio(upload, session_prompt(sid))
+    if result.get("transcript"):
+        session_states.add_transcript(sid, result["transcript"])
+    return result
+
+def run_stream_ingest(ingest, chunks, finish):
+    """Feed buffered WebSocket audio to a StreamingTranscriber on the transcribe pool."""
+    lazy_load_whisper()
+    return ingest(chunks, finish)
+
+def session_voice(sid: str, voice: Optional[str]):
+    """
+    (voice, speaker embedding) for this turn: the requested voice, remembered for the
+    session, or else the voice the session chose earlier. The embedding is loaded once
+    per session and voice. Runs on the speak pool since loading reads model assets.
+    """
+    state = get_session_state(sid)
+    if voice is None:
+        if state is None or state.voice is None:
+            return None, None
+        voice = state.voice
+    lazy_load_tts()
+    if state is not None and state.voice == voice and state.voice_backend == speak.tts_backend:
+        return voice, state.speaker_embedding
+    try:
+        embedding = speak.load_voice_embedding(voice)
+    except Exception as e:
+        # Let synthesis report the bad voice (and fall back) as before
+        logging.warning(f"Could not load voice '{voice}': {e}")
+        return voice, None
+    session_states.set_voice(sid, voice, speak.tts_backend, embedding)
+    return voice, embedding
+
+def run_speak(text: str, voice: Optional[str], sid: str):
+    voice, embedding = session_voice(sid, voice)
+    return speak.generate_speech(text, voice, embedding)
+
+def run_speak_chunk(text: str, sample_rate: Optional[int], voice: Optional[str], sid: str):
+    voice, embedding = session_voice(sid, voice)
+    rate = sample_rate or speak.output_sample_rate()
+    return speak.synthesize_pcm(text, rate, voice, embedding), rate
+
+async def stream_speech(text: str, audio_format: str, sid: str, voice: Optional[str] = None):
+    """
+    Synthesize sentence by sentence and stream PCM as each chunk is ready.
+    The first chunk is rendered before responding so the sample rate is known for the headers.
+    """
+    if audio_format not in ("wav", "pcm"):
+        return JSONResponse(content={"error": "format must be 'wav' or 'pcm'"}, status_code=400)
+    chunks = speak.split_sentences(text)
+    stage = get_stage("speak")
+    start = time.perf_counter()
+    first_pcm, sample_rate = await stage.run(run_speak_chunk, chunks[0], None, voice, sid)
+    headers = {
+        "X-Session-ID": sid,
+        "X-Sample-Rate": str(sample_rate),
+        "X-First-Chunk-Latency": f"{round(time.perf_counter() - start, 2)}s",
+        "X-Chunks": str(len(chunks)),
+    }
+
+    async def body():
+        if audio_format == "wav":
+            yield wav.stream_header(sample_rate)
+        yield first_pcm
+        for chunk in chunks[1:]:
+            while True:
+                try:
+                    pcm, _ = await stage.run(run_speak_chunk, chunk, sample_rate, voice, sid)
+                    break
+                except QueueFullError as e:
+                    # Headers are already sent; wait for a slot rather than truncating the audio
+                    await asyncio.sleep(e.retry_after)
+            yield pcm
+
+    if audio_format == "wav":
+        return StreamingResponse(body(), media_type="audio/wav", headers=headers)
+    headers.update({"X-Sample-Format": "s16le", "X-Channels": "1"})
+    return StreamingResponse(body(), media_type="application/octet-stream", headers=headers)
+
+def etag_matches(if_none_match: Optional[str], key: str) -> bool:
+    """True if an If-None-Match header value covers the (strong) ETag for key."""
+    if not if_none_match:
+        return False
+    tags = [t.strip() for t in if_none_match.split(",")]
+    return any(t == "*" or t.removeprefix("W/").strip('"') == key for t in tags)
+
+def video_response(video_path: str, key: str, headers: dict) -> FileResponse:
+    """A finished video; FileResponse answers Range requests itself."""
+    headers = dict(headers, **{"ETag": f'"{key}"', "X-Video-URL": f"/videos/{key}"})
+    return FileResponse(video_path, media_type="video/mp4", filename="avatar.mp4", headers=headers)
+
+async def live_video_response(request: Request, live: LiveVideo, headers: dict) -> Response:
+    """
+    A video that is still rendering, streamed fragment by fragment as it is written so
+    playback starts with the first fragment. A Range request for anything but the whole
+    video (bytes=0-) waits for the render to finish and is answered from the cached file.
+    """
+    range_header = request.headers.get("range")
+    if range_header and range_header.replace(" ", "") != "bytes=0-":
+        await live.finished()
+        if live.error is not None:
+            return JSONResponse(content={"error": f"Video render failed: {live.error}"}, status_code=500)
+        return video_response(live.path, live.key, headers)
+    # Don't commit to a 200 before there is anything to send
+    await live.wait(0)
+    if live.error is not None and not live.written:
+        return JSONResponse(content={"error": f"Video render failed: {live.error}"}, status_code=500)
+    headers = dict(headers, **{"ETag": f'"{live.key}"', "X-Video-URL": f"/videos/{live.key}", "Accept-Ranges": "bytes"})
+    return StreamingResponse(live.stream(), media_type="video/mp4", headers=headers)
+
+def session_avatar(sid: str, avatar_id: Optional[str]) -> Optional[avatar.AvatarIdentity]:
+    """
+    Portrait for a turn without an uploaded image: the registered avatar_id (falling back
+    to the session's own copy if the registry has evicted it), or, when no avatar_id is
+    given, the session's last avatar. None if avatar_id is unknown or the session has none.
+    """
+    state = get_session_state(sid)
+    remembered = state.avatar if state is not None else None
+    if not avatar_id:
+        return remembered
+    identity = avatar.get_avatar_identity(avatar_id)
+    if identity is None and remembered is not None and remembered.avatar_id == avatar_id:
+        identity = remembered
+    return identity
+
+def remember_avatar(sid: str, identity: Optional[avatar.AvatarIdentity]):
+    """Keep the portrait in session state so later turns can skip uploading it."""
+    if identity is None:
+        return
+    state = get_session_state(sid)
+    if state is None or state.avatar is not identity:
+        session_states.set_avatar(sid, identity)
+
+class AvatarLookup:
+    """An avatar request's media digests, hashed once, and the cached video if there is one."""
+    __slots__ = ("audio_digest", "image_digest", "key", "path", "avatar_id")
+
+    def __init__(self, audio_digest: str, image_digest: Optional[str]):
+        self.audio_digest = audio_digest
+        self.image_digest = image_digest
+        self.key: Optional[str] = None
+        self.path: Optional[str] = None
+        self.avatar_id: Optional[str] = None
+
+def run_avatar(
+    audio: avatar.MediaInput,
+    image: Optional[avatar.MediaInput],
+    identity: Optional[avatar.AvatarIdentity] = None,
+    if_none_match: Optional[str] = None,
+    sid: Optional[str] = None,
+    on_start: Optional[Callable[[LiveVideo, Optional[str]], None]] = None,
+    progress: Optional[Callable[[int, int], None]] = None,
+    cancel: Optional[threading.Event] = None,
+    lookup: Optional[AvatarLookup] = None
+):
+    """
+    Register an uploaded portrait (or use an already registered identity), then serve
+    from the video cache if possible; otherwise render straight from the audio buffer.
+    Runs on the avatar stage pool; on_start(live_video, avatar_id) is called as soon as a
+    render begins, so the caller can stream it while this call is still rendering.
+    progress/cancel are handed to the renderer (see avatar.render_fragments). A lookup
+    from lookup_avatar_video saves hashing the audio and image again.
+    Returns (cache key, video path or None if the client's copy is current, latency, avatar_id).
+    """
+    if image is not None:
+        identity = avatar.register_avatar_image(image, lookup.image_digest if lookup else None)
+    if sid:
+        remember_avatar(sid, identity)
+    avatar_id = identity.avatar_id if identity else None
+    if lookup is not None:
+        key = avatar.video_cache_key_for(lookup.audio_digest, avatar.media_digest(identity))
+    else:
+        key = avatar.video_cache_key(audio, identity)
+    cached = avatar.cached_video_path(key)
+    if cached:
+        return key, None if etag_matches(if_none_match, key) else cached, 0.0, avatar_id
+    lazy_load_avatar()
+    video_path, latency = avatar.generate_avatar(
+        audio, identity, key,
+        on_start=(lambda live: on_start(live, avatar_id)) if on_start else None,
+        progress=progress,
+        cancel=cancel
+    )
+    return key, video_path, latency, avatar_id
+
+def lookup_avatar_video(
+    audio: avatar.MediaInput,
+    image: Optional[avatar.MediaInput],
+    identity: Optional[avatar.AvatarIdentity] = None,
+    sid: Optional[str] = None
+) -> AvatarLookup:
+    """
+    Hash the uploads and look the request up in the video cache without going through
+    the avatar stage, so cache hits don't queue behind renders. An uploaded portrait that
+    isn't registered yet is a miss here: registering it is preprocessing work that belongs
+    on the stage. Hashing reads every byte of the uploads, so call this off the event loop.
+    """
+    lookup = AvatarLookup(avatar.media_digest(audio), avatar.media_digest(image) if image is not None else None)
+    if lookup.image_digest is not None:
+        identity = avatar.get_avatar_identity(lookup.image_digest[:32])
+        if identity is None:
+            return lookup
+    key = avatar.video_cache_key_for(lookup.audio_digest, avatar.media_digest(identity))
+    lookup.path = avatar.cached_video_path(key)
+    if lookup.path:
+        lookup.key = key
+        lookup.avatar_id = identity.avatar_id if identity else None
+        if sid:
+            remember_avatar(sid, identity)
+    return lookup
+
+def unknown_avatar_message(avatar_id: str) -> str:
+    return f"Unknown avatar_id '{avatar_id}'. Register the image again via POST /avatars."
+
+def unknown_avatar_response(avatar_id: str) -> JSONResponse:
+    return JSONResponse(content={"error": unknown_avatar_message(avatar_id)}, status_code=404)
+
+async def read_avatar_form(request: Request, sid: str) -> Tuple[uploads.MultipartForm, Optional[avatar.AvatarIdentity]]:
+    """
+    Stream an avatar request body (audio, plus an image or avatar_id) and, when no image
+    was uploaded, resolve the portrait from avatar_id or the session. Raises
+    uploads.UploadError with the status to answer; otherwise the caller owns the form
+    and must close it.
+    """
+    form = await uploads.read_multipart(
+        request, {"audio": uploads.MAX_AUDIO_BYTES, "image": uploads.MAX_IMAGE_BYTES}
+    )
+    try:
+        if form.file("audio") is None:
+            raise uploads.UploadError("Missing audio file.")
+        identity = None
+        if form.file("image") is None:
+            # Without an upload, use avatar_id or whatever portrait this session used last
+            avatar_id = form.field("avatar_id")
+            identity = session_avatar(sid, avatar_id)
+            if identity is None and avatar_id:
+                raise uploads.UploadError(unknown_avatar_message(avatar_id), 404)
+    except BaseException:
+        form.close()
+        raise
+    return form, identity
 
-def lazy_load_avatar():
-    if not models_loaded['avatar']:
-        avatar.lazy_load_model()
-        models_loaded['avatar'] = True
 
 @app.post("/warmup")
 def warmup():
@@ -49,7 +360,8 @@ def warmup():
     lazy_load_whisper()
     lazy_load_tts()
     lazy_load_avatar()
-    return {"status": "warmed up"}
+    seeded = speak.preseed_cache(speak.load_preseed_phrases())
+    return {"status": "warmed up", "tts_cache_seeded": seeded}
 
 # POST /transcribe — speech-to-text (WAV to text)
 @app.post("/transcribe")
@@ -63,18 +375,102 @@ async def transcribe_endpoint(
     session_id_query: Optional[str] = Query(None)
 ):
     """Endpoint for speech-to-text (WAV/MP3 to text) with session management. Accepts 'audio' or 'file' field."""
-    lazy_load_whisper()
     sid = get_or_create_session(session_id or session_cookie or session_id_query)
     response.headers["X-Session-ID"] = sid
     upload = audio or file
     if not upload:
         return JSONResponse(content={"error": "No file uploaded."}, status_code=400)
-    print(f"Received file: {upload.filename}, content_type: {upload.content_type}, size: {upload.size if hasattr(upload, 'size') else 'unknown'}")  # Debug log
-    result = transcribe.transcribe_audio(upload)
-    print(f"Transcription result: {result}")  # Debug log
+    logging.debug(f"Received file: {upload.filename}, content_type: {upload.content_type}, size: {upload.size if hasattr(upload, 'size') else 'unknown'}")
+    try:
+        result = await get_stage("transcribe").run(run_transcribe, upload, sid)
+    except QueueFullError as e:
+        return stage_busy_response(e, sid)
+    except models.ModelLoadError as e:
+        return model_unavailable_response(e, sid)
+    logging.debug(f"Transcription result: {result}")
     if "error" in result:
-        return JSONResponse(content=result, status_code=400)
-    return JSONResponse(content=result)
+        return JSONResponse(content=result, status_code=400, headers={"X-Session-ID": sid})
+    return JSONResponse(content=result, headers={"X-Session-ID": sid})
+
+# WS /ws/transcribe — streaming speech-to-text with partial and final transcripts
+@app.websocket("/ws/transcribe")
+async def transcribe_ws(websocket: WebSocket, session_id: Optional[str] = Query(None)):
+    """
+    Send audio as binary messages while recording; receive {"type": "partial"|"final", "text": ...}.
+    An optional first text message {"type": "start", "format": "pcm16"|"webm", "sample_rate": 16000}
+    picks the input format (default 16 kHz pcm16); {"type": "stop"} finalizes buffered speech.
+    """
+    await websocket.accept()
+    sid = get_or_create_session(session_id)
+    await websocket.send_json({"type": "session", "session_id": sid})
+    stage = get_stage("transcribe")
+    transcriber = StreamingTranscriber()
+    backlog = []
+
+    def ingest(chunks, finish):
+        for chunk in chunks:
+            transcriber.add_chunk(chunk)
+        transcriber.initial_prompt = session_prompt(sid)
+        events = transcriber.flush() if finish else transcriber.process()
+        for event in events:
+            if event["type"] == "final" and event["text"]:
+                session_states.add_transcript(sid, event["text"])
+        return events
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            finish = False
+            if message.get("bytes") is not None:
+                backlog.append(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    await websocket.send_json({"type": "error", "error": "Control messages must be JSON."})
+                    continue
+                if control.get("type") == "start":
+                    try:
+                        replacement = StreamingTranscriber(
+                            control.get("format", "pcm16"),
+                            int(control.get("sample_rate", transcribe.SAMPLE_RATE))
+                        )
+                        transcriber.close()
+                        transcriber = replacement
+                        backlog = []
+                    except ValueError as e:
+                        await websocket.send_json({"type": "error", "error": str(e)})
+                    continue
+                finish = control.get("type") == "stop"
+                if not finish:
+                    continue
+            chunks, backlog = backlog, []
+            while True:
+                try:
+                    events = await stage.run(run_stream_ingest, ingest, chunks, finish)
+                    break
+                except QueueFullError as e:
+                    if not finish:
+                        # Keep the audio and retry with the next chunk
+                        backlog = chunks + backlog
+                        events = [{"type": "busy", "retry_after": e.retry_after}]
+                        break
+                    await asyncio.sleep(e.retry_after)
+                except Exception as e:
+                    # e.g. Whisper failed to load; report it instead of dropping the connection
+                    logging.exception("Streaming transcription failed")
+                    events = [{"type": "error", "error": str(e)}]
+                    break
+            for event in events:
+                await websocket.send_json(event)
+            if finish:
+                await websocket.send_json({"type": "done"})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        transcriber.close()
 
 # POST /speak — text-to-speech (text to WAV)
 @app.post("/speak")
@@ -82,81 +478,504 @@ async def speak_endpoint(
     request: Request,
     response: Response,
     session_id: str = Header(None),
-    session_cookie: str = Cookie(None)
+    session_cookie: str = Cookie(None),
+    session_id_query: Optional[str] = Query(None)
 ):
-    """Endpoint for text-to-speech (text to WAV) with session management."""
-    lazy_load_tts()
-    sid = get_or_create_session(session_id or session_cookie)
+    """
+    Endpoint for text-to-speech (text to WAV) with session management.
+    Optional "voice" selects a Bark history prompt / Coqui speaker; it is remembered for the session.
+    With {"stream": true} the text is synthesized sentence by sentence and streamed as it is ready,
+    either as a WAV with an open-ended header ("format": "wav", default) or raw s16le PCM ("format": "pcm").
+    """
+    sid = get_or_create_session(session_id or session_cookie or session_id_query)
     response.headers["X-Session-ID"] = sid
     try:
         data = await request.json()
         text = data.get("text") if data else None
         if not text or not text.strip():
             return JSONResponse(content={"error": "Missing or empty 'text' field."}, status_code=400)
-        wav_bytes, latency = speak.generate_speech(text)
+        voice = data.get("voice")
+        if data.get("stream"):
+            return await stream_speech(text, data.get("format", "wav"), sid, voice)
+        wav_bytes, latency = await get_stage("speak").run(run_speak, text, voice, sid)
         headers = {"X-Latency": f"{latency}s", "X-Session-ID": sid}
         return StreamingResponse(
             iter([wav_bytes]),
             media_type="audio/wav",
             headers=headers
         )
+    except QueueFullError as e:
+        return stage_busy_response(e, sid)
+    except models.ModelLoadError as e:
+        return model_unavailable_response(e, sid)
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 # POST /generate-avatar — audio+image to video
-@app.post("/generate-avatar")
+# The body is parsed by uploads.read_multipart rather than UploadFile parameters, so
+# the form is described here for the OpenAPI docs
+GENERATE_AVATAR_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["audio"],
+                    "properties": {
+                        "audio": {"type": "string", "format": "binary"},
+                        "image": {"type": "string", "format": "binary"},
+                        "avatar_id": {"type": "string"},
+                    },
+                }
+            }
+        },
+    }
+}
+
+def avatar_result_response(
+    key: str,
+    video_path: Optional[str],
+    latency: float,
+    used_avatar_id: Optional[str],
+    sid: str,
+    if_none_match: Optional[str] = None
+) -> Response:
+    """A finished /generate-avatar result; video_path None (or a matching If-None-Match) means 304."""
+    headers = {"X-Latency": f"{latency}s", "X-Session-ID": sid}
+    if used_avatar_id:
+        headers["X-Avatar-ID"] = used_avatar_id
+    if video_path is None or etag_matches(if_none_match, key):
+        return Response(status_code=304, headers=dict(headers, ETag=f'"{key}"'))
+    if os.path.exists(video_path):
+        return video_response(video_path, key, headers)
+    return JSONResponse(content={"error": "Failed to generate video file"}, status_code=500)
+
+@app.post("/generate-avatar", openapi_extra=GENERATE_AVATAR_FORM)
 async def generate_avatar_endpoint(
+    request: Request,
+    response: Response,
+    session_id: str = Header(None),
+    session_cookie: str = Cookie(None),
+    session_id_query: Optional[str] = Query(None),
+    if_none_match: Optional[str] = Header(None)
+):
+    """
+    Render (or fetch from the video cache) a talking-head video for audio + image.
+    Instead of re-uploading the portrait, pass the avatar_id returned by POST /avatars,
+    or nothing to reuse the portrait this session used last.
+    Uploads are streamed into memory (large ones into tmpfs) and handed to the model
+    as buffers; parts over UPLOAD_MAX_AUDIO_MB / UPLOAD_MAX_IMAGE_MB get 413 as soon as they cross it.
+    Responses carry a content-addressed ETag; a matching If-None-Match gets 304 without a body.
+    """
+    sid = get_or_create_session(session_id or session_cookie or session_id_query)
+    response.headers["X-Session-ID"] = sid
+    try:
+        form, identity = await read_avatar_form(request, sid)
+    except uploads.UploadError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code, headers={"X-Session-ID": sid})
+    # The form is closed when this returns, unless a render still streaming from it takes it over
+    keep_form = False
+    try:
+        audio = form.file("audio")
+        image = form.file("image")
+        lookup = await asyncio.to_thread(lookup_avatar_video, audio.view(), image.view() if image else None, identity, sid)
+        if lookup.path:
+            return avatar_result_response(lookup.key, lookup.path, 0.0, lookup.avatar_id, sid, if_none_match)
+        loop = asyncio.get_running_loop()
+        started = loop.create_future()
+
+        def on_start(live: LiveVideo, used_avatar_id: Optional[str]):
+            loop.call_soon_threadsafe(lambda: started.done() or started.set_result((live, used_avatar_id)))
+
+        job = asyncio.ensure_future(get_stage("avatar").run(
+            run_avatar, audio.view(), image.view() if image else None, identity, if_none_match, sid, on_start,
+            lookup=lookup
+        ))
+        await asyncio.wait({job, started}, return_when=asyncio.FIRST_COMPLETED)
+        if started.done():
+            # Rendering: stream the video while the stage job finishes it, then release the uploads
+            live, used_avatar_id = started.result()
+            keep_form = True
+
+            def release(done_job: asyncio.Future):
+                # Retrieve the outcome so a failed render isn't logged as an unretrieved exception
+                if not done_job.cancelled():
+                    done_job.exception()
+                form.close()
+
+            job.add_done_callback(release)
+            headers = {"X-Session-ID": sid}
+            if used_avatar_id:
+                headers["X-Avatar-ID"] = used_avatar_id
+            return await live_video_response(request, live, headers)
+        try:
+            key, video_path, latency, used_avatar_id = job.result()
+            return avatar_result_response(key, video_path, latency, used_avatar_id, sid)
+        except QueueFullError as e:
+            return stage_busy_response(e, sid)
+        except models.ModelLoadError as e:
+            return model_unavailable_response(e, sid)
+        except avatar.InvalidImageError as e:
+            return JSONResponse(content={"error": f"Invalid image: {e}"}, status_code=400, headers={"X-Session-ID": sid})
+        except Exception as e:
+            return JSONResponse(content={"error": str(e)}, status_code=500)
+    finally:
+        if not keep_form:
+            form.close()
+
+# --- Avatar render jobs ---
+# Instead of holding a request open for the whole render, POST /jobs/avatar queues it and
+# returns a job id at once; clients poll GET /jobs/{id} or follow GET /jobs/{id}/events (SSE).
+
+AVATAR_JOB_FORM = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "required": ["audio"],
+                    "properties": dict(
+                        GENERATE_AVATAR_FORM["requestBody"]["content"]["multipart/form-data"]["schema"]["properties"],
+                        priority={"type": "string", "enum": list(PRIORITIES), "default": "normal"},
+                    ),
+                }
+            }
+        },
+    }
+}
+# Per-frame progress is coalesced to at most one SSE event per this many seconds
+JOB_EVENTS_MIN_INTERVAL = 0.2
+JOB_EVENTS_KEEPALIVE = 15.0
+
+def avatar_job(form: uploads.MultipartForm, identity: Optional[avatar.AvatarIdentity], sid: str) -> Callable[[Job], None]:
+    """The job function for one render; the job owns form until it finishes."""
+    audio = form.file("audio")
+    image = form.file("image")
+
+    def run(job: Job):
+        def on_start(live: LiveVideo, used_avatar_id: Optional[str]):
+            # The video is streamable from here on, before the render completes;
+            # a client streaming it counts as watching the job
+            job.watched_at = live.watched_at
+            job.update(video_url=f"/videos/{live.key}", avatar_id=used_avatar_id)
+
+        key, _, latency, used_avatar_id = run_avatar(
+            audio.view(), image.view() if image else None, identity, None, sid, on_start,
+            progress=job.report, cancel=job.cancel_event
+        )
+        job.update(video_url=f"/videos/{key}", avatar_id=used_avatar_id, latency=latency)
+
+    return run
+
+def job_json(job: Job) -> dict:
+    return dict(
+        job.to_dict(avatar_jobs.position(job)),
+        status_url=f"/jobs/{job.id}",
+        events_url=f"/jobs/{job.id}/events"
+    )
+
+# POST /jobs/avatar — queue an avatar render; 202 with the job id right away
+@app.post("/jobs/avatar", status_code=202, openapi_extra=AVATAR_JOB_FORM)
+async def submit_avatar_job(
+    request: Request,
+    session_id: str = Header(None),
+    session_cookie: str = Cookie(None),
+    session_id_query: Optional[str] = Query(None)
+):
+    """
+    Same inputs as /generate-avatar plus an optional priority (high, normal, low).
+    Jobs run in priority order, taking turns between sessions. Poll GET /jobs/{id} or
+    subscribe to GET /jobs/{id}/events; video_url can be streamed as soon as rendering
+    starts. Jobs nobody polls, watches or streams the video of for JOB_ABANDON_S are cancelled.
+    """
+    sid = get_or_create_session(session_id or session_cookie or session_id_query)
+    headers = {"X-Session-ID": sid}
+    try:
+        form, identity = await read_avatar_form(request, sid)
+    except uploads.UploadError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=e.status_code, headers=headers)
+    try:
+        job = avatar_jobs.submit(
+            sid, avatar_job(form, identity, sid), form.field("priority") or "normal",
+            on_finish=lambda _job: form.close()
+        )
+    except QueueFullError as e:
+        form.close()
+        return stage_busy_response(e, sid)
+    except SessionJobLimitError as e:
+        form.close()
+        return JSONResponse(content={"error": str(e)}, status_code=429, headers=headers)
+    except ValueError as e:
+        form.close()
+        return JSONResponse(content={"error": str(e)}, status_code=400, headers=headers)
+    return JSONResponse(content=job_json(job), status_code=202, headers=dict(headers, Location=f"/jobs/{job.id}"))
+
+def unknown_job_response(job_id: str) -> JSONResponse:
+    return JSONResponse(content={"error": f"Unknown job '{job_id}' (finished jobs are kept for JOB_RETENTION_S)"}, status_code=404)
+
+# GET /jobs/{job_id} — state, queue position, progress and, once rendering, video_url
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str):
+    job = avatar_jobs.get(job_id)
+    if job is None:
+        return unknown_job_response(job_id)
+    return JSONResponse(content=job_json(job))
+
+# DELETE /jobs/{job_id} — cancel; a running render stops at its next frame unless other requests share it
+@app.delete("/jobs/{job_id}")
+def cancel_job(job_id: str):
+    job = avatar_jobs.cancel(job_id)
+    if job is None:
+        return unknown_job_response(job_id)
+    return JSONResponse(content=job_json(job))
+
+async def job_events(job: Job):
+    job.watchers += 1
+    try:
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"event: {job.state}\ndata: {json.dumps(job_json(job))}\n\n"
+                if job.finished:
+                    return
+                await asyncio.sleep(JOB_EVENTS_MIN_INTERVAL)
+                continue
+            try:
+                await asyncio.wait_for(job.wait_change(version), JOB_EVENTS_KEEPALIVE)
+            except asyncio.TimeoutError:
+                yield ": keep-alive\n\n"
+    finally:
+        job.watchers -= 1
+        job.last_seen = time.monotonic()
+
+# GET /jobs/{job_id}/events — Server-Sent Events: one event per change, named after the job state
+@app.get("/jobs/{job_id}/events")
+def job_events_endpoint(job_id: str):
+    """An open stream counts as watching the job, so it is not cancelled as abandoned."""
+    job = avatar_jobs.get(job_id)
+    if job is None:
+        return unknown_job_response(job_id)
+    return StreamingResponse(
+        job_events(job),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+def multipart_part(boundary: str, name: str, content_type: str, body: bytes) -> bytes:
+    head = (
+        f"--{boundary}\r\n"
+        f"Content-Type: {content_type}\r\n"
+        f"Content-Disposition: inline; name=\"{name}\"\r\n"
+        f"Content-Length: {len(body)}\r\n\r\n"
+    ).encode()
+    return head + body + b"\r\n"
+
+# POST /converse — mic audio in, transcript + TTS audio + avatar video out in one call
+@app.post("/converse")
+async def converse_endpoint(
     response: Response,
     audio: UploadFile = File(...),
     image: UploadFile = File(None),
+    avatar_id: Optional[str] = Form(None),
+    reply_text: Optional[str] = Form(None),
+    format: str = Query("multipart"),
     session_id: str = Header(None),
-    session_cookie: str = Cookie(None)
+    session_cookie: str = Cookie(None),
+    session_id_query: Optional[str] = Query(None)
 ):
-    lazy_load_avatar()
-    sid = get_or_create_session(session_id or session_cookie)
+    """
+    Chain STT -> TTS -> avatar in-process. Speaks reply_text if given, otherwise the transcript.
+    The portrait is an uploaded image, the avatar_id of one registered via POST /avatars, or
+    else the portrait this session used last. The session's voice (set via /speak) is reused,
+    and earlier transcripts are passed to Whisper as context.
+    format=multipart streams a multipart/mixed body (transcript, audio, video, timings) part by part;
+    format=json returns everything at once with base64-encoded audio and video.
+    """
+    sid = get_or_create_session(session_id or session_cookie or session_id_query)
     response.headers["X-Session-ID"] = sid
-    if not audio:
-        return JSONResponse(content={"error": "Missing audio file."}, status_code=400)
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_audio:
+    if format not in ("multipart", "json"):
+        return JSONResponse(content={"error": "format must be 'multipart' or 'json'"}, status_code=400)
+    if image:
         try:
-            shutil.copyfileobj(audio.file, tmp_audio)
-            tmp_audio.flush()
-            audio_path = tmp_audio.name
-            image_path = None
-            if image:
-                with tempfile.NamedTemporaryFile(delete=False, suffix=".png") as tmp_image:
-                    ext = ".jpg" if image.content_type in ["image/jpeg", "image/jpg"] else ".png"
-                    tmp_image.close()
-                    with open(tmp_image.name, "wb") as img_out:
-                        shutil.copyfileobj(image.file, img_out)
-                    image_path = tmp_image.name
-            video_path, latency = avatar.generate_avatar(audio_path, image_path)
-            headers = {"X-Latency": f"{latency}s", "X-Session-ID": sid}
-            if video_path and os.path.exists(video_path):
-                return FileResponse(
-                    video_path,
-                    media_type="video/mp4",
-                    filename="avatar.mp4",
-                    headers=headers
-                )
-            else:
-                return JSONResponse(content={"error": "Failed to generate video file"}, status_code=500)
+            portrait = await get_stage("avatar").run(avatar.register_avatar_image, await image.read())
+        except QueueFullError as e:
+            return stage_busy_response(e, sid)
         except Exception as e:
-            return JSONResponse(content={"error": str(e)}, status_code=500)
-        finally:
-            temp_files = [tmp_audio.name]
-            if 'image_path' in locals() and image_path:
-                temp_files.append(image_path)
-            for path in temp_files:
-                if path and os.path.exists(path):
-                    os.remove(path)
+            return JSONResponse(content={"error": f"Invalid image: {str(e)}"}, status_code=400)
+    else:
+        portrait = session_avatar(sid, avatar_id)
+        if portrait is None and avatar_id:
+            return unknown_avatar_response(avatar_id)
+    remember_avatar(sid, portrait)
+    timings = {}
+    try:
+        transcript = await pipeline.transcribe_stage(audio, timings, session_prompt(sid))
+    except QueueFullError as e:
+        return stage_busy_response(e, sid)
+    except models.ModelLoadError as e:
+        return model_unavailable_response(e, sid)
+    except pipeline.PipelineError as e:
+        return JSONResponse(content={"error": str(e), "stage": e.stage}, status_code=e.status_code)
+    if transcript.strip():
+        session_states.add_transcript(sid, transcript)
+    state = get_session_state(sid)
+    voice = state.voice if state is not None else None
+    embedding = state.speaker_embedding if state is not None and state.voice_backend == speak.tts_backend else None
+    text = reply_text if reply_text and reply_text.strip() else transcript
+    if not text.strip():
+        return JSONResponse(content={"error": "No speech detected.", "transcript": transcript}, status_code=400)
+
+    if format == "json":
+        result = {"transcript": transcript, "reply_text": text}
+        try:
+            async for name, payload in pipeline.synthesis_stages(text, portrait, timings, voice, embedding):
+                result[f"{name}_base64"] = base64.b64encode(payload).decode("ascii")
+        except QueueFullError as e:
+            return stage_busy_response(e, sid)
+        except models.ModelLoadError as e:
+            return model_unavailable_response(e, sid)
+        except pipeline.PipelineError as e:
+            return JSONResponse(content={"error": str(e), "stage": e.stage}, status_code=e.status_code)
+        result["timings"] = timings
+        return JSONResponse(content=result, headers={"X-Session-ID": sid})
+
+    boundary = uuid.uuid4().hex
+    media_types = {"audio": "audio/wav", "video": "video/mp4"}
+
+    async def parts():
+        meta = json.dumps({"transcript": transcript, "reply_text": text}).encode()
+        yield multipart_part(boundary, "transcript", "application/json", meta)
+        try:
+            async for name, payload in pipeline.synthesis_stages(text, portrait, timings, voice, embedding):
+                yield multipart_part(boundary, name, media_types[name], payload)
+        except (QueueFullError, pipeline.PipelineError, models.ModelLoadError) as e:
+            error = {"error": str(e), "stage": getattr(e, "stage", None)}
+            yield multipart_part(boundary, "error", "application/json", json.dumps(error).encode())
+        yield multipart_part(boundary, "timings", "application/json", json.dumps(timings).encode())
+        yield f"--{boundary}--\r\n".encode()
+
+    return StreamingResponse(
+        parts(),
+        media_type=f"multipart/mixed; boundary={boundary}",
+        headers={"X-Session-ID": sid}
+    )
+
+# POST /avatars — register a portrait once, reuse its preprocessing via avatar_id
+@app.post("/avatars")
+async def register_avatar_endpoint(image: UploadFile = File(...)):
+    """Upload an avatar portrait; returns an avatar_id to pass to /generate-avatar and /converse."""
+    def _register():
+        return avatar.register_avatar_image(image.file.read())
+    try:
+        identity = await get_stage("avatar").run(_register)
+    except QueueFullError as e:
+        return stage_busy_response(e)
+    except Exception as e:
+        return JSONResponse(content={"error": f"Invalid image: {str(e)}"}, status_code=400)
+    return JSONResponse(content={"avatar_id": identity.avatar_id})
+
+# GET /videos/{video_id} — rendered video by cache key (immutable, browser-cacheable), or streamed while still rendering
+@app.get("/videos/{video_id}")
+async def get_video(request: Request, video_id: str, if_none_match: Optional[str] = Header(None)):
+    live = avatar.live_video(video_id) if video_id.isalnum() else None
+    if live is not None and not live.done:
+        # Not cacheable yet: the stream ends early if the render fails
+        return await live_video_response(request, live, {"Cache-Control": "no-store"})
+    headers = {"Cache-Control": "public, max-age=31536000, immutable"}
+    path = avatar.cached_video_path(video_id) if video_id.isalnum() else None
+    if not path:
+        return JSONResponse(content={"error": "Video not found."}, status_code=404)
+    if etag_matches(if_none_match, video_id):
+        return Response(status_code=304, headers=dict(headers, ETag=f'"{video_id}"'))
+    return video_response(path, video_id, headers)
 
 # GET /status — returns { "status": "ok" }
 @app.get("/status")
 def status():
-    """Health check endpoint."""
+    """Health check endpoint (liveness): the process is up, whether or not models are loaded."""
     return JSONResponse(content={"status": "ok"})
 
+# GET /ready — 200 once every preloaded model is loaded, 503 until then
+@app.get("/ready")
+def ready():
+    """Readiness endpoint: per-model load state and load durations."""
+    is_ready = models.registry.is_ready(models.PRELOAD_MODELS)
+    return JSONResponse(
+        content={"ready": is_ready, "models": models.registry.status()},
+        status_code=200 if is_ready else 503
+    )
+
+# POST /models/{name}/unload, /models/{name}/reload — free or refresh one model's memory.
+# Admin only: disabled (404) unless MODEL_ADMIN_TOKEN is set, and callers must send it
+# as X-Admin-Token, since anyone could otherwise drop models or force repeated reloads.
+MODEL_ADMIN_TOKEN = os.getenv("MODEL_ADMIN_TOKEN", "")
+
+def model_admin_denied(token: Optional[str]) -> Optional[JSONResponse]:
+    """The response refusing a model admin call, or None if token is the admin token."""
+    if not MODEL_ADMIN_TOKEN:
+        return JSONResponse(content={"error": "Not Found"}, status_code=404)
+    if not token or not hmac.compare_digest(token.encode(), MODEL_ADMIN_TOKEN.encode()):
+        return JSONResponse(content={"error": "Missing or invalid X-Admin-Token"}, status_code=403)
+    return None
+
+@app.post("/models/{name}/unload")
+def unload_model(name: str, x_admin_token: Optional[str] = Header(None)):
+    """Unload a model once in-flight requests using it finish; the next request reloads it."""
+    denied = model_admin_denied(x_admin_token)
+    if denied is not None:
+        return denied
+    if name not in models.registry.names():
+        return JSONResponse(content={"error": f"Unknown model '{name}'"}, status_code=404)
+    unloaded = models.registry.unload(name)
+    return JSONResponse(content={"unloaded": unloaded, "model": models.registry.status()[name]})
+
+@app.post("/models/{name}/reload")
+def reload_model(name: str, x_admin_token: Optional[str] = Header(None)):
+    denied = model_admin_denied(x_admin_token)
+    if denied is not None:
+        return denied
+    if name not in models.registry.names():
+        return JSONResponse(content={"error": f"Unknown model '{name}'"}, status_code=404)
+    try:
+        models.registry.reload(name)
+    except models.ModelLoadError as e:
+        return JSONResponse(content={"error": str(e), "model": models.registry.status()[name]}, status_code=500)
+    return JSONResponse(content={"model": models.registry.status()[name]})
+
+@app.get("/stats")
+def stats():
+    """Per-stage worker pool stats (queue depth, rejections, queue wait vs. compute time), cache and trace export counters."""
+    return JSONResponse(content={
+        "stages": get_stage_stats(),
+        "tts_cache": speak.tts_cache.stats(),
+        "video_cache": avatar.video_cache.stats(),
+        "video_renders": avatar.live_videos.stats(),
+        "avatar_jobs": avatar_jobs.stats(),
+        "avatar_identities": avatar.identity_registry.stats(),
+        "whisper_batching": transcribe.batcher.stats() if transcribe.batcher else None,
+        "model_residency": residency.stats(),
+        "sessions": session_manager.stats(),
+        "session_state": session_states.stats(),
+        "tracing": tracing.sink.stats()
+    })
+
+# GET /metrics — Prometheus text format
+@app.get("/metrics")
+def metrics_endpoint():
+    """Request/stage/phase latency histograms, error, fallback and cache counters, active sessions."""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+# GET /debug/startup — cold-start profile (only with STARTUP_PROFILE=1)
+@app.get("/debug/startup")
+def debug_startup():
+    """Per-phase startup timings, model load times and the slowest imports."""
+    if startup_profile.profile is None:
+        return JSONResponse(content={"error": "Set STARTUP_PROFILE=1 to profile startup."}, status_code=404)
+    return JSONResponse(content=startup_profile.profile.report(models.registry.status()))
+
 @app.get("/")
 def root():
     return JSONResponse({"message": "Welcome to the Daylily AI Avatar API! See /docs for usage."})
@@ -170,7 +989,16 @@ def debug():
             "/transcribe",
             "/speak", 
             "/generate-avatar",
+            "/converse",
+            "/ws/transcribe",
+            "/avatars",
             "/status",
+            "/ready",
+            "/models/{name}/unload",
+            "/models/{name}/reload",
+            "/stats",
+            "/metrics",
+            "/debug/startup",
             "/warmup"
         ]
     })
@@ -183,4 +1011,6 @@ async def avatar_fix(audio: UploadFile = File(...), session_id: str = Header(Non
         "session_id": session_id
     })
 
+startup_profile.mark("app")
+
 # For serverless: entrypoint is app (FastAPI instance) 
\ No newline at end of file
@@ -0,0 +1,104 @@
+import io
+import struct
+import time
+import wave
+import zlib
+from typing import List
+
+import numpy as np
+
+# Deterministic stand-ins for the models and request payloads, shared by the benchmark
+# scripts. Stubs replace a model's registry entry, so they must be installed after main
+# is imported and before the app starts (its lifespan preloads models).
+
+
+def make_wav(seconds: float = 1.0, rate: int = 16000, freq: float = 220.0) -> bytes:
+    t = np.arange(int(seconds * rate)) / rate
+    tone = (0.3 * np.sin(2 * np.pi * freq * t) * 32767).astype("<i2")
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(rate)
+        w.writeframes(tone.tobytes())
+    return buf.getvalue()
+
+
+def make_png(size: int = 128, tint: int = 128) -> bytes:
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+    ramp = np.arange(size, dtype=np.uint32) * 255 // size
+    pixels = np.empty((size, size, 3), dtype=np.uint8)
+    pixels[..., 0] = ramp[None, :]
+    pixels[..., 1] = ramp[:, None]
+    pixels[..., 2] = tint % 256
+    # 8-bit RGB; each row starts with filter type 0
+    rows = np.concatenate([np.zeros((size, 1), dtype=np.uint8), pixels.reshape(size, -1)], axis=1)
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(rows.tobytes())) + chunk(b"IEND", b""))
+
+
+class _StubSegment:
+    __slots__ = ("text",)
+
+    def __init__(self, text: str):
+        self.text = text
+
+
+class StubWhisper:
+    """Answers every transcribe() after compute_s with a transcript derived from the audio length."""
+    def __init__(self, compute_s: float = 0.0):
+        self.compute_s = compute_s
+
+    def transcribe(self, audio, **kwargs):
+        if self.compute_s:
+            time.sleep(self.compute_s)
+        return [_StubSegment(f" stub transcript of {len(audio)} samples")], None
+
+
+class StubTTS:
+    """Bark-style callable: a tone of 60 ms per character, after compute_s_per_char per character."""
+    sample_rate = 24000
+
+    def __init__(self, compute_s_per_char: float = 0.0):
+        self.compute_s_per_char = compute_s_per_char
+
+    def __call__(self, text: str, history_prompt=None):
+        if self.compute_s_per_char:
+            time.sleep(self.compute_s_per_char * len(text))
+        t = np.arange(int(0.06 * len(text) * self.sample_rate)) / self.sample_rate
+        return (0.3 * np.sin(2 * np.pi * (200 + 5 * (len(text) % 40)) * t)).astype(np.float32)
+
+
+def stub_names(spec: str) -> List[str]:
+    """Model names from a comma-separated list; "all" means every registered model."""
+    from backend import models
+    if spec.strip().lower() == "all":
+        return models.registry.names()
+    return [name.strip() for name in spec.split(",") if name.strip()]
+
+
+def install_stub_models(names: List[str], load_s: float = 0.0, whisper_s: float = 0.0, tts_s_per_char: float = 0.0):
+    """
+    Re-register the named models with loads that take load_s and need no weights.
+    Whisper and TTS get the stubs above; the avatar renderer is already a placeholder
+    (pace it with AVATAR_PLACEHOLDER_RENDER_FPS).
+    """
+    from backend import models, speak, transcribe
+
+    def stub(name: str):
+        def load():
+            time.sleep(load_s)
+            if name == "whisper":
+                transcribe.model = StubWhisper(whisper_s)
+            elif name == "tts":
+                speak.tts_model = StubTTS(tts_s_per_char)
+                speak.tts_backend = "bark"
+                speak.bark_sample_rate = StubTTS.sample_rate
+        return load
+
+    for name in names:
+        models.registry.register(name, stub(name))
+    if "whisper" in names:
+        # StubWhisper only has transcribe(), so it can't go through BatchedInferencePipeline
+        transcribe.batcher = None
@@ -0,0 +1,263 @@
+import json
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from statistics import mean
+from typing import Dict, List, Optional
+
+import httpx
+import psutil
+
+# bench_stubs sits next to this script; make it importable however the script is started
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_stubs import install_stub_models, make_png, make_wav, stub_names  # noqa: E402
+
+# Local cold-start benchmark: starts a fresh uvicorn process for main:app per run and
+# measures time-to-listen (TCP accept), time-to-ready (/ready 200), the first request
+# to each endpoint (time to first byte and total) and the process's peak RSS.
+# Results for every run plus p50/p95 distributions go to COLD_BENCH_JSON, tagged with
+# the git commit so runs on two commits can be compared.
+#
+# COLD_BENCH_STUB_MODELS=all (or e.g. "whisper,tts") swaps the named models for stubs
+# that take COLD_BENCH_STUB_LOAD_S to "load" and need no weights: Whisper answers with a
+# fixed transcript, TTS returns tones, the avatar renderer is already a placeholder.
+# That makes the harness usable in CI and isolates the server's own startup cost.
+# PRELOAD_MODELS and the other server settings are passed through from the environment.
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+NUM_RUNS = int(os.getenv("COLD_BENCH_RUNS", 5))
+ENDPOINTS = [e.strip() for e in os.getenv("COLD_BENCH_ENDPOINTS", "status,transcribe,speak,generate-avatar").split(",") if e.strip()]
+STUB_MODELS = os.getenv("COLD_BENCH_STUB_MODELS", "")
+STUB_LOAD_S = float(os.getenv("COLD_BENCH_STUB_LOAD_S", 0))
+# Send the first requests once /ready is 200 (1) or as soon as the port accepts (0)
+WAIT_READY = os.getenv("COLD_BENCH_WAIT_READY", "1") == "1"
+# A fresh process per endpoint, so each one's first request is the process's first request
+ISOLATE = os.getenv("COLD_BENCH_ISOLATE", "0") == "1"
+PORT = int(os.getenv("COLD_BENCH_PORT", 8790))
+TIMEOUT_S = float(os.getenv("COLD_BENCH_TIMEOUT_S", 300))
+OUTPUT_JSON = os.getenv("COLD_BENCH_JSON", "cold_start_bench_results.json")
+
+POLL_S = 0.01
+RSS_POLL_S = 0.02
+
+
+AUDIO = make_wav()
+IMAGE = make_png()
+
+
+def endpoint_request(name: str) -> dict:
+    """httpx request arguments for the first request to an endpoint."""
+    if name == "status":
+        return {"method": "GET", "url": "/status"}
+    if name == "transcribe":
+        return {"method": "POST", "url": "/transcribe", "files": {"audio": ("bench.wav", AUDIO, "audio/wav")}}
+    if name == "speak":
+        return {"method": "POST", "url": "/speak", "json": {"text": "Hello from a cold start."}}
+    if name == "generate-avatar":
+        return {"method": "POST", "url": "/generate-avatar", "files": {
+            "audio": ("bench.wav", AUDIO, "audio/wav"),
+            "image": ("bench.png", IMAGE, "image/png"),
+        }}
+    return {"method": "GET", "url": "/" + name.lstrip("/")}
+
+
+# --- Server side (python cold_start_bench.py serve PORT) ---
+
+def serve(port: int):
+    sys.path.insert(0, ROOT)
+    import uvicorn
+    import main
+    install_stub_models(stub_names(STUB_MODELS), STUB_LOAD_S)
+    uvicorn.run(main.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+# --- Harness side ---
+
+class RssSampler(threading.Thread):
+    """Peak RSS of a process and its children, sampled every RSS_POLL_S."""
+    def __init__(self, pid: int):
+        super().__init__(daemon=True)
+        self.process = psutil.Process(pid)
+        self.peak = 0
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                rss = self.process.memory_info().rss
+                for child in self.process.children(recursive=True):
+                    rss += child.memory_info().rss
+            except psutil.Error:
+                return
+            self.peak = max(self.peak, rss)
+            self.stopped.wait(RSS_POLL_S)
+
+
+def wait_listening(port: int, process: subprocess.Popen, deadline: float) -> bool:
+    while time.monotonic() < deadline and process.poll() is None:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=POLL_S * 10):
+                return True
+        except OSError:
+            time.sleep(POLL_S)
+    return False
+
+
+def wait_ready(client: httpx.Client, process: subprocess.Popen, deadline: float) -> Optional[str]:
+    """None once /ready is 200, else why it never got there."""
+    while time.monotonic() < deadline and process.poll() is None:
+        resp = client.get("/ready")
+        if resp.status_code == 200:
+            return None
+        states = [m["state"] for m in resp.json().get("models", {}).values()]
+        if "failed" in states and "loading" not in states:
+            return "model load failed: " + json.dumps(resp.json()["models"])
+        time.sleep(POLL_S * 5)
+    return "timed out" if process.poll() is None else f"server exited with {process.returncode}"
+
+
+def first_request(client: httpx.Client, name: str) -> dict:
+    start = time.perf_counter()
+    try:
+        with client.stream(**endpoint_request(name)) as resp:
+            ttfb = None
+            size = 0
+            for chunk in resp.iter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter() - start
+                size += len(chunk)
+            return {
+                "status": resp.status_code,
+                "ttfb_s": round(ttfb if ttfb is not None else time.perf_counter() - start, 4),
+                "latency_s": round(time.perf_counter() - start, 4),
+                "bytes": size,
+            }
+    except httpx.HTTPError as e:
+        return {"status": None, "error": str(e), "latency_s": round(time.perf_counter() - start, 4)}
+
+
+def run_once(endpoints: List[str]) -> dict:
+    cache_dir = tempfile.mkdtemp(prefix="cold-bench-")
+    env = dict(os.environ, AVATAR_CACHE_DIR=os.path.join(cache_dir, "avatar"))
+    env.pop("TTS_CACHE_DIR", None)
+    if STUB_MODELS:
+        cmd = [sys.executable, os.path.abspath(__file__), "serve", str(PORT)]
+    else:
+        cmd = [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(PORT),
+               "--log-level", "warning"]
+    result: Dict = {"endpoints": endpoints}
+    start = time.perf_counter()
+    deadline = time.monotonic() + TIMEOUT_S
+    # A file rather than a pipe: nothing reads the server's log until it exits
+    log = open(os.path.join(cache_dir, "server.log"), "w+b")
+    process = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=log)
+    sampler = RssSampler(process.pid)
+    sampler.start()
+    try:
+        if not wait_listening(PORT, process, deadline):
+            result["error"] = "server never listened"
+            return result
+        result["listen_s"] = round(time.perf_counter() - start, 4)
+        with httpx.Client(base_url=f"http://127.0.0.1:{PORT}", timeout=TIMEOUT_S) as client:
+            if WAIT_READY:
+                error = wait_ready(client, process, deadline)
+                if error is not None:
+                    result["error"] = error
+                    return result
+                result["ready_s"] = round(time.perf_counter() - start, 4)
+            result["first_requests"] = {name: first_request(client, name) for name in endpoints}
+            if not WAIT_READY:
+                error = wait_ready(client, process, deadline)
+                if error is None:
+                    result["ready_s"] = round(time.perf_counter() - start, 4)
+    finally:
+        sampler.stopped.set()
+        sampler.join()
+        result["peak_rss_mb"] = round(sampler.peak / 1024 / 1024, 1)
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+        if "error" in result:
+            log.seek(max(0, log.seek(0, os.SEEK_END) - 2000))
+            result["stderr_tail"] = log.read().decode(errors="replace")
+        log.close()
+        shutil.rmtree(cache_dir, ignore_errors=True)
+    return result
+
+
+def distribution(values: List[float]) -> Optional[dict]:
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    pick = lambda q: values[min(len(values) - 1, round(q * (len(values) - 1)))]  # noqa: E731
+    return {"n": len(values), "min": values[0], "p50": pick(0.5), "p95": pick(0.95), "max": values[-1],
+            "mean": round(mean(values), 4)}
+
+
+def summarize(runs: List[dict]) -> dict:
+    summary = {
+        "listen_s": distribution([r.get("listen_s") for r in runs]),
+        "ready_s": distribution([r.get("ready_s") for r in runs]),
+        "peak_rss_mb": distribution([r.get("peak_rss_mb") for r in runs]),
+        "first_request": {},
+    }
+    for name in ENDPOINTS:
+        hits = [r["first_requests"][name] for r in runs if name in r.get("first_requests", {})]
+        summary["first_request"][name] = {
+            "ttfb_s": distribution([h.get("ttfb_s") for h in hits]),
+            "latency_s": distribution([h.get("latency_s") for h in hits]),
+            "statuses": sorted({h.get("status") for h in hits}, key=str),
+        }
+    return summary
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    groups = [[name] for name in ENDPOINTS] if ISOLATE else [ENDPOINTS]
+    runs = []
+    print(f"Cold-start benchmark: {NUM_RUNS} runs x {len(groups)} process(es), endpoints {ENDPOINTS}, "
+          f"stub models: {STUB_MODELS or 'none'}")
+    for i in range(NUM_RUNS):
+        for group in groups:
+            result = run_once(group)
+            result["run"] = i + 1
+            runs.append(result)
+            firsts = ", ".join(f"{n} {r.get('latency_s')}s" for n, r in result.get("first_requests", {}).items())
+            print(f"  run {i + 1}: listen {result.get('listen_s')}s, ready {result.get('ready_s')}s, "
+                  f"peak RSS {result.get('peak_rss_mb')} MB; {firsts or result.get('error')}")
+    report = {
+        "commit": git_commit(),
+        "config": {
+            "runs": NUM_RUNS, "endpoints": ENDPOINTS, "stub_models": STUB_MODELS, "stub_load_s": STUB_LOAD_S,
+            "wait_ready": WAIT_READY, "isolate": ISOLATE, "preload_models": os.getenv("PRELOAD_MODELS"),
+        },
+        "summary": summarize(runs),
+        "runs": runs,
+    }
+    with open(OUTPUT_JSON, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report["summary"], indent=2))
+    print(f"Results saved to {OUTPUT_JSON}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "serve":
+        serve(int(sys.argv[2]))
+    else:
+        main()
@@ -0,0 +1,119 @@
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import wave
+from statistics import mean, median
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from backend.transcribe import decode_upload  # noqa: E402
+from faster_whisper.audio import decode_audio  # noqa: E402
+
+# Compares the old /transcribe decode path (temp file, pydub re-export to WAV,
+# faster-whisper re-reading the file) with the in-memory decode_upload path.
+# Only decoding is timed; no Whisper model is needed.
+
+NUM_RUNS = int(os.getenv("DECODE_BENCH_RUNS", 20))
+DURATION = float(os.getenv("DECODE_BENCH_SECONDS", 5))
+OUTPUT_JSON = os.getenv("DECODE_BENCH_JSON", "decode_benchmark_results.json")
+
+try:
+    from pydub import AudioSegment
+    from pydub.utils import which
+    PYDUB_AVAILABLE = which("ffmpeg") is not None
+except ImportError:
+    PYDUB_AVAILABLE = False
+
+
+def make_wav(sample_rate: int, channels: int = 1) -> bytes:
+    t = np.arange(int(sample_rate * DURATION)) / sample_rate
+    tone = (0.3 * np.sin(2 * np.pi * 220 * t) * 32767).astype("<i2")
+    if channels > 1:
+        tone = np.repeat(tone, channels)
+    buf = io.BytesIO()
+    with wave.open(buf, "wb") as w:
+        w.setnchannels(channels)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(tone.tobytes())
+    return buf.getvalue()
+
+
+def make_compressed(fmt: str, codec: str) -> bytes:
+    import av
+    sample_rate = 48000
+    t = np.arange(int(sample_rate * DURATION)) / sample_rate
+    tone = (0.3 * np.sin(2 * np.pi * 220 * t)).astype(np.float32)
+    out = io.BytesIO()
+    with av.open(out, mode="w", format=fmt) as container:
+        stream = container.add_stream(codec, rate=sample_rate)
+        stream.layout = "mono"
+        frame_size = 960
+        for start in range(0, tone.size, frame_size):
+            chunk = tone[start:start + frame_size]
+            frame = av.AudioFrame.from_ndarray(chunk.reshape(1, -1), format="flt", layout="mono")
+            frame.sample_rate = sample_rate
+            for packet in stream.encode(frame):
+                container.mux(packet)
+        for packet in stream.encode(None):
+            container.mux(packet)
+    return out.getvalue()
+
+
+def legacy_decode(data: bytes, pydub_format):
+    """The previous transcribe_audio path: temp file (+ pydub export), then decode from disk."""
+    upload = io.BytesIO(data)
+    with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp:
+        if pydub_format:
+            audio = AudioSegment.from_file(upload, format=pydub_format)
+            audio.export(tmp.name, format="wav")
+        else:
+            tmp.write(upload.read())
+            tmp.flush()
+        tmp_path = tmp.name
+    try:
+        return decode_audio(tmp_path, sampling_rate=16000)
+    finally:
+        os.remove(tmp_path)
+
+
+def time_runs(fn):
+    times = []
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"mean_ms": mean(times) * 1000, "p50_ms": median(times) * 1000, "max_ms": max(times) * 1000}
+
+
+def main():
+    cases = [
+        ("wav_16k_mono", make_wav(16000), "audio/wav", None),
+        ("wav_48k_stereo", make_wav(48000, channels=2), "audio/wav", None),
+        ("mp3", make_compressed("mp3", "libmp3lame"), "audio/mpeg", "mp3"),
+        ("webm_opus", make_compressed("webm", "libopus"), "audio/webm", "webm"),
+    ]
+    results = {}
+    for name, data, content_type, pydub_format in cases:
+        row = {"bytes": len(data)}
+        row["in_memory"] = time_runs(lambda: decode_upload(io.BytesIO(data), content_type))
+        if pydub_format is None or PYDUB_AVAILABLE:
+            row["legacy"] = time_runs(lambda: legacy_decode(data, pydub_format))
+            row["speedup"] = round(row["legacy"]["mean_ms"] / row["in_memory"]["mean_ms"], 2)
+        else:
+            row["legacy"] = None
+        results[name] = row
+        legacy = f"{row['legacy']['mean_ms']:.2f}ms" if row["legacy"] else "n/a (pydub/ffmpeg missing)"
+        print(f"{name}: in-memory={row['in_memory']['mean_ms']:.2f}ms legacy={legacy}")
+
+    with open(OUTPUT_JSON, "w") as f:
+        json.dump({"runs": NUM_RUNS, "duration_s": DURATION, "results": results}, f, indent=2)
+    print(f"Results saved to {OUTPUT_JSON}")
+
+
+if __name__ == "__main__":
+    main()
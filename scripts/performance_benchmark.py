@@ -1,111 +1,380 @@
 import asyncio
-import httpx
-import uuid
-import time
-import json
 import csv
+import json
 import os
-from statistics import mean, median, quantiles
-from typing import List, Dict
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List, Optional
+
+import httpx
 import psutil
-try:
-    import GPUtil
-    GPU_AVAILABLE = True
-except ImportError:
-    GPU_AVAILABLE = False
-
-# Configurable parameters
-API_URL = os.getenv("BENCH_API_URL", "http://localhost:8000")
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.insert(0, ROOT)
+# bench_stubs sits next to this script; make it importable however the script is started
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from bench_stubs import install_stub_models, make_png, make_wav, stub_names  # noqa: E402
+
+# Load benchmark for the API. Without BENCH_API_URL the FastAPI app runs in this process
+# (httpx ASGI transport, lifespan included), so no server or model weights are needed;
+# with it, requests go to that server instead.
+#
+# BENCH_MODE=closed keeps BENCH_CONCURRENCY requests in flight until BENCH_NUM_REQUESTS
+# have completed. BENCH_MODE=open starts requests at BENCH_RATE per second regardless of
+# how many are still running (Poisson arrivals, or evenly spaced with
+# BENCH_ARRIVALS=uniform); latency counts from the scheduled start, so a server that falls
+# behind can't hide it (no coordinated omission).
+# Request i goes to endpoint i % len(BENCH_ENDPOINTS), with its own audio/image unless
+# BENCH_UNIQUE=0 (then every request is identical and the TTS/video caches hit).
+#
+# In-process runs stub the models in BENCH_STUB_MODELS (default all): Whisper takes
+# BENCH_STUB_WHISPER_MS, TTS BENCH_STUB_TTS_MS_PER_CHAR per character, and the avatar
+# placeholder renders at AVATAR_PLACEHOLDER_RENDER_FPS. Everything is seeded by BENCH_SEED.
+#
+# Results follow a fixed schema (see SCHEMA) in BENCH_JSON; BENCH_BASELINE names an earlier
+# result file to compare percentiles against. BENCH_CSV (optional) gets every request.
+
+SCHEMA = "daylily-benchmark/1"
+
+API_URL = os.getenv("BENCH_API_URL")
+MODE = os.getenv("BENCH_MODE", "closed")
 CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", 10))
-NUM_REQUESTS = int(os.getenv("BENCH_NUM_REQUESTS", 20))
-AUDIO_PATH = os.getenv("BENCH_AUDIO", "test.wav")
-IMAGE_PATH = os.getenv("BENCH_IMAGE", "test.png")
-OUTPUT_CSV = os.getenv("BENCH_CSV", "benchmark_results.csv")
-OUTPUT_JSON = os.getenv("BENCH_JSON", "benchmark_results.json")
-
-# Helper to read binary files
-with open(AUDIO_PATH, "rb") as f:
-    AUDIO_BYTES = f.read()
-with open(IMAGE_PATH, "rb") as f:
-    IMAGE_BYTES = f.read()
-
-async def get_memory_gpu_usage():
-    mem = psutil.virtual_memory()
-    mem_used = mem.used / (1024 ** 2)  # MB
-    gpu_used = 0
-    if GPU_AVAILABLE:
-        gpus = GPUtil.getGPUs()
-        if gpus:
-            gpu_used = max([gpu.memoryUsed for gpu in gpus])  # MB
-    return mem_used, gpu_used
-
-async def benchmark_user(client, user_id, results: List[Dict]):
-    timings = {}
-    session_id = str(uuid.uuid4())
-    # 1. /transcribe
-    start = time.perf_counter()
-    mem_before, gpu_before = await get_memory_gpu_usage()
-    files = {'file': (AUDIO_PATH, AUDIO_BYTES, 'audio/wav')}
-    resp = await client.post(f"{API_URL}/transcribe", files=files, headers={"session_id": session_id})
-    timings['transcribe_latency'] = resp.json().get('latency', -1)
-    timings['transcribe_status'] = resp.status_code
-    timings['transcribe_time'] = time.perf_counter() - start
-    mem_after, gpu_after = await get_memory_gpu_usage()
-    timings['mem_transcribe'] = mem_after - mem_before
-    timings['gpu_transcribe'] = gpu_after - gpu_before
-    # 2. /speak
-    start = time.perf_counter()
-    mem_before, gpu_before = await get_memory_gpu_usage()
-    text = resp.json().get('transcript', 'Hello!')
-    resp2 = await client.post(f"{API_URL}/speak", json={"text": text}, headers={"session_id": session_id})
-    timings['speak_latency'] = float(resp2.headers.get('X-Latency', -1))
-    timings['speak_status'] = resp2.status_code
-    timings['speak_time'] = time.perf_counter() - start
-    mem_after, gpu_after = await get_memory_gpu_usage()
-    timings['mem_speak'] = mem_after - mem_before
-    timings['gpu_speak'] = gpu_after - gpu_before
-    # 3. /generate-avatar
+NUM_REQUESTS = int(os.getenv("BENCH_NUM_REQUESTS", 200))
+RATE = float(os.getenv("BENCH_RATE", 20))
+ARRIVALS = os.getenv("BENCH_ARRIVALS", "poisson")
+ENDPOINTS = [e.strip() for e in os.getenv("BENCH_ENDPOINTS", "transcribe,speak,generate-avatar").split(",") if e.strip()]
+WARMUP_REQUESTS = int(os.getenv("BENCH_WARMUP", len(ENDPOINTS)))
+UNIQUE = os.getenv("BENCH_UNIQUE", "1") == "1"
+SESSIONS = int(os.getenv("BENCH_SESSIONS", CONCURRENCY))
+SEED = int(os.getenv("BENCH_SEED", 1))
+TIMEOUT_S = float(os.getenv("BENCH_TIMEOUT_S", 120))
+STUB_MODELS = os.getenv("BENCH_STUB_MODELS", "all")
+STUB_WHISPER_S = float(os.getenv("BENCH_STUB_WHISPER_MS", 50)) / 1000
+STUB_TTS_S_PER_CHAR = float(os.getenv("BENCH_STUB_TTS_MS_PER_CHAR", 1)) / 1000
+# Server process to sample RSS from when benchmarking BENCH_API_URL (in-process: this one,
+# which includes the client's own memory)
+SERVER_PID = os.getenv("BENCH_SERVER_PID")
+# Paths are resolved now: in-process runs change into the repository root
+_path = lambda name, default=None: os.path.abspath(os.getenv(name, default)) if os.getenv(name, default) else None  # noqa: E731
+AUDIO_PATH = _path("BENCH_AUDIO")
+IMAGE_PATH = _path("BENCH_IMAGE")
+OUTPUT_JSON = _path("BENCH_JSON", "benchmark_results.json")
+OUTPUT_CSV = _path("BENCH_CSV")
+BASELINE_JSON = _path("BENCH_BASELINE")
+
+RSS_POLL_S = 0.05
+PHRASES = [
+    "Hello there, how are you today?",
+    "Tell me something interesting about the ocean.",
+    "What is the weather going to be like tomorrow?",
+    "Thanks, that was really helpful.",
+]
+
+
+def read_file(path: Optional[str]) -> Optional[bytes]:
+    if not path:
+        return None
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class Payloads:
+    """Request bodies; with BENCH_UNIQUE each request index gets distinct audio, image and text."""
+    def __init__(self):
+        self.audio = read_file(AUDIO_PATH)
+        self.image = read_file(IMAGE_PATH)
+        self._audio: Dict[int, bytes] = {}
+        self._image: Dict[int, bytes] = {}
+
+    def audio_for(self, i: int) -> bytes:
+        if self.audio is not None and not UNIQUE:
+            return self.audio
+        key = i if UNIQUE else 0
+        if key not in self._audio:
+            self._audio[key] = make_wav(1.0, freq=180 + key % 1000)
+        return self._audio[key]
+
+    def image_for(self, i: int) -> bytes:
+        if self.image is not None:
+            return self.image
+        key = i % 256 if UNIQUE else 0
+        if key not in self._image:
+            self._image[key] = make_png(tint=key)
+        return self._image[key]
+
+    def text_for(self, i: int) -> str:
+        phrase = PHRASES[i % len(PHRASES)]
+        return f"{phrase} Request {i}." if UNIQUE else phrase
+
+    def request(self, endpoint: str, i: int) -> dict:
+        headers = {"session-id": f"bench-session-{i % SESSIONS}"}
+        if endpoint == "transcribe":
+            return {"method": "POST", "url": "/transcribe", "headers": headers,
+                    "files": {"audio": ("bench.wav", self.audio_for(i), "audio/wav")}}
+        if endpoint == "speak":
+            return {"method": "POST", "url": "/speak", "headers": headers, "json": {"text": self.text_for(i)}}
+        if endpoint == "generate-avatar":
+            return {"method": "POST", "url": "/generate-avatar", "headers": headers, "files": {
+                "audio": ("bench.wav", self.audio_for(i), "audio/wav"),
+                "image": ("bench.png", self.image_for(i), "image/png"),
+            }}
+        return {"method": "GET", "url": "/" + endpoint.lstrip("/"), "headers": headers}
+
+
+class RssSampler:
+    """Peak RSS of a process, sampled from a background task."""
+    def __init__(self, pid: Optional[int]):
+        self.process = psutil.Process(pid) if pid else None
+        self.start_bytes = self.rss()
+        self.peak_bytes = self.start_bytes
+        self._task: Optional[asyncio.Task] = None
+
+    def rss(self) -> Optional[int]:
+        if self.process is None:
+            return None
+        try:
+            return self.process.memory_info().rss
+        except psutil.Error:
+            return None
+
+    async def _poll(self):
+        while True:
+            rss = self.rss()
+            if rss is not None:
+                self.peak_bytes = max(self.peak_bytes or 0, rss)
+            await asyncio.sleep(RSS_POLL_S)
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._poll())
+
+    async def stop(self) -> dict:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        end = self.rss()
+        mb = lambda b: round(b / 1024 / 1024, 1) if b is not None else None  # noqa: E731
+        return {"pid": self.process.pid if self.process else None, "rss_start_mb": mb(self.start_bytes),
+                "rss_peak_mb": mb(self.peak_bytes), "rss_end_mb": mb(end)}
+
+
+async def timed_request(client: httpx.AsyncClient, payloads: Payloads, i: int, scheduled: float) -> dict:
+    """Send request i; latency runs from scheduled (its intended start) to the last body byte."""
+    endpoint = ENDPOINTS[i % len(ENDPOINTS)]
+    started = time.perf_counter()
+    record = {"index": i, "endpoint": endpoint, "status": None, "error": None}
+    try:
+        async with client.stream(**payloads.request(endpoint, i)) as resp:
+            ttfb = None
+            async for _ in resp.aiter_raw():
+                if ttfb is None:
+                    ttfb = time.perf_counter()
+            record["status"] = resp.status_code
+            record["ttfb_ms"] = round(((ttfb or time.perf_counter()) - scheduled) * 1000, 3)
+    except httpx.HTTPError as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    done = time.perf_counter()
+    record["latency_ms"] = round((done - scheduled) * 1000, 3)
+    record["queued_ms"] = round((started - scheduled) * 1000, 3)
+    return record
+
+
+async def closed_loop(client: httpx.AsyncClient, payloads: Payloads, first: int, count: int) -> List[dict]:
+    results: List[dict] = []
+    next_index = iter(range(first, first + count))
+
+    async def worker():
+        for i in next_index:
+            results.append(await timed_request(client, payloads, i, time.perf_counter()))
+
+    await asyncio.gather(*(worker() for _ in range(min(CONCURRENCY, count))))
+    return results
+
+
+async def open_loop(client: httpx.AsyncClient, payloads: Payloads, first: int, count: int, stats: dict) -> List[dict]:
+    rng = random.Random(SEED)
     start = time.perf_counter()
-    mem_before, gpu_before = await get_memory_gpu_usage()
-    files = {
-        'audio': (AUDIO_PATH, AUDIO_BYTES, 'audio/wav'),
-        'image': (IMAGE_PATH, IMAGE_BYTES, 'image/png')
+    offset = 0.0
+    tasks = []
+    in_flight = 0
+    max_in_flight = 0
+
+    async def run(i: int, scheduled: float):
+        nonlocal in_flight, max_in_flight
+        in_flight += 1
+        max_in_flight = max(max_in_flight, in_flight)
+        try:
+            return await timed_request(client, payloads, i, scheduled)
+        finally:
+            in_flight -= 1
+
+    for i in range(first, first + count):
+        scheduled = start + offset
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(run(i, scheduled)))
+        offset += rng.expovariate(RATE) if ARRIVALS == "poisson" else 1.0 / RATE
+    issued = time.perf_counter() - start
+    results = await asyncio.gather(*tasks)
+    stats.update({"target_rps": RATE, "offered_rps": round(count / issued, 3) if issued > 0 else None,
+                  "max_in_flight": max_in_flight})
+    return list(results)
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """Linearly interpolated percentile (q in [0, 100]) of sorted values."""
+    if not values:
+        return None
+    rank = (len(values) - 1) * q / 100
+    low = int(rank)
+    high = min(low + 1, len(values) - 1)
+    return round(values[low] + (values[high] - values[low]) * (rank - low), 3)
+
+
+def summarize(records: List[dict], duration: float) -> dict:
+    ok = sorted(r["latency_ms"] for r in records if r["error"] is None and r["status"] is not None and r["status"] < 400)
+    ttfb = sorted(r["ttfb_ms"] for r in records if r.get("ttfb_ms") is not None and r["error"] is None)
+    statuses: Dict[str, int] = {}
+    for r in records:
+        key = str(r["status"]) if r["error"] is None else "error"
+        statuses[key] = statuses.get(key, 0) + 1
+    return {
+        "requests": len(records),
+        "ok": len(ok),
+        "errors": len(records) - len(ok),
+        "statuses": dict(sorted(statuses.items())),
+        "throughput_rps": round(len(ok) / duration, 3) if duration > 0 else None,
+        "latency_ms": {
+            "mean": round(sum(ok) / len(ok), 3) if ok else None,
+            "min": ok[0] if ok else None,
+            "p50": percentile(ok, 50),
+            "p95": percentile(ok, 95),
+            "p99": percentile(ok, 99),
+            "max": ok[-1] if ok else None,
+        },
+        "ttfb_ms": {"p50": percentile(ttfb, 50), "p95": percentile(ttfb, 95), "p99": percentile(ttfb, 99)},
     }
-    resp3 = await client.post(f"{API_URL}/generate-avatar", files=files, headers={"session_id": session_id})
-    timings['avatar_latency'] = float(resp3.headers.get('X-Latency', -1))
-    timings['avatar_status'] = resp3.status_code
-    timings['avatar_time'] = time.perf_counter() - start
-    mem_after, gpu_after = await get_memory_gpu_usage()
-    timings['mem_avatar'] = mem_after - mem_before
-    timings['gpu_avatar'] = gpu_after - gpu_before
-    # Total time
-    timings['total_time'] = timings['transcribe_time'] + timings['speak_time'] + timings['avatar_time']
-    timings['user_id'] = user_id
-    results.append(timings)
-    print(f"User {user_id} done: {timings}")
-
-async def main():
-    results = []
-    async with httpx.AsyncClient(timeout=120) as client:
-        tasks = [benchmark_user(client, i, results) for i in range(NUM_REQUESTS)]
-        await asyncio.gather(*tasks)
-    # Output summary
+
+
+def compare(report: dict, baseline: dict) -> Dict[str, Dict[str, Optional[float]]]:
+    """Per-endpoint change in p50/p95/p99 latency (percent) against a baseline report."""
+    changes = {}
+    for name, current in dict(report["endpoints"], overall=report["overall"]).items():
+        before = baseline["endpoints"].get(name) if name != "overall" else baseline.get("overall")
+        if not before:
+            continue
+        changes[name] = {
+            q: round((current["latency_ms"][q] / before["latency_ms"][q] - 1) * 100, 1)
+            if current["latency_ms"][q] and before["latency_ms"][q] else None
+            for q in ("p50", "p95", "p99")
+        }
+    return changes
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def drive(client: httpx.AsyncClient, server_pid: Optional[int]) -> dict:
+    payloads = Payloads()
+    if WARMUP_REQUESTS:
+        # Not measured: first-request costs belong to scripts/cold_start_bench.py
+        await closed_loop(client, payloads, -WARMUP_REQUESTS, WARMUP_REQUESTS)
+    sampler = RssSampler(server_pid)
+    sampler.start()
+    open_stats: dict = {}
+    started = time.perf_counter()
+    if MODE == "open":
+        records = await open_loop(client, payloads, 0, NUM_REQUESTS, open_stats)
+    else:
+        records = await closed_loop(client, payloads, 0, NUM_REQUESTS)
+    duration = time.perf_counter() - started
+    memory = await sampler.stop()
+    records.sort(key=lambda r: r["index"])
+    return {
+        "schema": SCHEMA,
+        "commit": git_commit(),
+        "target": API_URL or "in-process",
+        "config": {
+            "mode": MODE, "concurrency": CONCURRENCY if MODE == "closed" else None,
+            "rate": RATE if MODE == "open" else None, "arrivals": ARRIVALS if MODE == "open" else None,
+            "requests": NUM_REQUESTS, "warmup": WARMUP_REQUESTS, "endpoints": ENDPOINTS, "unique": UNIQUE,
+            "sessions": SESSIONS, "seed": SEED,
+            "stub_models": STUB_MODELS if not API_URL else None,
+            "stub_whisper_ms": STUB_WHISPER_S * 1000 if not API_URL else None,
+            "stub_tts_ms_per_char": STUB_TTS_S_PER_CHAR * 1000 if not API_URL else None,
+        },
+        "duration_s": round(duration, 3),
+        "open_loop": open_stats or None,
+        "server": memory,
+        "overall": summarize(records, duration),
+        "endpoints": {name: summarize([r for r in records if r["endpoint"] == name], duration) for name in ENDPOINTS},
+        "records": records,
+    }
+
+
+async def run_in_process() -> dict:
+    # Start from empty caches so BENCH_UNIQUE=0 measures warm-cache behaviour, not a leftover one
+    os.environ.setdefault("AVATAR_CACHE_DIR", tempfile.mkdtemp(prefix="bench-avatar-cache-"))
+    # The stub can't run Whisper's batched generate; don't make requests wait for batches it would split up
+    if STUB_MODELS.strip().lower() == "all" or "whisper" in STUB_MODELS:
+        os.environ.setdefault("WHISPER_BATCH_SIZE", "1")
+    # Like uvicorn main:app, the app expects to run from the repository root (e.g. for the sample video)
+    os.chdir(ROOT)
+    import main
+    if STUB_MODELS:
+        install_stub_models(stub_names(STUB_MODELS), 0.0, STUB_WHISPER_S, STUB_TTS_S_PER_CHAR)
+    async with main.app.router.lifespan_context(main.app):
+        while not main.models.registry.is_ready(main.models.PRELOAD_MODELS):
+            await asyncio.sleep(0.05)
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=TIMEOUT_S) as client:
+            return await drive(client, os.getpid())
+
+
+async def run_against_server() -> dict:
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=API_URL, timeout=TIMEOUT_S, limits=limits) as client:
+        return await drive(client, int(SERVER_PID) if SERVER_PID else None)
+
+
+def main():
+    load = f"concurrency {CONCURRENCY}" if MODE == "closed" else f"{RATE}/s {ARRIVALS} arrivals"
+    print(f"Benchmarking {NUM_REQUESTS} requests ({MODE} loop, {load}) against {API_URL or 'the app in-process'}...")
+    report = asyncio.run(run_against_server() if API_URL else run_in_process())
+    if BASELINE_JSON:
+        with open(BASELINE_JSON) as f:
+            report["baseline"] = {"file": BASELINE_JSON, "change_pct": compare(report, json.load(f))}
+
     print("\n--- Benchmark Summary ---")
-    for step in ['transcribe_time', 'speak_time', 'avatar_time', 'total_time']:
-        times = [r[step] for r in results if r[step] >= 0]
-        if times:
-            print(f"{step}: avg={mean(times):.2f}s, p50={median(times):.2f}s, p95={quantiles(times, n=100)[94]:.2f}s, max={max(times):.2f}s")
-    # Save to CSV
-    with open(OUTPUT_CSV, 'w', newline='') as csvfile:
-        fieldnames = list(results[0].keys())
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
-        writer.writeheader()
-        writer.writerows(results)
-    # Save to JSON
-    with open(OUTPUT_JSON, 'w') as f:
-        json.dump(results, f, indent=2)
-    print(f"Results saved to {OUTPUT_CSV} and {OUTPUT_JSON}")
+    for name, summary in dict(report["endpoints"], overall=report["overall"]).items():
+        lat = summary["latency_ms"]
+        print(f"{name}: {summary['ok']}/{summary['requests']} ok, {summary['throughput_rps']} req/s, "
+              f"p50={lat['p50']}ms p95={lat['p95']}ms p99={lat['p99']}ms max={lat['max']}ms")
+    if report["server"]["rss_peak_mb"] is not None:
+        print(f"Server RSS: {report['server']['rss_start_mb']} -> peak {report['server']['rss_peak_mb']} MB")
+    if report.get("baseline"):
+        print(f"Change vs {BASELINE_JSON} (%): {json.dumps(report['baseline']['change_pct'])}")
+
+    with open(OUTPUT_JSON, "w") as f:
+        json.dump(report, f, indent=2)
+    if OUTPUT_CSV:
+        with open(OUTPUT_CSV, "w", newline="") as csvfile:
+            fields = ["index", "endpoint", "status", "error", "queued_ms", "ttfb_ms", "latency_ms"]
+            writer = csv.DictWriter(csvfile, fieldnames=fields, extrasaction="ignore")
+            writer.writeheader()
+            writer.writerows(report["records"])
+    print(f"Results saved to {OUTPUT_JSON}" + (f" and {OUTPUT_CSV}" if OUTPUT_CSV else ""))
+
 
 if __name__ == "__main__":
-    print(f"Benchmarking {NUM_REQUESTS} requests with concurrency {CONCURRENCY}...")
-    asyncio.run(main()) 
\ No newline at end of file
+    main()
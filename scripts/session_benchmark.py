@@ -0,0 +1,139 @@
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from typing import Dict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from backend.session_manager import SessionManager  # noqa: E402
+
+# Compares the old single-lock SessionManager (per-touch INFO logging, O(n) cleanup
+# scan) with the sharded one: create N sessions, touch them from several threads,
+# then expire half of them and time the cleanup.
+
+NUM_SESSIONS = int(os.getenv("SESSION_BENCH_SESSIONS", 100000))
+NUM_THREADS = int(os.getenv("SESSION_BENCH_THREADS", 8))
+TOUCHES_PER_THREAD = int(os.getenv("SESSION_BENCH_TOUCHES", 50000))
+OUTPUT_JSON = os.getenv("SESSION_BENCH_JSON", "session_benchmark_results.json")
+
+TIMEOUT = 1800
+
+
+class LegacySessionManager:
+    """The previous implementation: one dict, one lock, time.time() inside the lock, log per event."""
+    def __init__(self):
+        self.sessions: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def create_session(self) -> str:
+        session_id = str(uuid.uuid4())
+        with self.lock:
+            self.sessions[session_id] = time.time()
+        logging.info(f"Session created: {session_id}")
+        return session_id
+
+    def touch_session(self, session_id: str) -> bool:
+        with self.lock:
+            if session_id in self.sessions:
+                if time.time() - self.sessions[session_id] < TIMEOUT:
+                    self.sessions[session_id] = time.time()
+                    logging.info(f"Session used: {session_id}")
+                    return True
+                del self.sessions[session_id]
+                logging.info(f"Session expired: {session_id}")
+        return False
+
+    def cleanup_sessions(self):
+        with self.lock:
+            expired = [sid for sid, ts in self.sessions.items() if time.time() - ts >= TIMEOUT]
+            for sid in expired:
+                del self.sessions[sid]
+                logging.info(f"Session expired (cleanup): {sid}")
+        return len(expired)
+
+    def get_active_sessions(self) -> int:
+        with self.lock:
+            return len(self.sessions)
+
+
+def age_half(manager, ids):
+    """Push half the sessions past their expiry without waiting for real time to pass."""
+    if isinstance(manager, LegacySessionManager):
+        for sid in ids[::2]:
+            manager.sessions[sid] -= TIMEOUT + 1
+        return
+    for sid in ids[::2]:
+        shard = manager._shard(sid)
+        shard.deadlines[sid] -= TIMEOUT + 1
+    # Older heap entries must also be due for the sweeper to look at them
+    for shard in manager._shards:
+        shard.expiry = [(deadline - TIMEOUT - 1, sid) for deadline, sid in shard.expiry]
+
+
+def run(manager) -> Dict[str, float]:
+    start = time.perf_counter()
+    ids = [manager.create_session() for _ in range(NUM_SESSIONS)]
+    create_s = time.perf_counter() - start
+
+    def toucher(seed):
+        rng = random.Random(seed)
+        for _ in range(TOUCHES_PER_THREAD):
+            manager.touch_session(ids[rng.randrange(len(ids))])
+
+    threads = [threading.Thread(target=toucher, args=(i,)) for i in range(NUM_THREADS)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    touch_s = time.perf_counter() - start
+    touches = NUM_THREADS * TOUCHES_PER_THREAD
+
+    start = time.perf_counter()
+    idle_cleanup = manager.cleanup_sessions()
+    idle_cleanup_s = time.perf_counter() - start
+
+    age_half(manager, ids)
+    start = time.perf_counter()
+    removed = manager.cleanup_sessions()
+    cleanup_s = time.perf_counter() - start
+    assert idle_cleanup == 0 and removed == NUM_SESSIONS // 2, (idle_cleanup, removed)
+    assert manager.get_active_sessions() == NUM_SESSIONS - removed
+
+    return {
+        "create_us": round(create_s / NUM_SESSIONS * 1e6, 3),
+        "touch_us": round(touch_s / touches * 1e6, 3),
+        "touches_per_s": round(touches / touch_s),
+        "cleanup_nothing_expired_ms": round(idle_cleanup_s * 1000, 3),
+        "cleanup_half_expired_ms": round(cleanup_s * 1000, 3),
+    }
+
+
+def main():
+    # Measure the cost of the logging calls themselves, not of writing them to a terminal
+    logging.basicConfig(level=logging.INFO, handlers=[logging.NullHandler()], force=True)
+    results = {
+        "legacy": run(LegacySessionManager()),
+        # A long sweep interval keeps the background sweeper out of the measurement
+        "sharded": run(SessionManager(timeout=TIMEOUT, sweep_interval=3600)),
+    }
+    for name, row in results.items():
+        print(f"{name}: create={row['create_us']}us touch={row['touch_us']}us "
+              f"cleanup(none due)={row['cleanup_nothing_expired_ms']}ms "
+              f"cleanup(half due)={row['cleanup_half_expired_ms']}ms")
+    with open(OUTPUT_JSON, "w") as f:
+        json.dump({
+            "sessions": NUM_SESSIONS,
+            "threads": NUM_THREADS,
+            "touches_per_thread": TOUCHES_PER_THREAD,
+            "results": results,
+        }, f, indent=2)
+    print(f"Results saved to {OUTPUT_JSON}")
+
+
+if __name__ == "__main__":
+    main()
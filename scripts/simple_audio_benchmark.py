@@ -0,0 +1,98 @@
+import json
+import os
+import struct
+import sys
+import time
+from statistics import mean, median
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from backend import speak, wav  # noqa: E402
+
+# Compares the old per-sample generate_simple_audio loop with the vectorized
+# fallback generator, and the old concat-based WAV encode with wav.encode.
+# Times are also reported per second of generated audio, since the new
+# fallback's length follows the text while the old one was always 1 s.
+
+NUM_RUNS = int(os.getenv("SIMPLE_AUDIO_BENCH_RUNS", 50))
+SAMPLE_RATE = int(os.getenv("SIMPLE_AUDIO_BENCH_RATE", 22050))
+OUTPUT_JSON = os.getenv("SIMPLE_AUDIO_BENCH_JSON", "simple_audio_benchmark_results.json")
+
+TEXTS = {
+    "short": "Hello!",
+    "sentence": "Thanks for calling, how can I help you with your order today?",
+    "paragraph": " ".join(["The quick brown fox jumps over the lazy dog."] * 5),
+}
+
+
+def legacy_simple_audio(text: str, sample_rate: int = 22050) -> bytes:
+    """The previous fallback: fixed 1 s, Python loop per sample, struct.pack splat."""
+    num_samples = int(sample_rate * 1.0)
+    audio_data = []
+    for i in range(num_samples):
+        audio_data.append(int(32767 * 0.3 * (i % 2)))
+    audio_bytes = struct.pack(f'<{len(audio_data)}h', *audio_data)
+    return wav.header(sample_rate, len(audio_bytes)) + audio_bytes
+
+
+def legacy_encode(audio, sample_rate: int) -> bytes:
+    """The previous encode_wav: convert, then concatenate header + PCM."""
+    samples = np.clip(np.asarray(audio, dtype=np.float32).ravel(), -1.0, 1.0)
+    pcm = (samples * 32767).astype("<i2").tobytes()
+    return wav.header(sample_rate, len(pcm)) + pcm
+
+
+def time_runs(fn):
+    times = []
+    for _ in range(NUM_RUNS):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return {"mean_ms": mean(times) * 1000, "p50_ms": median(times) * 1000, "max_ms": max(times) * 1000}
+
+
+def per_audio_second(timing, wav_bytes: bytes) -> float:
+    seconds = (len(wav_bytes) - wav.HEADER_SIZE) / 2 / SAMPLE_RATE
+    return round(timing["mean_ms"] / seconds, 4)
+
+
+def main():
+    results = {"simple_audio": {}, "encode": {}}
+    for name, text in TEXTS.items():
+        old = legacy_simple_audio(text, SAMPLE_RATE)
+        new = speak.generate_simple_audio(text, SAMPLE_RATE)
+        row = {
+            "chars": len(text),
+            "legacy": time_runs(lambda: legacy_simple_audio(text, SAMPLE_RATE)),
+            "vectorized": time_runs(lambda: speak.generate_simple_audio(text, SAMPLE_RATE)),
+            "legacy_audio_s": round((len(old) - wav.HEADER_SIZE) / 2 / SAMPLE_RATE, 2),
+            "vectorized_audio_s": round((len(new) - wav.HEADER_SIZE) / 2 / SAMPLE_RATE, 2),
+        }
+        row["legacy_ms_per_audio_s"] = per_audio_second(row["legacy"], old)
+        row["vectorized_ms_per_audio_s"] = per_audio_second(row["vectorized"], new)
+        row["speedup_per_audio_s"] = round(row["legacy_ms_per_audio_s"] / row["vectorized_ms_per_audio_s"], 1)
+        results["simple_audio"][name] = row
+        print(f"simple_audio/{name}: legacy={row['legacy']['mean_ms']:.2f}ms ({row['legacy_audio_s']}s) "
+              f"vectorized={row['vectorized']['mean_ms']:.2f}ms ({row['vectorized_audio_s']}s) "
+              f"speedup/audio-s={row['speedup_per_audio_s']}x")
+
+    for seconds in (1, 10):
+        audio = (0.5 * np.sin(np.arange(SAMPLE_RATE * seconds) * 0.05)).astype(np.float32)
+        assert legacy_encode(audio, SAMPLE_RATE) == wav.encode(audio, SAMPLE_RATE)
+        row = {
+            "legacy": time_runs(lambda: legacy_encode(audio, SAMPLE_RATE)),
+            "preallocated": time_runs(lambda: wav.encode(audio, SAMPLE_RATE)),
+        }
+        row["speedup"] = round(row["legacy"]["mean_ms"] / row["preallocated"]["mean_ms"], 2)
+        results["encode"][f"{seconds}s"] = row
+        print(f"encode/{seconds}s: legacy={row['legacy']['mean_ms']:.3f}ms "
+              f"preallocated={row['preallocated']['mean_ms']:.3f}ms speedup={row['speedup']}x")
+
+    with open(OUTPUT_JSON, "w") as f:
+        json.dump({"runs": NUM_RUNS, "sample_rate": SAMPLE_RATE, "results": results}, f, indent=2)
+    print(f"Results saved to {OUTPUT_JSON}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The benchmark stubs (scripts/bench_stubs.py) stand in for models in the tests
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
@@ -0,0 +1,52 @@
+import threading
+
+import pytest
+
+from bench_stubs import install_stub_models, stub_names
+from backend.executor import QueueFullError, StageExecutor, get_stage
+
+
+def fill(stage: StageExecutor, release: threading.Event):
+    """Occupy every worker and queue slot of stage until release is set."""
+    return [stage.submit(release.wait) for _ in range(stage.max_workers + stage.max_queue)]
+
+
+def test_full_stage_rejects():
+    stage = StageExecutor("test", max_workers=1, max_queue=1)
+    release = threading.Event()
+    futures = fill(stage, release)
+    try:
+        with pytest.raises(QueueFullError) as raised:
+            stage.submit(lambda: None)
+        assert raised.value.stage == "test"
+        assert raised.value.retry_after >= 1
+        assert stage.stats()["rejected"] == 1
+    finally:
+        release.set()
+    for future in futures:
+        future.result(timeout=5)
+    # Finished jobs give their slots back
+    assert stage.submit(lambda: 42).result(timeout=5) == 42
+    assert stage.stats()["completed"] == len(futures) + 1
+
+
+def test_full_stage_returns_503():
+    from fastapi.testclient import TestClient
+    import main
+
+    # The app's startup preload then loads the stubs instead of real weights
+    install_stub_models(stub_names("all"))
+    stage = get_stage("speak")
+    release = threading.Event()
+    with TestClient(main.app) as client:
+        futures = fill(stage, release)
+        try:
+            response = client.post("/speak", json={"text": "hello"}, headers={"session-id": "queue-full-test"})
+        finally:
+            release.set()
+        for future in futures:
+            future.result(timeout=5)
+    assert response.status_code == 503
+    assert response.json()["stage"] == "speak"
+    assert int(response.headers["Retry-After"]) >= 1
+    assert response.headers["X-Session-ID"]
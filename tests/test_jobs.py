@@ -0,0 +1,153 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+
+from bench_stubs import make_wav
+from backend import avatar
+from backend.executor import StageExecutor
+from backend.jobs import CANCELLED, DONE, QUEUED, JobQueue, SessionJobLimitError
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def wait_for(predicate, timeout: float = 5.0):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def queue():
+    # One worker, and a sweep interval long enough that only the tests sweep
+    return JobQueue(StageExecutor("test-jobs", 1, 8), workers=1, abandon_after=0, sweep_interval=3600)
+
+
+def test_priority_then_session_round_robin(queue):
+    release = threading.Event()
+    started = threading.Event()
+    order = []
+
+    def blocker(job):
+        started.set()
+        release.wait(5)
+
+    def record(name):
+        return lambda job: order.append(name)
+
+    queue.submit("blocker", blocker)
+    started.wait(5)
+    jobs = {
+        "a1": queue.submit("a", record("a1")),
+        "a2": queue.submit("a", record("a2")),
+        "a3": queue.submit("a", record("a3")),
+        "b1": queue.submit("b", record("b1")),
+        "low": queue.submit("c", record("low"), priority="low"),
+        "high": queue.submit("c", record("high"), priority="high"),
+    }
+    expected = ["high", "a1", "b1", "a2", "a3", "low"]
+    assert [queue.position(jobs[name]) for name in expected] == list(range(len(expected)))
+    release.set()
+    wait_for(lambda: all(job.state == DONE for job in jobs.values()))
+    assert order == expected
+
+
+def test_session_job_limit(queue):
+    release = threading.Event()
+    queue.max_per_session = 2
+    queue.submit("a", lambda job: release.wait(5))
+    queue.submit("a", lambda job: None)
+    with pytest.raises(SessionJobLimitError):
+        queue.submit("a", lambda job: None)
+    release.set()
+
+
+def test_abandoned_job_is_cancelled(queue):
+    release = threading.Event()
+    started = threading.Event()
+
+    def blocker(job):
+        started.set()
+        release.wait(5)
+
+    queue.abandon_after = 0.05
+    queue.submit("blocker", blocker).watchers = 1
+    started.wait(5)
+    finished = []
+    unwatched = queue.submit("a", lambda job: None, on_finish=finished.append)
+    streamed = queue.submit("b", lambda job: None)
+    # Streaming the job's video counts as watching it
+    streamed.watched_at = time.monotonic
+    time.sleep(0.1)
+    assert queue.sweep() == 1
+    assert unwatched.state == CANCELLED
+    assert unwatched.error.startswith("abandoned")
+    assert finished == [unwatched]
+    assert streamed.state == QUEUED
+    release.set()
+    wait_for(lambda: streamed.state == DONE)
+    assert queue.stats()["abandoned"] == 1
+
+
+def render_in_thread(key, audio, cancel, outcome, on_start=None):
+    def run():
+        try:
+            outcome["path"], _ = avatar.generate_avatar(audio, None, key=key, on_start=on_start, cancel=cancel)
+        except BaseException as e:
+            outcome["error"] = e
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+@pytest.fixture
+def slow_render(monkeypatch):
+    # The placeholder renderer reads the sample clip relative to the repo root
+    monkeypatch.chdir(ROOT)
+    # 50 frames over 2 s: well past the 0.5 s a sharing caller takes to notice its cancel
+    monkeypatch.setattr(avatar, "PLACEHOLDER_RENDER_FPS", 25)
+    return make_wav(2.0)
+
+
+def test_shared_render_survives_one_cancel(slow_render):
+    key = f"test-{uuid.uuid4().hex}"
+    rendering = threading.Event()
+    first_cancel, second_cancel = threading.Event(), threading.Event()
+    first, second = {}, {}
+    first_thread = render_in_thread(key, slow_render, first_cancel, first, lambda live: rendering.set())
+    rendering.wait(5)
+    second_thread = render_in_thread(key, slow_render, second_cancel, second)
+    wait_for(lambda: avatar.live_videos.get(key) is not None and avatar.live_videos.get(key).consumers == 2)
+    first_cancel.set()
+    first_thread.join(10)
+    second_thread.join(10)
+    # The caller that started the render gave up, but kept rendering for the other one
+    assert isinstance(first.get("error"), avatar.RenderCancelled)
+    assert "error" not in second
+    assert os.path.exists(second["path"])
+
+
+def test_cancelling_last_consumer_stops_render(slow_render):
+    key = f"test-{uuid.uuid4().hex}"
+    rendering = threading.Event()
+    first_cancel, second_cancel = threading.Event(), threading.Event()
+    first, second = {}, {}
+    stopped = avatar.live_videos.stats()["stopped"]
+    first_thread = render_in_thread(key, slow_render, first_cancel, first, lambda live: rendering.set())
+    rendering.wait(5)
+    live = avatar.live_videos.get(key)
+    second_thread = render_in_thread(key, slow_render, second_cancel, second)
+    wait_for(lambda: live.consumers == 2)
+    second_cancel.set()
+    second_thread.join(10)
+    assert not live.stop.is_set()
+    first_cancel.set()
+    first_thread.join(10)
+    assert live.stop.is_set()
+    assert isinstance(first.get("error"), avatar.RenderCancelled)
+    assert isinstance(second.get("error"), avatar.RenderCancelled)
+    assert avatar.live_videos.stats()["stopped"] == stopped + 1
+    assert avatar.video_cache.get_path(key) is None
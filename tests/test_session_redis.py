@@ -0,0 +1,88 @@
+import time
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+
+from backend.session_manager import SessionManager, SessionStore
+from backend.session_redis import RedisSessionStore
+from backend.session_state import session_states
+
+
+@pytest.fixture
+def redis_store():
+    # refresh_after=0 sends every touch to Redis instead of accepting it locally
+    return RedisSessionStore(client=fakeredis.FakeRedis(), timeout=60, refresh_after=0)
+
+
+def test_session_store_is_abstract():
+    with pytest.raises(TypeError):
+        SessionStore()
+
+
+def test_redis_create_and_touch(redis_store):
+    sid = redis_store.create_session()
+    assert redis_store.client.exists(redis_store.prefix + sid)
+    assert redis_store.touch_session(sid)
+    assert not redis_store.touch_session("no-such-session")
+    assert redis_store.touched == 1
+
+
+def test_redis_touch_refreshes_ttl(redis_store):
+    sid = redis_store.create_session()
+    key = redis_store.prefix + sid
+    redis_store.client.expire(key, 5)
+    assert redis_store.touch_session(sid)
+    assert redis_store.client.ttl(key) > 5
+
+
+def test_redis_expired_session_is_rejected(redis_store):
+    sid = redis_store.create_session()
+    session_states.set_voice(sid, "v2/en_speaker_1", "bark", None)
+    # Redis expiring the key is what ends a session
+    redis_store.client.delete(redis_store.prefix + sid)
+    assert not redis_store.touch_session(sid)
+    assert session_states.get(sid) is None
+
+
+def test_redis_local_touches_are_flushed():
+    store = RedisSessionStore(client=fakeredis.FakeRedis(), timeout=60, refresh_after=30)
+    sid = store.create_session()
+    key = store.prefix + sid
+    store.client.expire(key, 5)
+    assert store.touch_session(sid)
+    assert store.local_touches == 1
+    assert store.client.ttl(key) <= 5
+    assert store.cleanup_sessions() == 0
+    assert store.client.ttl(key) > 5
+
+
+def test_redis_active_sessions(redis_store):
+    sids = [redis_store.create_session() for _ in range(3)]
+    redis_store.client.set("unrelated", 1)
+    assert redis_store.get_active_sessions() == 3
+    redis_store.client.delete(redis_store.prefix + sids[0])
+    assert redis_store.get_active_sessions() == 2
+    assert redis_store.stats()["active"] == 2
+
+
+def test_memory_create_touch_expire():
+    store = SessionManager(timeout=0.05, shards=4, sweep_interval=3600)
+    sid = store.create_session()
+    assert store.touch_session(sid)
+    assert not store.touch_session("no-such-session")
+    assert store.get_active_sessions() == 1
+    time.sleep(0.1)
+    assert not store.touch_session(sid)
+    assert store.get_active_sessions() == 0
+
+
+def test_memory_cleanup_removes_expired():
+    store = SessionManager(timeout=0.05, shards=4, sweep_interval=3600)
+    expired = [store.create_session() for _ in range(5)]
+    time.sleep(0.1)
+    store.timeout = 60
+    live = store.create_session()
+    assert store.cleanup_sessions() == len(expired)
+    assert store.get_active_sessions() == 1
+    assert store.touch_session(live)